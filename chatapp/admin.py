@@ -1,22 +1,126 @@
+from asgiref.sync import async_to_sync
 from django.contrib import admin
-from .models import ChatRoom, Message, MediaFile, CallRecording
+from django.contrib.auth import get_user_model
+from django.contrib.auth.admin import UserAdmin
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count
+from .message_ops import delete_in_batches, publish_deletion
+from .models import ArchivedPartition, ChatRoom, Message, MediaBlob, MediaFile, CallRecording
+from .room_summary import recount_room
+
+User = get_user_model()
+
+
+def _delete_messages(request, messages, summary=None):
+    """
+    Batched delete (see message_ops.py). Returns the number deleted.
+
+    Under ASGI the affected rooms are told: with the `summary` frame once
+    at the end if given, else with a messages_deleted frame per batch.
+    Otherwise open pages only catch up once their cached messages expire.
+    """
+    notify = isinstance(request, ASGIRequest)
+    names = {}
+    count = 0
+    for batch in delete_in_batches(messages):
+        count += sum(len(ids) for ids in batch.values())
+        if not notify:
+            continue
+        missing = set(batch) - set(names)
+        if missing:
+            names.update(ChatRoom.objects.filter(id__in=missing).values_list("id", "name"))
+        if summary is None:
+            for room_id, ids in batch.items():
+                frame = {"type": "messages_deleted", "message_ids": ids, "username": request.user.username}
+                async_to_sync(publish_deletion)(room_id, names[room_id], frame)
+
+    if summary is not None:
+        for room_id, name in names.items():
+            async_to_sync(publish_deletion)(room_id, name, summary)
+    return count
+
 
 @admin.register(ChatRoom)
 class ChatRoomAdmin(admin.ModelAdmin):
-    list_display = ("id", "name", "created_at")
+    list_display = ("id", "name", "message_count", "last_message_at", "created_at")
+    actions = ["clear_messages", "recount"]
+
+    @admin.action(description="Delete all messages of the selected rooms")
+    def clear_messages(self, request, queryset):
+        count = 0
+        for room in queryset:
+            count += _delete_messages(
+                request,
+                Message.objects.filter(room_id=room.id),
+                summary={"type": "room_cleared", "username": request.user.username},
+            )
+        self.message_user(request, f"Deleted {count} messages.")
+
+    @admin.action(description="Recount messages and unread counts of the selected rooms")
+    def recount(self, request, queryset):
+        for room_id in queryset.values_list("id", flat=True):
+            recount_room(room_id)
+        self.message_user(request, "Recounted.")
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ("id", "room", "user", "timestamp")
     list_filter = ("room", "timestamp")
+    actions = ["delete_batched"]
+
+    @admin.action(description="Delete selected messages (batched, without loading them)")
+    def delete_batched(self, request, queryset):
+        count = _delete_messages(request, queryset)
+        self.message_user(request, f"Deleted {count} messages.")
 
 @admin.register(MediaFile)
 class MediaFileAdmin(admin.ModelAdmin):
     list_display = ("id", "message", "file_url", "media_type", "name", "uploaded_at")
     list_filter = ("media_type", "uploaded_at")
 
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ("id", "path", "size", "ref_count", "archived", "created_at", "last_used_at")
+    search_fields = ("sha256",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            media_refs=Count("media_files", distinct=True),
+            call_refs=Count("call_recordings", distinct=True),
+        )
+
+    @admin.display(description="References")
+    def ref_count(self, obj):
+        return obj.media_refs + obj.call_refs
+
+@admin.register(ArchivedPartition)
+class ArchivedPartitionAdmin(admin.ModelAdmin):
+    list_display = ("name", "range_start", "range_end", "message_count", "archived_at")
+    readonly_fields = ("name", "range_start", "range_end", "message_count", "room_counts", "archived_at")
+
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(CallRecording)
 class CallRecordingAdmin(admin.ModelAdmin):
     list_display = ("id", "caller", "receiver", "room_name", "file_url", "duration", "started_at", "ended_at")
     list_filter = ("started_at", "ended_at", "caller", "receiver")
     search_fields = ("caller", "receiver", "room_name")
+
+admin.site.unregister(User)
+
+@admin.register(User)
+class ChatUserAdmin(UserAdmin):
+    actions = ["purge_messages"]
+
+    @admin.action(description="Delete all messages of the selected users")
+    def purge_messages(self, request, queryset):
+        count = 0
+        for user in queryset:
+            count += _delete_messages(
+                request,
+                Message.objects.filter(user_id=user.id),
+                summary={"type": "user_purged", "username": user.username},
+            )
+        self.message_user(request, f"Deleted {count} messages.")
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class ChatappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chatapp"
+
+    def ready(self):
+        from . import metrics, signals  # noqa: F401 (metrics hooks every new db connection)
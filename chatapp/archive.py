@@ -0,0 +1,288 @@
+# chatapp/archive.py
+"""
+Cold storage for months of messages past the retention horizon.
+
+`manage.py archive_messages` exports a month partition (see
+partitions.py) to one gzipped JSONL file per room,
+
+    MESSAGE_ARCHIVE["DIR"]/chatapp_message_y2025m03/room_12.jsonl.gz
+
+each line a message in the shape history.serialize_message() gives it,
+oldest first. The file is a series of gzip members of MEMBER_MESSAGES
+lines (still one valid gzip file); room_12.idx.json lists where each
+member starts and its first message, so a history page decompresses only
+the members it needs. The export then detaches and drops the partition in the same
+transaction. An ArchivedPartition row records what was moved and how
+many messages of each room. The MediaFile rows of those messages go too;
+their blobs are flagged `archived` so gc_media_blobs keeps the files the
+archived messages link to.
+
+history.fetch_page() continues here once a page runs past the oldest
+message still in the database, so scrolling up reads through into the
+archive without the client noticing. Archived messages can no longer be
+edited, deleted or found by search. Room message counts keep including
+them (recount_room() adds them back in).
+"""
+import gzip
+import json
+import os
+import shutil
+import time
+from collections import deque
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import frames
+from .models import ArchivedPartition, MediaBlob, MediaFile, Message
+
+EXPORT_BATCH = 2000
+
+# Messages per gzip member of a room file; a history page reads one or two
+MEMBER_MESSAGES = 500
+
+EXPORT_SQL = """
+SELECT m.room_id, m.id, m."timestamp", m.content, u.username,
+       (SELECT json_agg(json_build_object(
+                   'type', f.media_type, 'url', f.file_url, 'name', f.name, 'duration', f.duration,
+                   'thumb', b.thumbnail_path, 'preview', b.preview_path) ORDER BY f.id)
+        FROM {media} f LEFT JOIN {blobs} b ON b.id = f.blob_id
+        WHERE f.message_id = m.id)
+FROM {partition} m LEFT JOIN {users} u ON u.id = m.user_id
+ORDER BY m.room_id, m."timestamp", m.id
+"""
+
+ARCHIVE_BLOBS_SQL = """
+UPDATE {blobs} SET archived = true
+WHERE id IN (SELECT f.blob_id FROM {media} f JOIN {partition} m ON m.id = f.message_id)
+"""
+
+DELETE_MEDIA_SQL = "DELETE FROM {media} WHERE message_id IN (SELECT id FROM {partition})"
+
+
+def _sql(template, partition):
+    quote = connection.ops.quote_name
+    return template.format(
+        partition=quote(partition),
+        media=quote(MediaFile._meta.db_table),
+        blobs=quote(MediaBlob._meta.db_table),
+        users=quote(Message._meta.get_field("user").related_model._meta.db_table),
+    )
+
+
+def archive_dir():
+    return settings.MESSAGE_ARCHIVE["DIR"]
+
+
+def room_file(name, room_id):
+    return archive_dir() / name / f"room_{room_id}.jsonl.gz"
+
+
+def index_file(name, room_id):
+    return archive_dir() / name / f"room_{room_id}.idx.json"
+
+
+# ---------------------------------------
+# EXPORT
+# ---------------------------------------
+def _payload(msg_id, timestamp, content, username, media):
+    """history.serialize_message() from a row of EXPORT_SQL."""
+    payload = {"message_id": msg_id, "username": username, "timestamp": timestamp.isoformat()}
+    if content:
+        payload["message"] = content
+
+    attachments = []
+    for m in media or []:
+        attachment = {"type": m["type"], "url": m["url"], "name": m["name"], "duration": m["duration"]}
+        if m["thumb"]:
+            attachment["thumb"] = settings.MEDIA_URL + m["thumb"]
+        if m["preview"]:
+            attachment["preview"] = settings.MEDIA_URL + m["preview"]
+        attachments.append(attachment)
+    if attachments:
+        payload["attachments"] = attachments
+    return payload
+
+
+class _RoomWriter:
+    """One room file of an export, with its member index."""
+
+    def __init__(self, directory, room_id):
+        self.path = directory / f"room_{room_id}.jsonl.gz"
+        self.index_path = directory / f"room_{room_id}.idx.json"
+        self.file = open(self.path, "wb")
+        self.member = None
+        self.members = []  # [offset, first timestamp, first id]
+        self.count = 0
+
+    def write(self, payload):
+        if self.count % MEMBER_MESSAGES == 0:
+            if self.member is not None:
+                self.member.close()  # writes its trailer, not the file
+            self.members.append([self.file.tell(), payload["timestamp"], payload["message_id"]])
+            self.member = gzip.GzipFile(fileobj=self.file, mode="wb")
+        self.member.write((frames.encode(payload) + "\n").encode("utf-8"))
+        self.count += 1
+
+    def close(self):
+        if self.member is not None:
+            self.member.close()
+        self.file.close()
+        with open(self.index_path, "w", encoding="utf-8") as f:
+            json.dump(self.members, f)
+
+
+def _export(partition, directory):
+    """Write the partition's rooms to `directory`. Returns {room id: messages}."""
+    counts = {}
+    out, room = None, None
+    cursor = connection.chunked_cursor()
+    try:
+        cursor.execute(_sql(EXPORT_SQL, partition))
+        while rows := cursor.fetchmany(EXPORT_BATCH):
+            for room_id, *row in rows:
+                if room_id != room:
+                    if out is not None:
+                        out.close()
+                    room = room_id
+                    out = _RoomWriter(directory, room_id)
+                    counts[room_id] = 0
+                out.write(_payload(*row))
+                counts[room_id] += 1
+    finally:
+        if out is not None:
+            out.close()
+        cursor.close()
+
+    for path in directory.iterdir():
+        with open(path, "rb") as f:
+            os.fsync(f.fileno())
+    return counts
+
+
+def archive_partition(name, range_start, range_end, keep_table=False):
+    """
+    Export partition `name` and detach it, dropping it unless
+    `keep_table`. Returns the ArchivedPartition.
+    """
+    quote = connection.ops.quote_name
+    final = archive_dir() / name
+    partial = archive_dir() / f"{name}.partial"
+    # Left over from a run that did not commit
+    shutil.rmtree(partial, ignore_errors=True)
+    partial.mkdir(parents=True)
+
+    try:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Edits and deletes of these messages wait; new messages go to other partitions
+                cursor.execute(f"LOCK TABLE {quote(name)} IN SHARE MODE")
+            counts = _export(name, partial)
+
+            with connection.cursor() as cursor:
+                cursor.execute(_sql(ARCHIVE_BLOBS_SQL, name))
+                cursor.execute(_sql(DELETE_MEDIA_SQL, name))
+                cursor.execute(f"ALTER TABLE {quote(Message._meta.db_table)} DETACH PARTITION {quote(name)}")
+                if not keep_table:
+                    cursor.execute(f"DROP TABLE {quote(name)}")
+
+            archived = ArchivedPartition.objects.create(
+                name=name,
+                range_start=range_start,
+                range_end=range_end,
+                message_count=sum(counts.values()),
+                room_counts={str(room_id): count for room_id, count in counts.items()},
+            )
+            # Last, so a failure before the commit leaves no files claiming to be the archive
+            shutil.rmtree(final, ignore_errors=True)
+            os.replace(partial, final)
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    return archived
+
+
+def archived_count(room_id):
+    """Messages of a room in the archive."""
+    key = str(room_id)
+    return sum(p.room_counts[key] for p in ArchivedPartition.objects.filter(room_counts__has_key=key))
+
+
+# ---------------------------------------
+# READS (history fallback)
+# ---------------------------------------
+_index = (float("-inf"), [])
+
+
+def _archived_partitions():
+    """[(name, range_start, room ids)] newest first; reloaded every INDEX_TTL seconds."""
+    global _index
+    loaded_at, partitions = _index
+    if time.monotonic() - loaded_at > settings.MESSAGE_ARCHIVE["INDEX_TTL"]:
+        partitions = [
+            (p.name, p.range_start, {int(room_id) for room_id in p.room_counts})
+            for p in ArchivedPartition.objects.order_by("-range_start")
+        ]
+        _index = (time.monotonic(), partitions)
+    return partitions
+
+
+def _key(message):
+    return datetime.fromisoformat(message["timestamp"]), message["message_id"]
+
+
+def _read_before(name, room_id, before, limit):
+    """
+    Up to `limit` payloads of one room file older than `before`, newest
+    first. Decompresses only the members holding them, newest first.
+    """
+    try:
+        with open(index_file(name, room_id), encoding="utf-8") as f:
+            members = json.load(f)
+    except FileNotFoundError:
+        return _stream_before(name, room_id, before, limit)
+
+    found = []
+    with open(room_file(name, room_id), "rb") as f:
+        ends = [offset for offset, _, _ in members[1:]] + [os.fstat(f.fileno()).st_size]
+        for (offset, timestamp, msg_id), end in reversed(list(zip(members, ends))):
+            if before is not None and (datetime.fromisoformat(timestamp), msg_id) >= before:
+                continue
+            f.seek(offset)
+            lines = gzip.decompress(f.read(end - offset)).decode("utf-8").splitlines()
+            for line in reversed(lines):
+                message = frames.decode(line)
+                if before is not None and _key(message) >= before:
+                    continue
+                found.append(message)
+                if len(found) == limit:
+                    return found
+    return found
+
+
+def _stream_before(name, room_id, before, limit):
+    """_read_before() for a room file archived without an index: read up to `before`."""
+    kept = deque(maxlen=limit)
+    with gzip.open(room_file(name, room_id), "rt", encoding="utf-8") as f:
+        for line in f:
+            message = frames.decode(line)
+            if before is not None and _key(message) >= before:
+                break
+            kept.append(message)
+    return list(reversed(kept))
+
+
+def fetch_before(room_id, before=None, limit=50):
+    """
+    Archived messages of a room older than `before`, a (timestamp, id)
+    pair or None for the newest, as serialized payloads, newest first.
+    """
+    found = []
+    for name, range_start, rooms in _archived_partitions():
+        if room_id not in rooms or (before is not None and range_start > before[0]):
+            continue
+        found.extend(_read_before(name, room_id, before, limit - len(found)))
+        if len(found) == limit:
+            break
+    return found
@@ -0,0 +1,119 @@
+# chatapp/async_views.py
+"""
+Helpers for async views.
+
+Django 4.2's login_required, csrf_exempt and require_http_methods wrap
+the view in a sync function: Django would then run an async view in a
+thread and get an unawaited coroutine back. These are async equivalents.
+
+request.user and request.POST / request.FILES are computed lazily by
+blocking code (a session and user lookup, multipart parsing that spools
+large files to disk), so async views resolve them with the helpers here
+instead of touching them on the event loop. Before any of that, the
+ASGIHandler below spools the request body without blocking the loop.
+"""
+import tempfile
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import RequestAborted, RequestDataTooBig
+from django.core.handlers import asgi
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from .blocking_io import run_blocking
+from .metrics import database_sync_to_async
+
+# Multipart framing and form fields sent along with a file
+FORM_OVERHEAD = 1024 * 1024
+
+
+async def is_authenticated(request):
+    """Loads request.user off the event loop; afterwards it is cached on the request."""
+    return await database_sync_to_async(lambda: request.user.is_authenticated)()
+
+
+async def read_form(request, upload_handlers=None):
+    """
+    Parses the request body on the blocking I/O pool, with `upload_handlers`
+    instead of the default ones if given. Returns (POST, FILES).
+    """
+    if upload_handlers is not None:
+        request.upload_handlers = upload_handlers
+    return await run_blocking(lambda: (request.POST, request.FILES))
+
+
+def login_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await is_authenticated(request):
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def csrf_exempt(view):
+    view.csrf_exempt = True
+    return view
+
+
+def require_http_methods(methods):
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    Django's handler writes the request body to its spool file on the event
+    loop; past FILE_UPLOAD_MAX_MEMORY_SIZE that is a disk write per body
+    message, stalling every WebSocket of the process while an upload
+    arrives. Here those writes go to the blocking I/O pool.
+
+    Bodies larger than any upload may be are refused before they are
+    spooled when Content-Length announces them, otherwise as soon as
+    the limit is passed.
+    """
+
+    async def handle(self, scope, receive, send):
+        max_body = settings.MAX_UPLOAD_SIZE + FORM_OVERHEAD
+        headers = dict(scope.get("headers") or ())
+        try:
+            too_large = int(headers.get(b"content-length", 0)) > max_body
+        except ValueError:
+            too_large = False
+        try:
+            if too_large:
+                raise RequestDataTooBig()
+            await super().handle(scope, receive, send)
+        except RequestDataTooBig:  # only read_body() lets it through
+            await self.send_response(JsonResponse({"error": "File too large"}, status=413), send)
+
+    async def read_body(self, receive):
+        max_size = settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        body_file = tempfile.SpooledTemporaryFile(max_size=max_size, mode="w+b")
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    raise RequestAborted()
+                body = message.get("body")
+                if body:
+                    if body_file.tell() + len(body) > settings.MAX_UPLOAD_SIZE + FORM_OVERHEAD:
+                        raise RequestDataTooBig()
+                    if body_file.tell() + len(body) > max_size:
+                        await run_blocking(body_file.write, body)  # on disk, or rolling over to it
+                    else:
+                        body_file.write(body)
+                if not message.get("more_body", False):
+                    break
+        except BaseException:
+            body_file.close()
+            raise
+        body_file.seek(0)
+        return body_file
@@ -0,0 +1,101 @@
+# chatapp/benchmarks.py
+"""
+Helpers shared by the bench_* management commands.
+
+Each run is appended as one JSON line to BENCHMARK_DIR/<name>.jsonl,
+together with the parameters it ran with. compare() finds the previous run
+with the same parameters, so numbers are only ever compared like for like.
+"""
+import json
+import platform
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (0 when empty)."""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class QueryCounter:
+    """
+    Counts SQL statements on every database connection, including the ones
+    opened later by sync_to_async worker threads.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self._wrapped = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _install(self, connection, **kwargs):
+        if id(connection) not in self._wrapped:
+            self._wrapped.add(id(connection))
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        connection_created.connect(self._install, weak=False)
+        for connection in connections.all(initialized_only=True):
+            self._install(connection)
+        return self
+
+    def __exit__(self, *exc):
+        connection_created.disconnect(self._install)
+
+
+def save_result(name, params, metrics):
+    """Append a run to the benchmark history. Returns the stored entry."""
+    entry = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "params": params,
+        "metrics": metrics,
+    }
+    settings.BENCHMARK_DIR.mkdir(parents=True, exist_ok=True)
+    with open(settings.BENCHMARK_DIR / f"{name}.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+    return entry
+
+
+def previous_result(name, params):
+    """The last stored run of `name` with identical params, or None."""
+    path = settings.BENCHMARK_DIR / f"{name}.jsonl"
+    if not path.exists():
+        return None
+    previous = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry["params"] == params:
+                previous = entry
+    return previous
+
+
+def compare(previous, metrics, higher_is_better, tolerance=0.10):
+    """
+    [(metric, old, new, change, regressed)] for the metrics both runs have.
+    A metric regresses when it moves the wrong way by more than `tolerance`.
+    """
+    rows = []
+    for key, new in metrics.items():
+        old = previous["metrics"].get(key)
+        if not isinstance(new, (int, float)) or not old:
+            continue
+        change = (new - old) / old
+        worse = -change if key in higher_is_better else change
+        rows.append((key, old, new, change, worse > tolerance))
+    return rows
@@ -0,0 +1,62 @@
+# chatapp/blocking_io.py
+"""
+Thread pool for the blocking work of async views: spooling and hashing
+uploads, writing chunks, moving files into the media store.
+
+Sync views held a thread for the whole request, however long the upload
+took to write, and every in-flight upload added one more thread
+contending with the WebSocket consumers' database work. Async views
+instead hand just the blocking calls to this pool, sized on its own with
+settings.BLOCKING_IO_WORKERS, so heavy upload traffic queues here
+instead of spreading across the server.
+
+Like database_sync_to_async, run_blocking() closes stale database
+connections around each call, so the work may use the ORM.
+"""
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .metrics import blocking_io_execute_seconds, blocking_io_wait_seconds
+from .profiling import current_trace
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(
+            max_workers=settings.BLOCKING_IO_WORKERS,
+            thread_name_prefix="blocking-io",
+        )
+    return _pool
+
+
+def _call(submitted, fn, *args, **kwargs):
+    started = time.perf_counter()
+    blocking_io_wait_seconds.observe(started - submitted)
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+        elapsed = time.perf_counter() - started
+        blocking_io_execute_seconds.observe(elapsed)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.io_wait += started - submitted
+            trace.io_execute += elapsed
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on the blocking I/O pool and return its result."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(_call, time.perf_counter(), fn, *args, **kwargs)
+    # In the caller's context, like sync_to_async: queries count toward its trace
+    return await loop.run_in_executor(_get_pool(), contextvars.copy_context().run, call)
@@ -0,0 +1,190 @@
+# chatapp/calls.py
+"""
+Server-side state of one-to-one calls.
+
+A call is stored under both participants (per room) and moves through
+ringing -> active, and is removed once it ends (reject, timeout, hang up
+or disconnect). ChatConsumer uses it to refuse calls to busy users and to
+time out unanswered calls without any client having to broadcast anything.
+
+Two backends, picked with settings.CALLS["BACKEND"]:
+- InMemoryCallRegistry: per-process, for local development
+- RedisCallRegistry: shared by every Daphne worker
+"""
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .redis_client import get_redis
+
+RINGING = "ringing"
+ACTIVE = "active"
+
+
+def new_call(caller, callee):
+    return {
+        "id": uuid.uuid4().hex,
+        "caller": caller,
+        "callee": callee,
+        "state": RINGING,
+        "since": time.time(),
+    }
+
+
+def peer_of(call, username):
+    return call["callee"] if call["caller"] == username else call["caller"]
+
+
+class BaseCallRegistry:
+
+    async def get(self, room, username):
+        """The user's current call in the room, or None."""
+        raise NotImplementedError
+
+    async def ring(self, room, caller, callee):
+        """Start ringing. Returns the call, or None if either side is busy."""
+        raise NotImplementedError
+
+    async def accept(self, room, callee):
+        """Mark the ringing call of `callee` active. Returns it, or None."""
+        raise NotImplementedError
+
+    async def end(self, room, username, call_id=None, state=None):
+        """
+        Remove the user's call (only if it has `call_id` / is in `state`,
+        when given). Returns the removed call, or None.
+        """
+        raise NotImplementedError
+
+
+class InMemoryCallRegistry(BaseCallRegistry):
+
+    def __init__(self, **options):
+        self.calls = {}  # (room, username) -> call
+
+    async def get(self, room, username):
+        return self.calls.get((room, username))
+
+    async def ring(self, room, caller, callee):
+        if caller == callee or (room, caller) in self.calls or (room, callee) in self.calls:
+            return None
+        call = new_call(caller, callee)
+        self.calls[room, caller] = self.calls[room, callee] = call
+        return call
+
+    async def accept(self, room, callee):
+        call = self.calls.get((room, callee))
+        if not call or call["callee"] != callee or call["state"] != RINGING:
+            return None
+        call["state"], call["since"] = ACTIVE, time.time()
+        return call
+
+    async def end(self, room, username, call_id=None, state=None):
+        call = self.calls.get((room, username))
+        if not call or (call_id and call["id"] != call_id) or (state and call["state"] != state):
+            return None
+        for user in (call["caller"], call["callee"]):
+            self.calls.pop((room, user), None)
+        return call
+
+
+# ---------------------------------------
+# REDIS BACKEND
+# ---------------------------------------
+# call:{room}:<username>  STRING  JSON of the call, same value under both users
+
+RING_SCRIPT = """
+if redis.call('EXISTS', KEYS[1], KEYS[2]) > 0 then
+  return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+# Replace / delete the pair only if both still hold the value we read
+SWAP_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] or redis.call('GET', KEYS[2]) ~= ARGV[1] then
+  return 0
+end
+if ARGV[2] == '' then
+  redis.call('DEL', KEYS[1], KEYS[2])
+else
+  redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+  redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+end
+return 1
+"""
+
+
+class RedisCallRegistry(BaseCallRegistry):
+    """
+    Keys expire on their own (ring timeout while ringing, `max_duration`
+    once active), so calls left behind by a crashed worker do not linger.
+    """
+
+    def __init__(self, ring_timeout=30, max_duration=6 * 60 * 60, **options):
+        self.ring_ttl = int(ring_timeout) + 5
+        self.max_duration = max_duration
+        self._scripts = None
+
+    def _key(self, room, username):
+        return f"call:{{{room}}}:{username}"
+
+    def _get_scripts(self):
+        if self._scripts is None:
+            r = get_redis()
+            self._scripts = (r.register_script(RING_SCRIPT), r.register_script(SWAP_SCRIPT))
+        return self._scripts
+
+    async def get(self, room, username):
+        raw = await get_redis().get(self._key(room, username))
+        return json.loads(raw) if raw else None
+
+    async def ring(self, room, caller, callee):
+        if caller == callee:
+            return None
+        ring, _ = self._get_scripts()
+        call = new_call(caller, callee)
+        keys = [self._key(room, caller), self._key(room, callee)]
+        ok = await ring(keys=keys, args=[json.dumps(call), self.ring_ttl])
+        return call if ok else None
+
+    async def accept(self, room, callee):
+        raw = await get_redis().get(self._key(room, callee))
+        call = json.loads(raw) if raw else None
+        if not call or call["callee"] != callee or call["state"] != RINGING:
+            return None
+
+        call["state"], call["since"] = ACTIVE, time.time()
+        ok = await self._swap(room, call, raw, json.dumps(call), self.max_duration)
+        return call if ok else None
+
+    async def end(self, room, username, call_id=None, state=None):
+        raw = await get_redis().get(self._key(room, username))
+        call = json.loads(raw) if raw else None
+        if not call or (call_id and call["id"] != call_id) or (state and call["state"] != state):
+            return None
+        ok = await self._swap(room, call, raw, "", 0)
+        return call if ok else None
+
+    async def _swap(self, room, call, old, new, ttl):
+        _, swap = self._get_scripts()
+        keys = [self._key(room, call["caller"]), self._key(room, call["callee"])]
+        return await swap(keys=keys, args=[old, new, ttl])
+
+
+_registry = None
+
+
+def get_call_registry():
+    """Process-wide registry configured in settings.CALLS."""
+    global _registry
+    if _registry is None:
+        config = dict(settings.CALLS)
+        backend = import_string(config.pop("BACKEND"))
+        _registry = backend(**{k.lower(): v for k, v in config.items()})
+    return _registry
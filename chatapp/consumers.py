@@ -1,16 +1,35 @@
 # chatapp/consumers.py
 
-import json
-from collections import defaultdict
+import asyncio
+import random
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import ChatRoom, Message, MediaFile
+from . import metrics
+from .calls import RINGING, get_call_registry, peer_of
+from .event_log import get_event_log
+from .frames import decode, encoded_event, room_event
+from .history import PAGE_SIZE, fetch_page
+from .media_pipeline import PROCESSED_TYPES, variants_for_urls
+from .message_ops import BATCH_SIZE, delete_in_batches, delete_message, edit_message, publish_deletion
+from .metrics import database_sync_to_async, group_send
+from .outbound import OutboundQueue
+from .models import Message
+from .presence import get_presence
+from .profiling import untraced_context
+from .rate_limit import SIGNAL_TYPES, ConnectionLimiter, frame_kind
+from .recent_messages import cache_entry, get_recent_messages
+from .room_cache import get_room_id, room_cache
+from .room_summary import get_read_cursors
+from .typing_state import broadcast as broadcast_typing, get_typing_tracker
+from .wire import negotiate
+from .write_behind import PersistError, get_message_writer
 
 User = get_user_model()
 
-# NOTE: for production use Redis instead (this is per-process only)
-ONLINE = defaultdict(set)
+_ring_tasks = set()  # keep references so pending ring timeouts are not garbage collected
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -25,36 +44,77 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
+        # Resolved once for the life of the socket
+        self.user_id = user.id
+        self.room_id = await database_sync_to_async(get_room_id)(self.room_name)
+        self.limiter = ConnectionLimiter()
+
+        # JSON text unless the client asked for a compact protocol
+        self.codec = negotiate(self.scope.get("subprotocols", []))
+
+        # Live frames up to this seq were already sent by the catch-up replay
+        self.replayed_seq = 0
+
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
+        await self.accept(subprotocol=self.codec.subprotocol)
+        metrics.connections.inc(self.room_name)
+
+        # Written out by its own task, so a slow client never stalls this consumer
+        self.outbound = OutboundQueue(self._send_encoded)
 
-        # presence
-        ONLINE[self.room_name].add(user.username)
+        # presence (counted per connection, shared by all workers)
+        presence = get_presence()
+        first_connection = await presence.join(self.room_name, user.username, self.channel_name)
+
+        # users whose worker died without a clean disconnect
+        for username in await presence.reap(self.room_name):
+            await group_send(self.group_name, room_event({
+                "type": "user_leave",
+                "username": username
+            }))
 
         # Send full list to this client
         await self.send_json({
             "type": "online_list",
-            "users": list(ONLINE[self.room_name])
+            "users": await presence.online(self.room_name)
         })
 
-        # broadcast join
-        await self.channel_layer.group_send(self.group_name, {
-            "type": "presence.event",
-            "event": "user_join",
-            "username": user.username
-        })
+        # Whatever this client missed while it was disconnected
+        await self._catch_up()
+
+        # broadcast join (only once per user, not per tab)
+        if first_connection:
+            await group_send(self.group_name, room_event({
+                "type": "user_join",
+                "username": user.username
+            }))
 
     async def disconnect(self, close_code):
         user = self.scope["user"]
 
-        if user and user.username in ONLINE.get(self.room_name, set()):
-            ONLINE[self.room_name].discard(user.username)
+        if user.is_anonymous:
+            return
+        if getattr(self, "outbound", None) is None:
+            # connect() failed before accepting (e.g. resolving the room): nothing else was set up
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            return
+        metrics.connections.dec(self.room_name)
+        self.outbound.close()
+
+        await self._stop_typing(user.username)
 
-            await self.channel_layer.group_send(self.group_name, {
-                "type": "presence.event",
-                "event": "user_leave",
+        last_connection = await get_presence().leave(self.room_name, user.username, self.channel_name)
+        if last_connection:
+            await group_send(self.group_name, room_event({
+                "type": "user_leave",
                 "username": user.username
-            })
+            }))
+
+            # Hang up whatever call the user was in
+            call = await get_call_registry().end(self.room_name, user.username)
+            if call:
+                peer = peer_of(call, user.username)
+                await self._send_to_user(peer, {"type": "call_reject", "target": peer, "from": user.username})
 
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
@@ -65,35 +125,72 @@ class ChatConsumer(AsyncWebsocketConsumer):
         2. Normal messages
         3. Media messages (image / file / voice)
         """
-        data = json.loads(text_data or "{}")
+        try:
+            data = self.codec.decode(text_data if text_data is not None else bytes_data)
+        except ValueError as e:
+            await self.send_json({"type": "error", "error": str(e)})
+            return
+        with metrics.FrameTimer(data.get("type") or "message", self.room_name):
+            await self._handle_frame(data)
+
+    async def _handle_frame(self, data):
         user = self.scope["user"]
         sender = user.username
 
+        # Per-connection token buckets; typing floods are dropped silently
+        kind = frame_kind(data)
+        if not self.limiter.allow(kind):
+            if kind != "typing":
+                await self.send_json({"type": "error", "error": "Rate limited", "frame": data.get("type") or "message"})
+            return
+
         # ------------------------------
         # 1️⃣ CALL SIGNALING
         # ------------------------------
-        signal_types = {
-            "call_request", "call_accept", "call_reject",
-            "call_timeout", "offer", "answer", "ice", "call_end"
-        }
-
-        if data.get("type") in signal_types:
-            payload = data.copy()
-            payload["from"] = sender
-
-            await self.channel_layer.group_send(self.group_name, {
-                "type": "signal.event",
-                "payload": payload
-            })
+        if data.get("type") in SIGNAL_TYPES:
+            await self._signal(data, sender)
             return
 
         # ------------------------------
         # TYPING INDICATOR
         # ------------------------------
         if data.get("type") == "typing":
-            await self.channel_layer.group_send(self.group_name, {
-                "type": "typing.event",
-                "username": sender
+            # Only the start is broadcast; the tracker sends "stop" on expiry
+            if get_typing_tracker().touch(self.room_name, sender):
+                await broadcast_typing(self.room_name, sender, "start")
+            return
+
+        # ------------------------------
+        # READ MARK (coalesced, see room_summary.py)
+        # ------------------------------
+        if data.get("type") == "read":
+            # No message_id marks everything read; a malformed one must not
+            msg_id = None
+            if data.get("message_id") is not None:
+                msg_id = await self._message_id(data)
+                if msg_id is None:
+                    return
+            get_read_cursors().mark(self.user_id, self.room_id, msg_id)
+            return
+
+        # ------------------------------
+        # HISTORY (older messages, only for this client)
+        # ------------------------------
+        if data.get("type") == "history":
+            try:
+                messages, next_cursor = await database_sync_to_async(fetch_page)(
+                    self.room_id,
+                    before=data.get("before") or None,
+                    limit=int(data.get("limit", PAGE_SIZE)),
+                )
+            except (TypeError, ValueError):
+                await self.send_json({"type": "error", "error": "Invalid history cursor"})
+                return
+
+            await self.send_json({
+                "type": "history",
+                "messages": messages,
+                "next": next_cursor
             })
             return
 
@@ -109,6 +206,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 "media_url": "/media/uploads/.../file"
             }
             """
+            await self._stop_typing(sender)
             attachments = [{
                 "type": data.get("media_type"),
                 "url": data.get("media_url"),
@@ -116,14 +214,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 "duration": data.get("duration", "")
             }]
 
-            await self.channel_layer.group_send(self.group_name, {
-                "type": "chat.message",
+            await self._broadcast_logged({
                 "message": "",
                 "username": sender,
-                "attachments": attachments
+                "attachments": await self._with_variants(attachments),
+                "message_id": None
             })
 
-            await self._save_message(sender, self.room_name, "", attachments)
+            await self._save_message("", attachments)
             return
 
         # ------------------------------
@@ -133,28 +231,35 @@ class ChatConsumer(AsyncWebsocketConsumer):
         attachments = data.get("attachments", [])
 
         if message or attachments:
+            await self._stop_typing(sender)
             reply_to = data.get("reply_to", None)
-            msg = await self._save_message(sender, self.room_name, message, attachments)
-            await self.channel_layer.group_send(self.group_name, {
-                "type": "chat.message",
+            msg_id = await self._save_message(message, attachments)
+            if msg_id is None:
+                return
+            frame = {
                 "message": message,
                 "username": sender,
-                "attachments": attachments,
-                "reply_to": reply_to,
-                "message_id": msg.id if msg else None
-            })
+                "attachments": await self._with_variants(attachments),
+                "message_id": msg_id
+            }
+            if reply_to:
+                frame["reply_to"] = reply_to
+            await self._broadcast_logged(frame)
             return
 
         # ------------------------------
         # 4. EDIT MESSAGE
         # ------------------------------
         if data.get("type") == "edit_message":
-            msg_id = data.get("message_id")
+            msg_id = await self._message_id(data)
+            if msg_id is None:
+                return
             new_content = data.get("content", "")
-            success = await self._edit_message(msg_id, sender, new_content)
+            success = await database_sync_to_async(edit_message)(msg_id, self.user_id, self.room_id, new_content)
             if success:
-                await self.channel_layer.group_send(self.group_name, {
-                    "type": "edit.event",
+                await get_recent_messages().edit(self.room_id, msg_id, new_content)
+                await self._broadcast_logged({
+                    "type": "message_edited",
                     "message_id": msg_id,
                     "content": new_content,
                     "username": sender
@@ -165,125 +270,265 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # 5. DELETE MESSAGE
         # ------------------------------
         if data.get("type") == "delete_message":
-            msg_id = data.get("message_id")
-            success = await self._delete_message(msg_id, sender)
+            msg_id = await self._message_id(data)
+            if msg_id is None:
+                return
+            success = await database_sync_to_async(delete_message)(msg_id, self.user_id, self.room_id)
             if success:
-                await self.channel_layer.group_send(self.group_name, {
-                    "type": "delete.event",
+                await get_recent_messages().remove(self.room_id, msg_id)
+                await self._broadcast_logged({
+                    "type": "message_deleted",
                     "message_id": msg_id,
                     "username": sender
                 })
             return
 
-    # ---------------------------------------
-    # PRESENCE EVENT
-    # ---------------------------------------
-    async def presence_event(self, event):
-        await self.send_json({
-            "type": event["event"],
-            "username": event["username"]
-        })
+        # ------------------------------
+        # 6. BULK DELETION (batched, see message_ops.py)
+        # ------------------------------
+        if data.get("type") in ("delete_messages", "purge_user", "clear_room"):
+            await self._bulk_delete(data, user)
+            return
 
     # ---------------------------------------
-    # TYPING EVENT
+    # BULK DELETION
     # ---------------------------------------
-    async def typing_event(self, event):
-        # Don't send typing event back to the sender
-        user = self.scope["user"]
-        if user.username != event["username"]:
-            await self.send_json({
-                "type": "typing",
-                "username": event["username"]
-            })
+    async def _bulk_delete(self, data, user):
+        """
+        delete_messages {message_ids}: the sender's own messages (any, for staff)
+        purge_user {username}: that user's messages in this room (staff)
+        clear_room: every message of the room (staff)
+        """
+        messages = Message.objects.filter(room_id=self.room_id)
+        frame_type = data["type"]
+
+        if frame_type == "delete_messages":
+            ids = data.get("message_ids")
+            if isinstance(ids, list):
+                ids = [i for i in ids if isinstance(i, int) and not isinstance(i, bool)]
+            if not isinstance(ids, list) or not 0 < len(ids) <= BATCH_SIZE:
+                await self.send_json({
+                    "type": "error", "error": f"message_ids must list 1 to {BATCH_SIZE} ids", "frame": frame_type,
+                })
+                return
+            messages = messages.filter(id__in=ids)
+            if not user.is_staff:
+                messages = messages.filter(user_id=self.user_id)
+        elif not user.is_staff:
+            await self.send_json({"type": "error", "error": "Not allowed", "frame": frame_type})
+            return
+        elif frame_type == "purge_user":
+            purged_id = await database_sync_to_async(
+                User.objects.filter(username=data.get("username")).values_list("id", flat=True).first
+            )()
+            if purged_id is None:
+                await self.send_json({"type": "error", "error": "Unknown user", "frame": frame_type})
+                return
+            messages = messages.filter(user_id=purged_id)
+
+        batches = delete_in_batches(messages)
+        while True:
+            deleted = await database_sync_to_async(next)(batches, None)
+            if deleted is None:
+                break
+            if frame_type == "delete_messages":
+                await publish_deletion(self.room_id, self.room_name, {
+                    "type": "messages_deleted",
+                    "message_ids": deleted[self.room_id],
+                    "username": user.username,
+                })
 
-    # ---------------------------------------
-    # SIGNAL EVENT FOR CALLING
-    # ---------------------------------------
-    async def signal_event(self, event):
-        await self.send_json(event["payload"])
+        if frame_type == "purge_user":
+            await publish_deletion(self.room_id, self.room_name, {"type": "user_purged", "username": data.get("username")})
+        elif frame_type == "clear_room":
+            await publish_deletion(self.room_id, self.room_name, {"type": "room_cleared", "username": user.username})
+
+    async def _stop_typing(self, username):
+        # Typing frames go out behind messages (see outbound.py), so a "start"
+        # can arrive after the message; only a "stop" reliably hides it
+        if get_typing_tracker().clear(self.room_name, username):
+            await broadcast_typing(self.room_name, username, "stop")
+
+    async def _message_id(self, data):
+        """
+        The frame's message_id as an int (clients may send it as a string),
+        or None after telling the sender it is invalid. The database and the
+        recent messages cache must both be given the same int.
+        """
+        msg_id = data.get("message_id")
+        try:
+            if isinstance(msg_id, (bool, float)):
+                raise TypeError
+            return int(msg_id)
+        except (TypeError, ValueError):
+            await self.send_json({"type": "error", "error": "Invalid message_id", "frame": data["type"]})
+            return None
 
     # ---------------------------------------
-    # CHAT MESSAGE EVENT (MAIN)
+    # CALL SIGNALING (unicast to the target)
     # ---------------------------------------
-    async def chat_message(self, event):
-        payload = {
-            "message": event.get("message", ""),
-            "username": event.get("username"),
-            "attachments": event.get("attachments", []),
-            "message_id": event.get("message_id")
-        }
-        if event.get("reply_to"):
-            payload["reply_to"] = event["reply_to"]
-        await self.send_json(payload)
+    async def _signal(self, data, sender):
+        payload = data.copy()
+        payload["from"] = sender
+        target = data.get("to") or data.get("target")
+
+        if not target:
+            # Legacy clients without a target: whole room
+            await group_send(self.group_name, room_event(payload))
+            return
+
+        payload["target"] = target
+        calls = get_call_registry()
+        signal_type = data["type"]
+
+        if signal_type == "call_request":
+            call = await calls.ring(self.room_name, sender, target)
+            if call is None:
+                await self.send_json({"type": "call_failed", "target": sender, "from": target, "reason": "busy"})
+                return
+            if not await self._send_to_user(target, payload):
+                await calls.end(self.room_name, sender, call_id=call["id"])
+                await self.send_json({"type": "call_failed", "target": sender, "from": target, "reason": "offline"})
+                return
+            # Outlives the socket (the call may time out after we left), so kept here, not on self
+            task = asyncio.create_task(self._ring_timeout(call), context=untraced_context())
+            _ring_tasks.add(task)
+            task.add_done_callback(_ring_tasks.discard)
+            return
+
+        if signal_type == "call_accept":
+            if await calls.accept(self.room_name, sender) is None:
+                # Already timed out or hung up by the caller
+                await self.send_json({"type": "call_timeout", "target": sender, "from": target})
+                return
+        elif signal_type in ("call_reject", "call_timeout", "call_end"):
+            await calls.end(self.room_name, sender)
+
+        await self._send_to_user(target, payload)
+
+    async def _ring_timeout(self, call):
+        await asyncio.sleep(settings.CALLS["RING_TIMEOUT"])
+        if await get_call_registry().end(self.room_name, call["caller"], call_id=call["id"], state=RINGING):
+            for user, peer in ((call["caller"], call["callee"]), (call["callee"], call["caller"])):
+                await self._send_to_user(user, {"type": "call_timeout", "target": user, "from": peer})
+
+    async def _send_to_user(self, username, payload):
+        """Deliver to every connection of `username` in this room. Returns how many."""
+        channels = await get_presence().channels_for(self.room_name, username)
+        if channels:
+            event = room_event(payload)
+            for channel in channels:
+                await self.channel_layer.send(channel, event)
+        return len(channels)
 
     # ---------------------------------------
-    # EDIT EVENT
+    # RECONNECT CATCH-UP
     # ---------------------------------------
-    async def edit_event(self, event):
-        await self.send_json({
-            "type": "message_edited",
-            "message_id": event["message_id"],
-            "content": event["content"],
-            "username": event["username"]
-        })
+    async def _broadcast_logged(self, frame):
+        """Room broadcast that reconnecting clients can replay (gets a seq)."""
+        text = await get_event_log().append(self.room_name, frame)
+        await group_send(self.group_name, encoded_event(text, seq=frame["seq"]))
+
+    async def _catch_up(self):
+        """
+        The client reconnects with ?since=<last seq>&last_id=<last message id>.
+        Replays from the event log; ends with a "sync" frame carrying the
+        seq to resume from next time. reset=True means the log cannot tell
+        what was missed (it no longer goes back to `since`, or the client
+        has messages but no seq): reload the newest page. Edits and
+        deletions are only in the log, so there is no partial fallback.
+
+        The socket joined the room group first, so events logged before the
+        replay was read also arrive live; room_frame() skips those.
+        """
+        params = parse_qs(self.scope.get("query_string", b"").decode())
+        try:
+            since = int(params["since"][0]) if "since" in params else None
+        except ValueError:
+            since = None
+
+        log = get_event_log()
+        seq = await log.last_seq(self.room_name)
+
+        events = await log.since(self.room_name, since) if since is not None else None
+        if events:
+            for text in events:
+                await self._enqueue(self.codec.transcode(text))
+            self.replayed_seq = decode(events[-1])["seq"]
+            seq = max(seq, self.replayed_seq)
+        # A first connection has nothing to catch up on
+        reset = events is None and ("since" in params or "last_id" in params)
+
+        await self.send_json({"type": "sync", "seq": seq, "reset": reset})
 
     # ---------------------------------------
-    # DELETE EVENT
+    # ROOM FRAME (encoded once by the sender)
     # ---------------------------------------
-    async def delete_event(self, event):
-        await self.send_json({
-            "type": "message_deleted",
-            "message_id": event["message_id"],
-            "username": event["username"]
-        })
+    async def room_frame(self, event):
+        # e.g. typing indicators are not echoed back to the typist
+        if event.get("exclude") == self.scope["user"].username:
+            return
+        if event.get("seq", self.replayed_seq + 1) <= self.replayed_seq:
+            return
+        await self._enqueue(self.codec.transcode(event["text"]), event.get("coalesce"))
+
+    async def room_deleted(self, event):
+        """The room was deleted (see signals.py); its id is gone, so start over in a fresh one."""
+        room_cache.invalidate(event["room_id"])
+        await self._reconnect("room_deleted")
 
     # ---------------------------------------
     # SAVE TO DATABASE
     # ---------------------------------------
-    @database_sync_to_async
-    def _save_message(self, username, room_name, content, attachments):
-        user = User.objects.filter(username=username).first()
-        room, _ = ChatRoom.objects.get_or_create(name=room_name)
-
-        msg = Message.objects.create(
-            room=room,
-            user=user,
-            content=content or "",
-            attachments_json=attachments or [],
-        )
-
-        # Save media separately
-        for att in attachments or []:
-            if att.get("url"):
-                MediaFile.objects.create(
-                    message=msg,
-                    file_url=att["url"],
-                    media_type=att.get("type", "file"),
-                    duration=att.get("duration", ""),
-                    name=att.get("name", "")
-                )
-
-        return msg
-
-    @database_sync_to_async
-    def _edit_message(self, message_id, username, new_content):
-        try:
-            msg = Message.objects.get(id=message_id, user__username=username)
-            msg.content = new_content
-            msg.save(update_fields=["content"])
-            return True
-        except Message.DoesNotExist:
-            return False
-
-    @database_sync_to_async
-    def _delete_message(self, message_id, username):
+    async def _save_message(self, content, attachments):
+        """The new message id, or None (the sender is told) if it could not be saved."""
+        # Batched with other consumers' messages; resolves to the new id and timestamp
         try:
-            msg = Message.objects.get(id=message_id, user__username=username)
-            msg.delete()
-            return True
-        except Message.DoesNotExist:
-            return False
+            msg_id, timestamp = await get_message_writer().submit(self.room_id, self.user_id, content, attachments)
+        except PersistError as e:
+            await self.send_json({"type": "error", "error": str(e), "frame": "message"})
+            return None
+        await get_recent_messages().append(self.room_id, cache_entry(
+            msg_id, self.scope["user"].username, content, attachments, timestamp
+        ))
+        return msg_id
+
+    async def _with_variants(self, attachments):
+        """Attachments with thumb/preview URLs added where already rendered."""
+        urls = [att.get("url") for att in attachments if att.get("type") in PROCESSED_TYPES]
+        if not urls:
+            return attachments
+        variants = await database_sync_to_async(variants_for_urls)(urls)
+        return [{**att, **variants.get(att.get("url"), {})} for att in attachments]
 
-    # Utility
+    # ---------------------------------------
+    # OUTBOUND (queued, see outbound.py)
+    # ---------------------------------------
     async def send_json(self, obj):
-        await self.send(text_data=json.dumps(obj))
+        await self._enqueue(self.codec.encode(obj))
+
+    async def _enqueue(self, data, coalesce=None):
+        reason = self.outbound.put(data, coalesce)
+        if reason:
+            await self._evict(reason)
+
+    async def _evict(self, reason):
+        """Too far behind: drop the backlog and tell the client to reconnect and catch up."""
+        metrics.outbound_evictions.inc(reason)
+        await self._reconnect(reason)
+
+    async def _reconnect(self, reason):
+        self.outbound.close()
+        low, high = settings.OUTBOUND["RETRY_AFTER"]
+        await self._send_encoded(self.codec.encode({
+            "type": "reconnect",
+            "reason": reason,
+            "retry_after_ms": int(random.uniform(low, high) * 1000),
+        }))
+        await self.close(code=4008)
+
+    async def _send_encoded(self, data):
+        if isinstance(data, bytes):
+            await self.send(bytes_data=data)
+        else:
+            await self.send(text_data=data)
@@ -0,0 +1,168 @@
+# chatapp/event_log.py
+"""
+Recent room events, kept for reconnect catch-up.
+
+Frames a client must not miss (messages, edits, deletions) get a per-room
+sequence number and are stored, encoded, in a bounded log before they are
+broadcast. A reconnecting client passes the last seq it saw and
+ChatConsumer replays whatever followed it; when the log no longer reaches
+back that far the client is told to reload the newest page instead.
+
+Sequence numbers start from the current time in milliseconds whenever a
+room's counter is (re)created, so they keep increasing across restarts
+and a cursor from before a restart reads as "too old" instead of
+matching unrelated events.
+
+Two backends, picked with settings.EVENT_LOG["BACKEND"]:
+- InMemoryEventLog: per-process, for local development
+- RedisEventLog: shared by every Daphne worker
+"""
+import time
+from collections import deque
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .frames import encode
+from .redis_client import get_redis
+
+
+def initial_seq():
+    return int(time.time() * 1000)
+
+
+class BaseEventLog:
+
+    async def append(self, room, frame):
+        """Number `frame` (sets frame["seq"]), store it. Returns its encoded text."""
+        raise NotImplementedError
+
+    async def since(self, room, seq):
+        """
+        Encoded frames after `seq`, oldest first. None when the log does not
+        go back that far (or `seq` is from another counter).
+        """
+        raise NotImplementedError
+
+    async def last_seq(self, room):
+        """Seq of the room's latest event, for clients that have seen none yet."""
+        raise NotImplementedError
+
+
+class InMemoryEventLog(BaseEventLog):
+
+    def __init__(self, size=1000, **options):
+        self.size = size
+        self.rooms = {}  # room -> deque of (seq, text)
+        self.seqs = {}   # room -> last seq
+
+    async def append(self, room, frame):
+        seq = self.seqs.get(room) or initial_seq()
+        seq += 1
+        self.seqs[room] = frame["seq"] = seq
+        text = encode(frame)
+        events = self.rooms.get(room)
+        if events is None:
+            events = self.rooms[room] = deque(maxlen=self.size)
+        events.append((seq, text))
+        return text
+
+    async def since(self, room, seq):
+        last = await self.last_seq(room)
+        if seq == last:
+            return []
+        events = self.rooms.get(room)
+        if seq > last or not events or events[0][0] > seq + 1:
+            return None
+        return [text for event_seq, text in events if event_seq > seq]
+
+    async def last_seq(self, room):
+        if room not in self.seqs:
+            self.seqs[room] = initial_seq()
+        return self.seqs[room]
+
+
+# ---------------------------------------
+# REDIS BACKEND
+# ---------------------------------------
+# Keys per room:
+#   events:{room}:seq   STRING  last seq
+#   events:{room}:log   ZSET    encoded frame, scored by its seq
+
+SEQ_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'NX')
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return redis.call('INCRBY', KEYS[1], ARGV[3])
+"""
+
+# Numbers and stores the frame in one step, so no seq is ever handed out
+# before its event is in the log (a replay would skip it). ARGV[2] is the
+# frame encoded without its seq; the seq is added as the last key.
+APPEND_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'NX')
+local seq = redis.call('INCRBY', KEYS[1], 1)
+local text = string.sub(ARGV[2], 1, -2) .. ',"seq":' .. string.format('%d', seq) .. '}'
+redis.call('ZADD', KEYS[2], seq, text)
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -1 - tonumber(ARGV[3]))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return {seq, text}
+"""
+
+
+class RedisEventLog(BaseEventLog):
+    """
+    The counter and the log expire after `ttl` seconds without events,
+    so idle rooms cost nothing.
+    """
+
+    def __init__(self, size=1000, ttl=60 * 60, **options):
+        self.size = size
+        self.ttl = ttl
+        self._scripts = None
+
+    def _keys(self, room):
+        prefix = f"events:{{{room}}}"
+        return f"{prefix}:seq", f"{prefix}:log"
+
+    def _get_scripts(self):
+        if self._scripts is None:
+            r = get_redis()
+            self._scripts = (r.register_script(SEQ_SCRIPT), r.register_script(APPEND_SCRIPT))
+        return self._scripts
+
+    async def append(self, room, frame):
+        _, append = self._get_scripts()
+        seq, text = await append(keys=list(self._keys(room)), args=[initial_seq(), encode(frame), self.size, self.ttl])
+        frame["seq"] = int(seq)
+        return text
+
+    async def since(self, room, seq):
+        last = await self.last_seq(room)
+        if seq == last:
+            return []
+        if seq > last:
+            return None
+        _, log_key = self._keys(room)
+        events = await get_redis().zrangebyscore(log_key, f"({seq}", "+inf", withscores=True)
+        if not events or int(events[0][1]) > seq + 1:
+            return None
+        return [text for text, _ in events]
+
+    async def last_seq(self, room):
+        next_seq, _ = self._get_scripts()
+        seq_key, _ = self._keys(room)
+        return int(await next_seq(keys=[seq_key], args=[initial_seq(), self.ttl, 0]))
+
+
+_log = None
+
+
+def get_event_log():
+    """Process-wide event log configured in settings.EVENT_LOG."""
+    global _log
+    if _log is None:
+        config = dict(settings.EVENT_LOG)
+        backend = import_string(config.pop("BACKEND"))
+        _log = backend(**{k.lower(): v for k, v in config.items()})
+    return _log
@@ -0,0 +1,64 @@
+# chatapp/frames.py
+"""
+Outbound WebSocket frames, encoded once.
+
+A room broadcast carries the final JSON text of its frame in the channel
+layer event, so every receiving ChatConsumer just forwards the string
+instead of rebuilding and re-serializing its own copy. orjson is used for
+encoding when it is installed.
+
+Typing and presence frames also carry a coalesce key: only the latest
+one per user matters, so a slow client's outbound queue keeps just that
+one (see outbound.py).
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+# Frame type -> coalesce key prefix (the key adds the username)
+COALESCED = {
+    "typing": "typing",
+    "user_join": "presence",
+    "user_leave": "presence",
+}
+
+
+def encode(frame):
+    if orjson is not None:
+        return orjson.dumps(frame).decode()
+    return json.dumps(frame)
+
+
+def decode(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def room_event(frame, exclude=None):
+    """
+    Channel layer event delivering `frame` as-is to each consumer.
+    `exclude` is a username that should not receive it (e.g. the typist).
+    """
+    event = encoded_event(encode(frame), exclude)
+    prefix = COALESCED.get(frame.get("type"))
+    if prefix:
+        event["coalesce"] = f"{prefix}:{frame.get('username')}"
+    return event
+
+
+def encoded_event(text, exclude=None, seq=None):
+    """
+    room_event() for a frame that is already encoded (see event_log).
+    `seq` is the frame's event log seq, so consumers can skip frames
+    their reconnect catch-up already replayed.
+    """
+    event = {"type": "room.frame", "text": text}
+    if exclude:
+        event["exclude"] = exclude
+    if seq is not None:
+        event["seq"] = seq
+    return event
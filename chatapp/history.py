@@ -0,0 +1,107 @@
+# chatapp/history.py
+"""
+Keyset-paginated message history.
+
+Pages walk backwards through a room ordered by (timestamp, id), so every
+page is an index range scan on chatapp_msg_room_ts_id_idx no matter how
+deep the user scrolls. Cursors are opaque strings handed back to the client.
+
+A page that runs past the oldest message still in the database goes on
+into the archived months (see archive.py); a cursor from there keeps
+reading the archive.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+from . import archive
+from .models import Message
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(timestamp, msg_id):
+    raw = f"{timestamp.isoformat()}|{msg_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns (timestamp, id). Raises ValueError on a malformed cursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, msg_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(msg_id)
+    except (TypeError, UnicodeDecodeError, base64.binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def serialize_message(msg):
+    """Same shape as a live chat message frame, minus empty fields."""
+    payload = {
+        "message_id": msg.id,
+        "username": msg.user.username if msg.user else None,
+        "timestamp": msg.timestamp.isoformat(),
+    }
+    if msg.content:
+        payload["message"] = msg.content
+
+    attachments = []
+    for m in msg.media_files.all():
+        attachment = {"type": m.media_type, "url": m.file_url, "name": m.name, "duration": m.duration}
+        if m.thumbnail_url:
+            attachment["thumb"] = m.thumbnail_url
+        if m.preview_url:
+            attachment["preview"] = m.preview_url
+        attachments.append(attachment)
+    if attachments:
+        payload["attachments"] = attachments
+    return payload
+
+
+def page_queryset(room_id, boundary=None):
+    """A room's messages older than `boundary` (timestamp, id), newest first."""
+    qs = (
+        Message.objects
+        .filter(room_id=room_id)
+        .select_related("user")
+        .prefetch_related("media_files__blob")
+        .only("id", "content", "timestamp", "user__username")
+        .order_by("-timestamp", "-id")
+    )
+    if boundary:
+        timestamp, msg_id = boundary
+        # The redundant timestamp <= bound is what the index range starts from;
+        # Postgres only applies the OR as a filter
+        qs = qs.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=msg_id), timestamp__lte=timestamp)
+    return qs
+
+
+def fetch_page(room_id, before=None, limit=PAGE_SIZE):
+    """
+    Messages older than the `before` cursor (newest page when None),
+    returned oldest first, plus the cursor for the next older page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    boundary = decode_cursor(before) if before else None
+    rows = list(page_queryset(room_id, boundary)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    messages = [serialize_message(m) for m in rows]
+
+    if not has_more:
+        # Archived months are all older than what is left in the database
+        if rows:
+            boundary = (rows[-1].timestamp, rows[-1].id)
+        older = archive.fetch_before(room_id, boundary, limit - len(rows) + 1)
+        has_more = len(older) > limit - len(rows)
+        messages += older[:limit - len(rows)]
+
+    next_cursor = None
+    if has_more:
+        last = messages[-1]
+        next_cursor = encode_cursor(datetime.fromisoformat(last["timestamp"]), last["message_id"])
+    return messages[::-1], next_cursor
+
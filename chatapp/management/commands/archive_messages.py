@@ -0,0 +1,67 @@
+# chatapp/management/commands/archive_messages.py
+"""
+Create upcoming message partitions and archive the months past the
+retention horizon (see chatapp/partitions.py, chatapp/archive.py):
+
+    python manage.py archive_messages                 # MESSAGE_ARCHIVE settings
+    python manage.py archive_messages --months 6      # keep six months plus the current one
+    python manage.py archive_messages --dry-run       # list what would be archived
+
+Meant to run daily from cron. A month is archived once it ended more
+than RETENTION_MONTHS months before the start of the current month;
+each one is exported, detached and dropped in its own transaction.
+"""
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from chatapp.archive import archive_dir, archive_partition
+from chatapp.partitions import add_months, ensure_partitions, is_partitioned, list_partitions, month_start
+
+
+class Command(BaseCommand):
+    help = "Create upcoming message partitions and archive old ones to compressed files."
+
+    def add_arguments(self, parser):
+        config = settings.MESSAGE_ARCHIVE
+        parser.add_argument(
+            "--months", type=int, default=config["RETENTION_MONTHS"],
+            help=f"Whole months kept before the current one (default {config['RETENTION_MONTHS']})",
+        )
+        parser.add_argument(
+            "--ahead", type=int, default=config["MONTHS_AHEAD"],
+            help=f"Partitions to create past the current month (default {config['MONTHS_AHEAD']})",
+        )
+        parser.add_argument("--keep-tables", action="store_true", help="Detach archived partitions without dropping them")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be archived")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql" or not is_partitioned():
+            raise CommandError("chatapp_message is not partitioned; run the migrations on PostgreSQL first.")
+        if options["months"] < 0:
+            raise CommandError("--months cannot be negative.")
+
+        if not options["dry_run"]:
+            for name in ensure_partitions(options["ahead"]):
+                self.stdout.write(f"Created {name}")
+
+        horizon = add_months(month_start(datetime.now(timezone.utc)), -options["months"])
+        expired = [partition for partition in list_partitions() if partition[2] <= horizon]
+        if not expired:
+            self.stdout.write(self.style.SUCCESS(f"Nothing older than {horizon:%Y-%m} to archive"))
+            return
+
+        for name, start, end in expired:
+            if options["dry_run"]:
+                self.stdout.write(f"Would archive {name} ({start:%Y-%m-%d} to {end:%Y-%m-%d})")
+                continue
+            archived = archive_partition(name, start, end, keep_table=options["keep_tables"])
+            self.stdout.write(
+                f"Archived {name}: {archived.message_count} messages in "
+                f"{len(archived.room_counts)} rooms to {archive_dir() / name}"
+            )
+
+        verb = "Would archive" if options["dry_run"] else "Archived"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(expired)} partitions"))
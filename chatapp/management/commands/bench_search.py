@@ -0,0 +1,164 @@
+# chatapp/management/commands/bench_search.py
+"""
+Benchmark full-text message search on a large seeded table:
+
+    python manage.py bench_search --rows 10000000 --rooms 100
+    python manage.py bench_search --keep       # reuse the seed on the next run
+
+Messages are generated in SQL (generate_series over a fixed vocabulary,
+so word frequencies are Zipf-like) into rooms named bench_search_N, and
+indexed by the search trigger as they are inserted. Then each query in
+QUERIES runs --repeat times through search.search_messages() — first page
+and one keyset page — against the busiest room.
+
+Reported: seed time, p50/p99 latency per query and overall. --check
+fails when the overall p99 exceeds --target-ms or regresses against the
+previous run (BENCHMARK_DIR/bench_search.jsonl). The seed is deleted at
+the end unless --keep is given.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from chatapp.benchmarks import compare, percentile, previous_result, save_result
+from chatapp.models import ChatRoom, Message
+from chatapp.search import search_messages
+
+User = get_user_model()
+
+VOCABULARY = (
+    "the meeting deploy release latency dashboard coffee lunch review bug fix "
+    "ticket server database index query cache redis postgres socket upload video "
+    "photo call recording invoice budget roadmap sprint standup demo customer "
+    "alert incident rollback migration benchmark profile memory network timeout "
+    "weekend holiday birthday football concert airport hotel train report draft"
+).split()
+
+QUERIES = {
+    "common_word": "meeting",
+    "two_words": "deploy rollback",
+    "phrase": '"database index"',
+    "or": "invoice or budget",
+    "exclusion": "server -redis",
+    "no_match": "xylophone",
+}
+
+
+class Command(BaseCommand):
+    help = "Benchmark ranked full-text search latency on a seeded message table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000000, help="Messages to seed")
+        parser.add_argument("--rooms", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--target-ms", type=float, default=100, help="p99 budget for --check")
+        parser.add_argument("--keep", action="store_true", help="Keep the seeded rows")
+        parser.add_argument("--no-save", action="store_true", help="Do not store the result")
+        parser.add_argument("--check", action="store_true", help="Fail on a regression or a blown p99 budget")
+        parser.add_argument("--tolerance", type=float, default=0.20)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Full-text search needs PostgreSQL.")
+
+        rooms = self.rooms(options["rooms"])
+        try:
+            metrics = {"seed_seconds": self.seed(rooms, options["rows"])}
+            metrics.update(self.measure(rooms[0].id, options["repeat"]))
+        finally:
+            if not options["keep"]:
+                self.cleanup(rooms)
+
+        params = {k: options[k] for k in ("rows", "rooms")}
+        self.report(params, metrics, options)
+
+    # ---------------------------------------
+    # SEED DATA
+    # ---------------------------------------
+    def rooms(self, count):
+        names = [f"bench_search_{i}" for i in range(count)]
+        ChatRoom.objects.bulk_create([ChatRoom(name=n) for n in names], ignore_conflicts=True)
+        return list(ChatRoom.objects.filter(name__in=names).order_by("id"))
+
+    def seed(self, rooms, rows):
+        """Top up the bench rooms to `rows` messages. Returns seconds spent."""
+        missing = rows - Message.objects.filter(room__in=rooms).count()
+        if missing <= 0:
+            return 0.0
+
+        user, _ = User.objects.get_or_create(username="bench_user_0", defaults={"password": "!"})
+        room_ids = [r.id for r in rooms]
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            # Room 0 gets ~1/3 of the rows; word i is picked with weight ~1/i
+            cursor.execute(
+                """
+                INSERT INTO chatapp_message (room_id, user_id, content, timestamp)
+                SELECT
+                    CASE WHEN random() < 0.33 THEN (%(rooms)s)[1]
+                         ELSE (%(rooms)s)[1 + floor(random() * cardinality(%(rooms)s))::int] END,
+                    %(user)s,
+                    (SELECT string_agg((%(words)s)[floor(power(cardinality(%(words)s), random()))::int], ' ')
+                     FROM generate_series(1, 4 + (n %% 12))),
+                    now() - (n || ' seconds')::interval
+                FROM generate_series(1, %(rows)s) AS n
+                """,
+                {"rooms": room_ids, "user": user.id, "words": list(VOCABULARY), "rows": missing},
+            )
+            # Also flushes the GIN pending list the inserts went to
+            cursor.execute("VACUUM ANALYZE chatapp_message")
+        return round(time.perf_counter() - started, 1)
+
+    def cleanup(self, rooms):
+        # Seeded rows have no media: skip the ORM's cascade collection
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM chatapp_message WHERE room_id = ANY(%s)", [[r.id for r in rooms]])
+
+    # ---------------------------------------
+    # RUN
+    # ---------------------------------------
+    def measure(self, room_id, repeat):
+        metrics = {}
+        every = []
+        for name, query in QUERIES.items():
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                _, cursor = search_messages(room_id, query)
+                if cursor:
+                    search_messages(room_id, query, after=cursor)
+                samples.append((time.perf_counter() - started) / (2 if cursor else 1))
+            every.extend(samples)
+            metrics[f"{name}_p50_ms"] = round(percentile(samples, 50) * 1000, 2)
+            metrics[f"{name}_p99_ms"] = round(percentile(samples, 99) * 1000, 2)
+        metrics["p50_ms"] = round(percentile(every, 50) * 1000, 2)
+        metrics["p99_ms"] = round(percentile(every, 99) * 1000, 2)
+        return metrics
+
+    # ---------------------------------------
+    # OUTPUT
+    # ---------------------------------------
+    def report(self, params, metrics, options):
+        for key, value in metrics.items():
+            self.stdout.write(f"{key:24} {value}")
+
+        failures = []
+        if metrics["p99_ms"] > options["target_ms"]:
+            failures.append(f"p99 {metrics['p99_ms']}ms over the {options['target_ms']}ms budget")
+
+        previous = previous_result("bench_search", params)
+        if previous:
+            self.stdout.write(f"\nCompared with run of {previous['time']}:")
+            for key, old, new, change, regressed in compare(previous, metrics, set(), options["tolerance"]):
+                line = f"{key:24} {old} -> {new} ({change:+.1%})"
+                self.stdout.write(self.style.ERROR(line) if regressed else line)
+                if regressed and key != "seed_seconds":
+                    failures.append(f"{key} regressed")
+
+        if not options["no_save"]:
+            save_result("bench_search", params, metrics)
+
+        if options["check"] and failures:
+            raise CommandError("; ".join(failures))
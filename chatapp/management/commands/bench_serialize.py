@@ -0,0 +1,98 @@
+# chatapp/management/commands/bench_serialize.py
+"""
+Microbenchmark: cost of serializing one room broadcast for N recipients.
+
+    python manage.py bench_serialize --recipients 1000
+
+per_recipient   every consumer builds its frame dict and json.dumps it
+                (how chat.message was handled before frames.room_event)
+encode_once     the sender encodes once with the stdlib json module and
+                every consumer forwards the same string
+encode_once_orjson   same, with orjson (skipped when not installed)
+
+Times are microseconds per broadcast (best of --repeat runs). Results
+go to BENCHMARK_DIR/bench_serialize.jsonl like bench_ws.
+"""
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from chatapp import frames
+from chatapp.benchmarks import compare, previous_result, save_result
+
+
+def sample_event():
+    return {
+        "type": "chat.message",
+        "message": "Has anyone looked at the latency numbers from last night's run? " * 2,
+        "username": "alice",
+        "attachments": [
+            {"type": "image", "url": "/media/cas/ab/cd/" + "0" * 64 + ".jpg", "name": "photo.jpg",
+             "duration": "", "thumb": "/media/variants/ab/" + "0" * 64 + "/thumb.jpg"},
+        ],
+        "reply_to": {"message_id": 41, "username": "bob", "message": "Numbers are in the sheet"},
+        "message_id": 42,
+    }
+
+
+def per_recipient(event, recipients):
+    for _ in range(recipients):
+        payload = {
+            "message": event.get("message", ""),
+            "username": event.get("username"),
+            "attachments": event.get("attachments", []),
+            "message_id": event.get("message_id"),
+        }
+        if event.get("reply_to"):
+            payload["reply_to"] = event["reply_to"]
+        json.dumps(payload)
+
+
+def encode_once(encode, event, recipients):
+    frame = {k: v for k, v in event.items() if k != "type"}
+    channel_event = {"type": "room.frame", "text": encode(frame)}
+    for _ in range(recipients):
+        channel_event["text"]  # what room_frame() hands to send()
+
+
+class Command(BaseCommand):
+    help = "Compare per-recipient serialization with encode-once fan-out."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipients", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--no-save", action="store_true", help="Do not store the result")
+
+    def handle(self, *args, **options):
+        event = sample_event()
+        recipients = options["recipients"]
+
+        variants = {
+            "per_recipient": lambda: per_recipient(event, recipients),
+            "encode_once": lambda: encode_once(json.dumps, event, recipients),
+        }
+        if frames.orjson is not None:
+            variants["encode_once_orjson"] = lambda: encode_once(
+                lambda obj: frames.orjson.dumps(obj).decode(), event, recipients
+            )
+
+        metrics = {}
+        for name, fn in variants.items():
+            best = min(timeit.repeat(fn, number=1, repeat=options["repeat"]))
+            metrics[f"{name}_us"] = round(best * 1e6, 1)
+        metrics["speedup"] = round(metrics["per_recipient_us"] / metrics["encode_once_us"], 1)
+
+        for key, value in metrics.items():
+            self.stdout.write(f"{key:24} {value}")
+
+        params = {"recipients": recipients}
+        previous = previous_result("bench_serialize", params)
+        if previous:
+            self.stdout.write(f"\nCompared with run of {previous['time']}:")
+            for key, old, new, change, regressed in compare(previous, metrics, {"speedup"}):
+                line = f"{key:24} {old} -> {new} ({change:+.1%})"
+                self.stdout.write(self.style.ERROR(line) if regressed else line)
+
+        if not options["no_save"]:
+            save_result("bench_serialize", params, metrics)
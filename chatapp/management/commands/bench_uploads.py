@@ -0,0 +1,147 @@
+# chatapp/management/commands/bench_uploads.py
+"""
+WebSocket latency while uploads are in flight, in process:
+
+    python manage.py bench_uploads --clients 20 --uploads 8 --size-mb 16
+
+Bench clients join one room through chatproject.asgi.application and
+send timestamped messages every --interval seconds. Fan-out latency is
+sampled twice for --seconds each: idle, then while --uploads concurrent
+uploaders POST files to upload_media through the same application (and
+so the same event loop and thread pools). latency_p99_ratio is the
+loaded p99 over the idle p99; it stays close to 1 as long as upload work
+does not hold up the loop or the consumers' database calls.
+
+Runs are appended to BENCHMARK_DIR/bench_uploads.jsonl and compared with
+the previous run with the same parameters; --check exits non-zero on a
+regression. Bench messages and uploaded blobs are deleted afterwards.
+"""
+import asyncio
+import json
+import os
+import time
+
+from channels.testing import HttpCommunicator
+from django.conf import settings
+from django.core.management.base import CommandError
+
+from chatapp.benchmarks import percentile
+from chatapp.message_ops import delete_in_batches
+from chatapp.models import MediaBlob, Message
+
+from . import bench_ws
+
+ROOM = "bench_uploads"
+BOUNDARY = "benchuploadboundary"
+
+
+def multipart_body(payload, filename):
+    return b"".join([
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="room"\r\n\r\n{ROOM}\r\n'.encode(),
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'.encode(),
+        b"Content-Type: application/octet-stream\r\n\r\n",
+        payload,
+        f"\r\n--{BOUNDARY}--\r\n".encode(),
+    ])
+
+
+class Command(bench_ws.Command):
+    help = "Benchmark WebSocket fan-out latency with uploads in flight."
+    name = "bench_uploads"
+    higher_is_better = {"uploads", "upload_mb_per_sec"}
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=20)
+        parser.add_argument("--uploads", type=int, default=8, help="Concurrent uploaders")
+        parser.add_argument("--size-mb", type=int, default=16, help="Size of each uploaded file")
+        parser.add_argument("--seconds", type=float, default=10, help="Duration of each phase")
+        parser.add_argument("--interval", type=float, default=0.2, help="Seconds between a client's messages")
+        parser.add_argument("--no-save", action="store_true", help="Do not store the result")
+        parser.add_argument("--check", action="store_true", help="Fail on a regression against the previous run")
+        parser.add_argument("--tolerance", type=float, default=0.10)
+
+    def handle(self, *args, **options):
+        self.configure_backends(False)
+        sessions = self.login_users(options["clients"])
+        self.uploaded = set()
+
+        from chatproject.asgi import application
+
+        try:
+            metrics = asyncio.run(self.run(application, sessions, options))
+        finally:
+            for _ in delete_in_batches(Message.objects.filter(room__name=ROOM)):
+                pass
+            for blob in MediaBlob.objects.filter(sha256__in=self.uploaded):
+                blob.delete()
+                try:
+                    os.unlink(settings.MEDIA_ROOT / blob.path)
+                except FileNotFoundError:
+                    pass
+
+        params = {k: options[k] for k in ("clients", "uploads", "size_mb", "seconds", "interval")}
+        self.report(params, metrics, options)
+
+    # ---------------------------------------
+    # RUN
+    # ---------------------------------------
+    async def run(self, application, sessions, options):
+        clients = [bench_ws.BenchClient(application, ROOM, username, key) for username, key in sessions]
+        await asyncio.gather(*(c.connect() for c in clients))
+
+        idle = await self.sample(clients, options)
+
+        stop = asyncio.Event()
+        size = options["size_mb"] * 1024 * 1024
+        uploaders = [
+            asyncio.create_task(self.upload(application, multipart_body(os.urandom(size), f"bench_{i}.bin"), stop))
+            for i in range(options["uploads"])
+        ]
+        started = time.perf_counter()
+        loaded = await self.sample(clients, options)
+        upload_seconds = time.perf_counter() - started
+        stop.set()
+        completed = sum(await asyncio.gather(*uploaders))
+
+        await asyncio.gather(*(c.close() for c in clients))
+
+        idle_p99 = percentile(idle, 99)
+        loaded_p99 = percentile(loaded, 99)
+        return {
+            "idle_p50_ms": round(percentile(idle, 50) * 1000, 2),
+            "idle_p99_ms": round(idle_p99 * 1000, 2),
+            "loaded_p50_ms": round(percentile(loaded, 50) * 1000, 2),
+            "loaded_p99_ms": round(loaded_p99 * 1000, 2),
+            "latency_p99_ratio": round(loaded_p99 / idle_p99, 2) if idle_p99 else 0,
+            "uploads": completed,
+            "upload_mb_per_sec": round(completed * options["size_mb"] / upload_seconds, 1),
+        }
+
+    async def sample(self, clients, options):
+        """Latencies delivered while every client chats for --seconds."""
+        before = [len(c.latencies) for c in clients]
+        deadline = time.monotonic() + options["seconds"]
+
+        async def chat(client):
+            while time.monotonic() < deadline:
+                await client.send({"message": f"bench:{time.perf_counter()}"})
+                await asyncio.sleep(options["interval"])
+
+        await asyncio.gather(*(chat(c) for c in clients))
+        await asyncio.sleep(1)  # let the last deliveries arrive
+        return [s for c, n in zip(clients, before) for s in c.latencies[n:]]
+
+    async def upload(self, application, body, stop):
+        """Uploads `body` back to back until `stop` is set. Returns the uploads completed."""
+        completed = 0
+        while not stop.is_set():
+            communicator = HttpCommunicator(application, "POST", "/media/upload/", body=body, headers=[
+                (b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode()),
+                (b"content-length", str(len(body)).encode()),
+            ])
+            response = await communicator.get_response(timeout=300)
+            if response["status"] != 200:
+                raise CommandError(f"Upload failed with {response['status']}: {response['body'][:200]!r}")
+            self.uploaded.add(json.loads(response["body"])["sha256"])
+            completed += 1
+        return completed
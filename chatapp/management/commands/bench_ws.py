@@ -0,0 +1,248 @@
+# chatapp/management/commands/bench_ws.py
+"""
+Load test for the WebSocket chat path, in process:
+
+    python manage.py bench_ws --clients 2000 --rooms 20 --messages 5
+    python manage.py bench_ws --redis        # channels_redis + Redis presence
+
+Simulated clients connect to chatproject.asgi.application (real session
+auth, real ChatConsumer) and each one runs: typing -> text messages ->
+a media message -> edit and delete of its first message -> a call
+request to a room mate. Every text message carries its send time, so each
+delivery to each room member gives one fan-out latency sample.
+
+Reported: p50/p99 fan-out latency, messages/sec, DB queries per message
+and Python heap per open connection (tracemalloc, measured while
+connecting only). Runs are appended to BENCHMARK_DIR/bench_ws.jsonl and
+compared with the previous run with the same parameters; --check exits
+non-zero on a regression.
+
+Bench users are named bench_user_N, rooms bench_N; their messages are
+deleted afterwards.
+"""
+import asyncio
+import json
+import time
+import tracemalloc
+
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from chatapp import presence
+from chatapp.benchmarks import QueryCounter, compare, percentile, previous_result, save_result
+from chatapp.message_ops import delete_in_batches
+from chatapp.models import Message
+
+User = get_user_model()
+
+HIGHER_IS_BETTER = {"messages_per_sec", "deliveries_per_sec", "delivery_ratio"}
+
+
+class BenchClient:
+
+    def __init__(self, application, room, username, session_key):
+        self.room = room
+        self.username = username
+        self.communicator = WebsocketCommunicator(
+            application,
+            f"/ws/chat/{room}/",
+            headers=[(b"cookie", f"{settings.SESSION_COOKIE_NAME}={session_key}".encode())],
+        )
+        self.latencies = []
+        self.received = 0
+        self.own_ids = []
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=60)
+        if not connected:
+            raise CommandError(f"{self.username} could not connect")
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        while True:
+            output = await self.communicator.receive_output(timeout=None)
+            if output["type"] != "websocket.send":
+                continue
+            frame = json.loads(output["text"])
+            message = frame.get("message") or ""
+            if message.startswith("bench:"):
+                self.received += 1
+                self.latencies.append(time.perf_counter() - float(message.split(":")[1]))
+                if frame.get("username") == self.username and frame.get("message_id"):
+                    self.own_ids.append(frame["message_id"])
+
+    async def send(self, payload):
+        await self.communicator.send_to(text_data=json.dumps(payload))
+
+    async def close(self):
+        self.reader.cancel()
+        await self.communicator.disconnect(timeout=10)
+
+
+class Command(BaseCommand):
+    help = "Benchmark WebSocket fan-out latency, throughput, queries and memory."
+    name = "bench_ws"
+    higher_is_better = HIGHER_IS_BETTER
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=500)
+        parser.add_argument("--rooms", type=int, default=10)
+        parser.add_argument("--messages", type=int, default=5, help="Text messages per client")
+        parser.add_argument("--redis", action="store_true", help="Use channels_redis and Redis presence (needs REDIS_URL)")
+        parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for deliveries")
+        parser.add_argument("--no-save", action="store_true", help="Do not store the result")
+        parser.add_argument("--check", action="store_true", help="Fail on a regression against the previous run")
+        parser.add_argument("--tolerance", type=float, default=0.10)
+
+    def handle(self, *args, **options):
+        self.configure_backends(options["redis"])
+        sessions = self.login_users(options["clients"])
+
+        from chatproject.asgi import application
+
+        try:
+            # Installed up front: worker threads open their connections while connecting
+            with QueryCounter() as self.queries:
+                metrics = asyncio.run(self.run(application, sessions, options))
+        finally:
+            for _ in delete_in_batches(Message.objects.filter(room__name__startswith="bench_")):
+                pass
+
+        params = {k: options[k] for k in ("clients", "rooms", "messages", "redis")}
+        self.report(params, metrics, options)
+
+    # ---------------------------------------
+    # SETUP
+    # ---------------------------------------
+    def configure_backends(self, use_redis):
+        if use_redis:
+            if not settings.REDIS_URL:
+                raise CommandError("--redis needs REDIS_URL.")
+            settings.CHANNEL_LAYERS = {"default": {
+                "BACKEND": "channels_redis.core.RedisChannelLayer",
+                "CONFIG": {"hosts": [settings.REDIS_URL]},
+            }}
+            settings.PRESENCE = {"BACKEND": "chatapp.presence.RedisPresence", "TTL": 60, "HEARTBEAT": 20}
+        else:
+            # Room for every frame of the run, so deliveries are never dropped
+            settings.CHANNEL_LAYERS = {"default": {
+                "BACKEND": "channels.layers.InMemoryChannelLayer",
+                "CONFIG": {"capacity": 100000},
+            }}
+            settings.PRESENCE = {"BACKEND": "chatapp.presence.InMemoryPresence"}
+        channel_layers.backends.clear()
+        presence._presence = None
+
+    def login_users(self, count):
+        """[(username, session key)] for `count` bench users."""
+        names = [f"bench_user_{i}" for i in range(count)]
+        existing = set(User.objects.filter(username__in=names).values_list("username", flat=True))
+        User.objects.bulk_create([User(username=n, password="!") for n in names if n not in existing])
+
+        sessions = []
+        for user in User.objects.filter(username__in=names).order_by("id"):
+            client = Client()
+            client.force_login(user)
+            sessions.append((user.username, client.cookies[settings.SESSION_COOKIE_NAME].value))
+        return sessions
+
+    # ---------------------------------------
+    # RUN
+    # ---------------------------------------
+    async def run(self, application, sessions, options):
+        clients = [
+            BenchClient(application, f"bench_{i % options['rooms']}", username, key)
+            for i, (username, key) in enumerate(sessions)
+        ]
+        rooms = {}
+        for client in clients:
+            rooms.setdefault(client.room, []).append(client)
+
+        # Connect (heap growth per connection)
+        tracemalloc.start()
+        heap_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        await asyncio.gather(*(c.connect() for c in clients))
+        connect_seconds = time.perf_counter() - started
+        heap_per_connection = (tracemalloc.get_traced_memory()[0] - heap_before) / len(clients)
+        tracemalloc.stop()
+
+        # Typing + text messages (latency, throughput, queries)
+        expected = sum(len(members) ** 2 * options["messages"] for members in rooms.values())
+        queries_before = self.queries.count
+        started = time.perf_counter()
+        await asyncio.gather(*(self.chat(c, options["messages"]) for c in clients))
+        deadline = time.monotonic() + options["timeout"]
+        while sum(c.received for c in clients) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        message_seconds = time.perf_counter() - started
+        message_queries = self.queries.count - queries_before
+        sent = len(clients) * options["messages"]
+
+        # Media, edit/delete and call signaling round
+        started = time.perf_counter()
+        await asyncio.gather(*(self.interact(c, rooms[c.room]) for c in clients))
+        interact_seconds = time.perf_counter() - started
+
+        await asyncio.gather(*(c.close() for c in clients))
+
+        latencies = [s for c in clients for s in c.latencies]
+        delivered = len(latencies)
+        return {
+            "connect_seconds": round(connect_seconds, 3),
+            "heap_bytes_per_connection": round(heap_per_connection),
+            "messages_per_sec": round(sent / message_seconds, 1),
+            "deliveries_per_sec": round(delivered / message_seconds, 1),
+            "delivery_ratio": round(delivered / expected, 4) if expected else 1,
+            "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "latency_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "queries_per_message": round(message_queries / sent, 2),
+            "interact_seconds": round(interact_seconds, 3),
+        }
+
+    async def chat(self, client, messages):
+        await client.send({"type": "typing"})
+        for _ in range(messages):
+            await client.send({"message": f"bench:{time.perf_counter()}"})
+
+    async def interact(self, client, members):
+        await client.send({
+            "type": "media",
+            "media_type": "image",
+            "media_url": "/media/bench/image.png",
+            "name": "image.png",
+        })
+        if client.own_ids:
+            await client.send({"type": "edit_message", "message_id": client.own_ids[0], "content": "edited"})
+            await client.send({"type": "delete_message", "message_id": client.own_ids[0]})
+
+        peer = members[(members.index(client) + 1) % len(members)]
+        await client.send({"type": "call_request", "target": peer.username})
+        await client.send({"type": "call_end", "target": peer.username})
+
+    # ---------------------------------------
+    # OUTPUT
+    # ---------------------------------------
+    def report(self, params, metrics, options):
+        for key, value in metrics.items():
+            self.stdout.write(f"{key:28} {value}")
+
+        previous = previous_result(self.name, params)
+        regressions = []
+        if previous:
+            self.stdout.write(f"\nCompared with run of {previous['time']}:")
+            for key, old, new, change, regressed in compare(previous, metrics, self.higher_is_better, options["tolerance"]):
+                line = f"{key:28} {old} -> {new} ({change:+.1%})"
+                self.stdout.write(self.style.ERROR(line) if regressed else line)
+                if regressed:
+                    regressions.append(key)
+
+        if not options["no_save"]:
+            save_result(self.name, params, metrics)
+
+        if options["check"] and regressions:
+            raise CommandError(f"Regressed: {', '.join(regressions)}")
@@ -0,0 +1,51 @@
+# chatapp/management/commands/check_media_pipeline.py
+"""
+Render variants of a generated image through the real media process
+pool and fail unless a thumbnail and a preview come back. Meant to run in
+CI, and after deploying to a new image (Pillow, ffmpeg):
+
+    python manage.py check_media_pipeline
+
+The pool's workers are spawned like under Daphne: they import only what
+the job needs, without Django being set up (see media_variants.py).
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatapp import media_pipeline
+
+
+class Command(BaseCommand):
+    help = "Check that the media process pool renders thumbnails and previews."
+
+    def handle(self, *args, **options):
+        from PIL import Image
+
+        config = settings.MEDIA_PIPELINE
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "source.png")
+            Image.new("RGB", (config["PREVIEW_SIZE"] * 2, config["PREVIEW_SIZE"]), (40, 120, 200)).save(src)
+            dest_dir = os.path.join(tmp, "variants")
+
+            future = media_pipeline._get_pool().submit(
+                media_pipeline.make_variants, src, dest_dir, "image", config["THUMBNAIL_SIZE"], config["PREVIEW_SIZE"],
+            )
+            try:
+                variants = future.result(timeout=120)
+            except Exception as e:
+                raise CommandError(f"Media worker failed: {e!r}") from e
+            finally:
+                media_pipeline._get_pool().shutdown()
+                media_pipeline._pool = None
+
+            for name in ("thumbnail", "preview"):
+                if not variants.get(name) or not os.path.getsize(os.path.join(dest_dir, variants[name])):
+                    raise CommandError(f"No {name} rendered: {variants}")
+            with Image.open(os.path.join(dest_dir, variants["thumbnail"])) as thumb:
+                if max(thumb.size) != config["THUMBNAIL_SIZE"]:
+                    raise CommandError(f"Thumbnail is {thumb.size}, expected a side of {config['THUMBNAIL_SIZE']}")
+
+        self.stdout.write(self.style.SUCCESS(f"Media pipeline ok ({variants['width']}x{variants['height']} source)"))
@@ -0,0 +1,180 @@
+# chatapp/management/commands/check_query_plans.py
+"""
+EXPLAIN the hot queries against a seeded dataset and fail if any of them
+falls back to a sequential scan or stops using the index built for it. Meant to run in CI against PostgreSQL:
+
+    python manage.py check_query_plans --rows 20000
+
+Seed data is created inside a transaction that is rolled back at the end.
+Sequential scans are disabled for the session, so Postgres only picks one
+when no usable index exists — which is exactly the regression we look for.
+On partitioned tables the plan names each partition's copy of an index;
+the copy of every partition holding rows must be used.
+"""
+import re
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chatapp.history import PAGE_SIZE, page_queryset
+from chatapp.models import CallRecording, ChatRoom, MediaFile, Message, ReadCursor
+
+User = get_user_model()
+
+SEQ_SCAN = re.compile(r"Seq Scan on (\w+)")
+
+# An index and the indexes of every partition below it, with whether their table has rows
+INDEX_TREE_SQL = """
+WITH RECURSIVE tree(oid) AS (
+    SELECT %s::regclass::oid
+    UNION ALL
+    SELECT i.inhrelid FROM pg_inherits i JOIN tree ON i.inhparent = tree.oid
+)
+SELECT c.relname, c.relkind, t.reltuples > 0
+FROM tree
+JOIN pg_class c ON c.oid = tree.oid
+JOIN pg_index x ON x.indexrelid = c.oid
+JOIN pg_class t ON t.oid = x.indrelid
+"""
+
+
+def index_tree(index):
+    """{name: (relkind, table has rows)} of `index` and its partitions' indexes."""
+    with connection.cursor() as cursor:
+        cursor.execute(INDEX_TREE_SQL, [index])
+        return {name: (kind, populated) for name, kind, populated in cursor.fetchall()}
+
+
+def required_indexes(index):
+    """
+    The copies of `index` a plan must use: on a partitioned table, those
+    of every partition holding rows (an empty partition using its copy
+    proves nothing), otherwise the index itself.
+    """
+    leaves = {name: populated for name, (kind, populated) in index_tree(index).items() if kind == "i"}
+    return [name for name, populated in leaves.items() if populated] or list(leaves)
+
+
+class Command(BaseCommand):
+    help = "Fail if a hot query plan regresses to a sequential scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=20000, help="Messages to seed")
+        parser.add_argument("--verbose-plans", action="store_true", help="Print every plan")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Query plan checks need PostgreSQL.")
+
+        with transaction.atomic():
+            fixtures = self.seed(options["rows"])
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+                # What autovacuum would do: seeded rows still sit in the GIN pending list
+                for name, (kind, _) in index_tree("chatapp_msg_search_idx").items():
+                    if kind == "i":  # partitioned indexes have no storage of their own
+                        cursor.execute("SELECT gin_clean_pending_list(%s::regclass)", [name])
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+            failures = []
+            for name, qs, index in self.hot_queries(**fixtures):
+                plan = qs.explain()
+                problems = [f"seq scan on {table}" for table in SEQ_SCAN.findall(plan)]
+                missing = [index_name for index_name in required_indexes(index) if index_name not in plan] if index else []
+                if missing:
+                    problems.append(f"{index} not used ({', '.join(missing)})")
+
+                status = self.style.ERROR("; ".join(problems)) if problems else self.style.SUCCESS("ok")
+                self.stdout.write(f"{name:<32} {status}")
+                if problems:
+                    failures.append((name, problems))
+                if problems or options["verbose_plans"]:
+                    self.stdout.write(plan + "\n")
+
+            transaction.set_rollback(True)
+
+        if failures:
+            summary = ", ".join(f"{name} ({'; '.join(problems)})" for name, problems in failures)
+            raise CommandError(f"Query plan regressions: {summary}")
+
+    # ---------------------------------------
+    # SEED DATA
+    # ---------------------------------------
+    def seed(self, rows):
+        users = User.objects.bulk_create([User(username=f"plan_user_{i}") for i in range(20)])
+        rooms = ChatRoom.objects.bulk_create([ChatRoom(name=f"plan_room_{i}") for i in range(10)])
+
+        messages = Message.objects.bulk_create([
+            Message(room=rooms[i % len(rooms)], user=users[i % len(users)], content=f"message {i}")
+            for i in range(rows)
+        ], batch_size=5000)
+
+        MediaFile.objects.bulk_create([
+            MediaFile(message=msg, file_url=f"/media/plan/{msg.id}.png", media_type="image")
+            for msg in messages[::10]
+        ], batch_size=5000)
+
+        ReadCursor.objects.bulk_create([ReadCursor(user=u, room=r) for u in users for r in rooms])
+
+        now = timezone.now()
+        CallRecording.objects.bulk_create([
+            CallRecording(
+                caller=users[i % len(users)].username,
+                receiver=users[(i + 1) % len(users)].username,
+                room_name=rooms[i % len(rooms)].name if i % 3 == 0 else None,
+                file_url=f"/media/recordings/plan_{i}.webm",
+                ended_at=now - timedelta(minutes=i),
+            )
+            for i in range(rows // 10)
+        ], batch_size=5000)
+
+        return {"room": rooms[0], "user": users[0], "message": messages[len(messages) // 2]}
+
+    # ---------------------------------------
+    # QUERIES UNDER TEST
+    # ---------------------------------------
+    def hot_queries(self, room, user, message):
+        """Yields (name, queryset, index the plan must use or None)."""
+        # history.fetch_page, built the same way
+        yield "chat history (newest page)", (
+            page_queryset(room.id)[:PAGE_SIZE + 1]
+        ), "chatapp_msg_room_ts_id_idx"
+        yield "chat history (keyset page)", (
+            page_queryset(room.id, (message.timestamp, message.id))[:PAGE_SIZE + 1]
+        ), "chatapp_msg_room_ts_id_idx"
+        # a selective term: a word in every row is cheaper to filter than to look up
+        yield "message search", (
+            Message.objects.filter(room_id=room.id, search_vector=SearchQuery(message.content.split()[-1], config="english"))
+        ), "chatapp_msg_search_idx"
+        yield "history media prefetch", MediaFile.objects.filter(message_id__in=[message.id]), None
+
+        # admin dashboard lists
+        yield "admin media list", (
+            MediaFile.objects.order_by("-uploaded_at")[:100]
+        ), "chatapp_media_uploaded_idx"
+        yield "admin call records list", (
+            CallRecording.objects.order_by("-created_at")[:100]
+        ), "chatapp_callrec_created_idx"
+        yield "call records by caller", (
+            CallRecording.objects.filter(caller=user.username).order_by("-created_at")[:100]
+        ), "chatapp_callrec_caller_idx"
+        yield "call records by receiver", (
+            CallRecording.objects.filter(receiver=user.username).order_by("-created_at")[:100]
+        ), "chatapp_callrec_receiver_idx"
+        yield "call records by room", (
+            CallRecording.objects.filter(room_name=room.name).order_by("-created_at")[:100]
+        ), "chatapp_callrec_room_idx"
+
+        # rooms API (room_summary.room_list)
+        yield "rooms of a user", (
+            ReadCursor.objects.filter(user_id=user.id).select_related("room", "room__last_message_user")
+        ), "chatapp_readcursor_user_room_uniq"
+
+        # message_ops.edit_message / delete_message
+        yield "edit/delete lookup", (
+            Message.objects.filter(id=message.id, user_id=user.id, room_id=room.id)
+        ), "chatapp_message_pkey"
@@ -0,0 +1,25 @@
+# chatapp/management/commands/gc_media_blobs.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from chatapp.media_store import collect_garbage
+
+
+class Command(BaseCommand):
+    help = "Delete stored media blobs that no message, archived message or call recording references."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-hours", type=float, default=24,
+            help="Keep unreferenced blobs uploaded within this window (default 24)",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be removed")
+
+    def handle(self, *args, **options):
+        removed, freed = collect_garbage(
+            grace=timedelta(hours=options["grace_hours"]),
+            dry_run=options["dry_run"],
+        )
+        verb = "Would remove" if options["dry_run"] else "Removed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {removed} blobs ({freed / 1024 / 1024:.1f} MB)"))
@@ -0,0 +1,37 @@
+# chatapp/management/commands/recount_rooms.py
+"""
+Rebuild ChatRoom.message_count / last message and the read counts of
+each room's ReadCursors from the messages themselves:
+
+    python manage.py recount_rooms               # every room
+    python manage.py recount_rooms lobby dev     # just these
+
+Needed once after migrating, for rooms whose messages predate the
+counters; afterwards writes and deletes keep them current. One room per
+transaction, so writers to other rooms are never held up.
+"""
+from django.core.management.base import BaseCommand
+
+from chatapp.models import ChatRoom
+from chatapp.room_summary import recount_room
+
+
+class Command(BaseCommand):
+    help = "Recount the message and unread counters of chat rooms."
+
+    def add_arguments(self, parser):
+        parser.add_argument("rooms", nargs="*", help="Room names (default: all)")
+
+    def handle(self, *args, **options):
+        rooms = ChatRoom.objects.order_by("id")
+        if options["rooms"]:
+            rooms = rooms.filter(name__in=options["rooms"])
+
+        count = 0
+        for room_id, name in rooms.values_list("id", "name"):
+            recount_room(room_id)
+            count += 1
+            if options["verbosity"] > 1:
+                self.stdout.write(f"  {name}")
+
+        self.stdout.write(self.style.SUCCESS(f"Recounted {count} rooms"))
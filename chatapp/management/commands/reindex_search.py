@@ -0,0 +1,49 @@
+# chatapp/management/commands/reindex_search.py
+"""
+Fill in (or rebuild) Message.search_vector in id-range batches:
+
+    python manage.py reindex_search              # rows never indexed
+    python manage.py reindex_search --all        # e.g. after changing the search config
+
+New and edited messages are indexed by the database trigger; this is only
+needed once after migrating, for rows written before the trigger existed.
+Each batch commits on its own, so the table is never locked for long.
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max, Min
+
+from chatapp.models import Message
+
+
+class Command(BaseCommand):
+    help = "Compute the full-text search vector of existing messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--all", action="store_true", help="Reindex rows that already have a vector too")
+
+    def handle(self, *args, **options):
+        bounds = Message.objects.aggregate(low=Min("id"), high=Max("id"))
+        if bounds["low"] is None:
+            self.stdout.write("No messages.")
+            return
+
+        sql = (
+            "UPDATE chatapp_message "
+            "SET search_vector = chatapp_message_search_vector(content, attachments_json) "
+            "WHERE id BETWEEN %s AND %s"
+        )
+        if not options["all"]:
+            sql += " AND search_vector IS NULL"
+
+        updated = 0
+        batch = options["batch_size"]
+        for start in range(bounds["low"], bounds["high"] + 1, batch):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [start, start + batch - 1])
+                updated += cursor.rowcount
+            if options["verbosity"] > 1:
+                self.stdout.write(f"  up to id {start + batch - 1}: {updated}")
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {updated} messages"))
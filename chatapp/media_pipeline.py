@@ -0,0 +1,125 @@
+# chatapp/media_pipeline.py
+"""
+Background media processing.
+
+After an image or video is uploaded, a small process pool (started lazily
+inside the Daphne process) renders a thumbnail and a compressed preview
+next to the stored blob. The results are recorded on MediaBlob and
+announced to the room with a `media_ready` frame, so clients can swap the
+full-size file they were showing for the lightweight variant.
+
+Variants are keyed by content hash, so a deduplicated upload is processed
+only once. Pillow is required for images; ffmpeg (if on PATH) is used to
+grab poster frames from videos.
+
+The rendering itself is in media_variants.py: pool workers are spawned
+fresh and never set up Django, so what they import must not need it.
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.utils import timezone
+
+from .frames import room_event
+from .media_store import sha256_from_url
+from .media_variants import make_variants
+from .metrics import database_sync_to_async, group_send
+from .models import MediaBlob
+from .profiling import untraced_context
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_TYPES = {"image", "video"}
+
+_pool = None
+_tasks = set()  # keep references so running jobs are not garbage collected
+
+
+# ---------------------------------------
+# SERVER SIDE (runs on the ASGI event loop)
+# ---------------------------------------
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.MEDIA_PIPELINE["WORKERS"],
+            # fork() from a threaded async server is unsafe
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def variants_dir(blob):
+    return f"variants/{blob.sha256[:2]}/{blob.sha256}"
+
+
+async def schedule(blob, media_type, room_name=None):
+    """Queue variant generation for a freshly stored blob. Returns immediately."""
+    if media_type not in PROCESSED_TYPES or blob.processed_at:
+        return
+    task = asyncio.get_running_loop().create_task(_process(blob, media_type, room_name), context=untraced_context())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _process(blob, media_type, room_name):
+    config = settings.MEDIA_PIPELINE
+    rel_dir = variants_dir(blob)
+
+    try:
+        variants = await asyncio.get_running_loop().run_in_executor(
+            _get_pool(),
+            make_variants,
+            str(settings.MEDIA_ROOT / blob.path),
+            str(settings.MEDIA_ROOT / rel_dir),
+            media_type,
+            config["THUMBNAIL_SIZE"],
+            config["PREVIEW_SIZE"],
+        )
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM on a huge image): start a fresh pool next time
+        global _pool
+        _pool = None
+        logger.exception("Media worker crashed processing %s", blob.path)
+        return
+    except Exception:
+        logger.exception("Media processing failed for %s", blob.path)
+        return
+
+    fields = {
+        "thumbnail_path": f"{rel_dir}/{variants['thumbnail']}" if variants.get("thumbnail") else "",
+        "preview_path": f"{rel_dir}/{variants['preview']}" if variants.get("preview") else "",
+        "width": variants.get("width"),
+        "height": variants.get("height"),
+        "processed_at": timezone.now(),
+    }
+    await database_sync_to_async(MediaBlob.objects.filter(pk=blob.pk).update)(**fields)
+
+    if room_name and fields["thumbnail_path"]:
+        await group_send(f"chat_{room_name}", room_event({
+            "type": "media_ready",
+            "url": settings.MEDIA_URL + blob.path,
+            "thumb": settings.MEDIA_URL + fields["thumbnail_path"],
+            "preview": settings.MEDIA_URL + fields["preview_path"] if fields["preview_path"] else "",
+        }))
+
+
+def variants_for_urls(urls):
+    """{url: {"thumb": ..., "preview": ...}} for already processed blobs."""
+    hashes = {sha256_from_url(url): url for url in urls}
+    blobs = MediaBlob.objects.filter(
+        sha256__in=[h for h in hashes if h],
+        processed_at__isnull=False,
+    ).exclude(thumbnail_path="").values_list("sha256", "thumbnail_path", "preview_path")
+
+    result = {}
+    for sha256, thumbnail_path, preview_path in blobs:
+        variants = {"thumb": settings.MEDIA_URL + thumbnail_path}
+        if preview_path:
+            variants["preview"] = settings.MEDIA_URL + preview_path
+        result[hashes[sha256]] = variants
+    return result
@@ -0,0 +1,201 @@
+# chatapp/media_serving.py
+"""
+ASGI handler for files under MEDIA_URL.
+
+Wraps the Django HTTP application in chatproject/asgi.py and answers
+GET/HEAD requests for existing media files itself, so a file is never read
+into memory by a Django view:
+
+* Range requests (single range, with If-Range) for seeking voice notes,
+  videos and call recordings
+* ETag / Last-Modified validators, answered with 304 when unchanged
+* `immutable` caching for content-addressed paths (cas/, variants/),
+  whose bytes can never change under the same URL
+* zero-copy responses through the ASGI `http.response.zerocopy` extension
+  when the server offers it, otherwise the file is streamed in blocks read
+  off the event loop
+* with MEDIA_ACCEL_REDIRECT set, only the headers are produced and the
+  body is handed to the front proxy (nginx X-Accel-Redirect)
+
+Anything else (uploads, missing files) falls through to Django.
+"""
+import asyncio
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+from django.utils.http import parse_http_date_safe
+
+READ_BLOCK = 256 * 1024
+
+IMMUTABLE_PREFIXES = ("cas/", "variants/")
+PRIVATE_PREFIXES = ("upload_sessions/", "cas/tmp/")
+
+# Content type of compressed files, sent without Content-Encoding
+ENCODED_TYPES = {"gzip": "application/gzip", "bzip2": "application/x-bzip2", "xz": "application/x-xz"}
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "public, no-cache"
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single-range `Range` header, None to
+    serve the whole file, or ValueError if the range is unsatisfiable.
+    """
+    match = RANGE.match(header.strip().replace(" ", ""))
+    if not match or not (match.group(1) or match.group(2)):
+        return None  # multiple or malformed ranges: the full file is a valid answer
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        start, end = max(size - length, 0), size - 1
+
+    if start >= size:
+        raise ValueError("Range starts past the end of the file")
+    return start, end
+
+
+def etag_matches(header, etag):
+    """If-None-Match comparison (weak, as RFC 9110 requires for it)."""
+    if header.strip() == "*":
+        return True
+    strip = lambda tag: tag.strip().removeprefix("W/")
+    return strip(etag) in {strip(tag) for tag in header.split(",")}
+
+
+class MediaFilesHandler:
+
+    def __init__(self, application):
+        self.application = application
+        self.prefix = settings.MEDIA_URL
+        self.root = os.path.realpath(settings.MEDIA_ROOT)
+        self.private_dirs = [os.path.join(self.root, prefix.rstrip("/")) for prefix in PRIVATE_PREFIXES]
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and scope["method"] in ("GET", "HEAD")
+            and scope["path"].startswith(self.prefix)
+        ):
+            path = self.resolve(scope["path"][len(self.prefix):])
+            if path:
+                # Checked on the resolved path: "cas/../upload_sessions/x.part" is private too
+                if self.is_private(path):
+                    return await self.respond(send, 404, {})
+                if os.path.isfile(path):
+                    relpath = os.path.relpath(path, self.root).replace(os.sep, "/")
+                    return await self.serve(scope, send, relpath, path)
+
+        return await self.application(scope, receive, send)
+
+    def resolve(self, relpath):
+        """Real absolute path of `relpath` if it is inside MEDIA_ROOT, or None."""
+        try:
+            path = os.path.realpath(safe_join(self.root, relpath))
+        except SuspiciousFileOperation:
+            return None
+        return path if path.startswith(self.root + os.sep) else None  # e.g. a symlink out
+
+    def is_private(self, path):
+        return any(path == directory or path.startswith(directory + os.sep) for directory in self.private_dirs)
+
+    # ---------------------------------------
+    # RESPONSE
+    # ---------------------------------------
+    async def serve(self, scope, send, relpath, path):
+        request = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        stat = os.stat(path)
+        size = stat.st_size
+
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        content_type, encoding = mimetypes.guess_type(path)
+        if encoding:
+            # The bytes as stored: a .gz is downloaded as is, not unpacked by the browser
+            content_type = ENCODED_TYPES.get(encoding, "application/octet-stream")
+
+        headers = {
+            "etag": etag,
+            "last-modified": last_modified,
+            "accept-ranges": "bytes",
+            "cache-control": IMMUTABLE_CACHE if relpath.startswith(IMMUTABLE_PREFIXES) else REVALIDATE_CACHE,
+        }
+
+        # Conditional GET
+        if "if-none-match" in request:
+            not_modified = etag_matches(request["if-none-match"], etag)
+        else:
+            since = parse_http_date_safe(request.get("if-modified-since", ""))
+            not_modified = since is not None and int(stat.st_mtime) <= since
+        if not_modified:
+            return await self.respond(send, 304, headers)
+
+        headers["content-type"] = content_type or "application/octet-stream"
+
+        # The front proxy streams the body (and handles Range itself)
+        if settings.MEDIA_ACCEL_REDIRECT:
+            headers["x-accel-redirect"] = settings.MEDIA_ACCEL_REDIRECT + relpath
+            return await self.respond(send, 200, headers)
+
+        # Byte ranges; If-Range falls back to the full file when it is stale
+        status, start, end = 200, 0, size - 1
+        if "range" in request and request.get("if-range", etag) in (etag, last_modified):
+            try:
+                byte_range = parse_range(request["range"], size)
+            except ValueError:
+                headers["content-range"] = f"bytes */{size}"
+                return await self.respond(send, 416, headers)
+            if byte_range:
+                status, (start, end) = 206, byte_range
+                headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        count = end - start + 1 if size else 0
+        headers["content-length"] = str(count)
+
+        if scope["method"] == "HEAD" or not count:
+            return await self.respond(send, status, headers)
+
+        with open(path, "rb") as f:
+            await send({"type": "http.response.start", "status": status, "headers": self.encode(headers)})
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopy", "file": f, "offset": start, "count": count})
+            else:
+                await self.stream(send, f.fileno(), start, count)
+
+    async def stream(self, send, fd, offset, count):
+        loop = asyncio.get_running_loop()
+        while count:
+            block = await loop.run_in_executor(None, os.pread, fd, min(READ_BLOCK, count), offset)
+            if not block:
+                break  # file truncated underneath us
+            offset += len(block)
+            count -= len(block)
+            await send({"type": "http.response.body", "body": block, "more_body": bool(count)})
+        if count:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def respond(self, send, status, headers):
+        if status >= 400:
+            headers["content-length"] = "0"
+        await send({"type": "http.response.start", "status": status, "headers": self.encode(headers)})
+        await send({"type": "http.response.body", "body": b""})
+
+    @staticmethod
+    def encode(headers):
+        return [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()]
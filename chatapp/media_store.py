@@ -0,0 +1,126 @@
+# chatapp/media_store.py
+"""
+Content-addressed media store.
+
+Files live under MEDIA_ROOT/cas/<aa>/<bb>/<sha256><ext>, named by the
+SHA-256 of their bytes. An upload is written to disk once, on the media
+filesystem (cas/tmp/ via upload_handlers.py, or a resumable session of
+upload_sessions.py), and ingest_file() renames it into place. A duplicate
+is detected by its hash: the spooled copy is simply dropped and the
+existing blob is reused.
+
+Blobs are referenced by MediaFile / CallRecording rows. collect_garbage()
+removes blobs nobody references any more (after a grace period, because an
+upload exists before the message that uses it is sent).
+"""
+import os
+import re
+import shutil
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MediaBlob
+
+CAS_DIR = "cas"
+CAS_URL = re.compile(r"/cas/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})")
+
+
+def blob_relpath(sha256, ext=""):
+    return f"{CAS_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext.lower()}"
+
+
+def blob_url(blob):
+    return settings.MEDIA_URL + blob.path
+
+
+def sha256_from_url(url):
+    """The content hash a media URL points at, or None if it is not a CAS URL."""
+    match = CAS_URL.search(url or "")
+    return match.group(1) if match else None
+
+
+def spool_dir():
+    path = settings.MEDIA_ROOT / CAS_DIR / "tmp"
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def ingest_file(path, sha256, size, ext=""):
+    """
+    Move an already-hashed file on the media filesystem into the store.
+    The file at `path` is consumed either way. Returns (blob, deduplicated).
+    """
+    blob = MediaBlob.objects.filter(sha256=sha256).first()
+    if blob and (settings.MEDIA_ROOT / blob.path).exists():
+        os.unlink(path)
+        blob.save(update_fields=["last_used_at"])  # keep it away from the GC
+        return blob, True
+
+    relpath = blob.path if blob else blob_relpath(sha256, ext)
+    final_path = settings.MEDIA_ROOT / relpath
+    os.makedirs(final_path.parent, exist_ok=True)
+    os.chmod(path, 0o644)
+    os.replace(path, final_path)
+
+    if blob is None:
+        blob, _ = MediaBlob.objects.get_or_create(sha256=sha256, defaults={"path": relpath, "size": size})
+    return blob, False
+
+
+def blob_ids_for_urls(urls):
+    """{url: blob id} for the URLs that point into the store."""
+    hashes = {url: sha256_from_url(url) for url in urls}
+    ids = dict(
+        MediaBlob.objects
+        .filter(sha256__in={h for h in hashes.values() if h})
+        .values_list("sha256", "id")
+    )
+    return {url: ids[h] for url, h in hashes.items() if h in ids}
+
+
+def collect_garbage(grace=timedelta(days=1), dry_run=False):
+    """
+    Delete blobs no MediaFile or CallRecording references and that have not
+    been uploaded again within `grace`. Blobs of archived messages are kept
+    (see archive.py). Returns (blobs removed, bytes freed).
+    """
+    cutoff = timezone.now() - grace
+    removed, freed = 0, 0
+
+    candidates = MediaBlob.objects.filter(
+        media_files__isnull=True,
+        call_recordings__isnull=True,
+        archived=False,
+        last_used_at__lt=cutoff,
+    )
+    for blob in candidates.iterator():
+        if dry_run:
+            removed, freed = removed + 1, freed + blob.size
+            continue
+
+        with transaction.atomic():
+            # Re-check under a row lock: a message may have linked it meanwhile
+            locked = MediaBlob.objects.select_for_update().filter(pk=blob.pk).first()
+            if locked is None or locked.archived or locked.media_files.exists() or locked.call_recordings.exists():
+                continue
+            locked.delete()
+
+        try:
+            os.unlink(settings.MEDIA_ROOT / blob.path)
+        except FileNotFoundError:
+            pass
+        if blob.thumbnail_path:
+            # Rendered thumbnail / preview share one directory per blob
+            shutil.rmtree(settings.MEDIA_ROOT / os.path.dirname(blob.thumbnail_path), ignore_errors=True)
+        removed, freed = removed + 1, freed + blob.size
+
+    # Spool files of uploads that crashed half-way
+    for tmp in spool_dir().iterdir():
+        if tmp.stat().st_mtime < time.time() - grace.total_seconds() and not dry_run:
+            tmp.unlink()
+
+    return removed, freed
@@ -0,0 +1,64 @@
+# chatapp/media_variants.py
+"""
+Thumbnail / preview rendering, run in media_pipeline's process pool.
+
+The pool spawns its workers, and a spawned worker imports this module
+without Django being set up: keep it free of Django and chatapp imports.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+def _save_resized(image, max_side, dest, quality):
+    copy = image.copy()
+    copy.thumbnail((max_side, max_side))
+    copy.save(dest, "JPEG", quality=quality, optimize=True, progressive=True)
+
+
+def make_variants(src, dest_dir, media_type, thumbnail_size, preview_size):
+    """
+    Render thumbnail/preview JPEGs for `src` into `dest_dir`.
+    Returns {"thumbnail", "preview", "width", "height"} (file names are
+    relative to dest_dir), or {} if the file cannot be processed.
+    """
+    from PIL import Image, ImageOps
+
+    os.makedirs(dest_dir, exist_ok=True)
+    frame = src
+
+    if media_type == "video":
+        ffmpeg = shutil.which("ffmpeg")
+        if not ffmpeg:
+            return {}
+        fd, frame = tempfile.mkstemp(suffix=".jpg", dir=dest_dir)
+        os.close(fd)
+        # First frame after one second, or the very first for short clips
+        for seek in ("1", "0"):
+            result = subprocess.run(
+                [ffmpeg, "-y", "-loglevel", "error", "-ss", seek, "-i", src, "-frames:v", "1", frame],
+                capture_output=True, timeout=60,
+            )
+            if result.returncode == 0 and os.path.getsize(frame):
+                break
+        else:
+            os.unlink(frame)
+            return {}
+
+    try:
+        with Image.open(frame) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            width, height = image.size
+
+            _save_resized(image, thumbnail_size, os.path.join(dest_dir, "thumb.jpg"), quality=75)
+            variants = {"thumbnail": "thumb.jpg", "width": width, "height": height}
+
+            # Only worth a preview if it is meaningfully smaller than the original
+            if media_type == "video" or max(width, height) > preview_size or os.path.getsize(src) > 512 * 1024:
+                _save_resized(image, preview_size, os.path.join(dest_dir, "preview.jpg"), quality=82)
+                variants["preview"] = "preview.jpg"
+            return variants
+    finally:
+        if frame != src:
+            os.unlink(frame)
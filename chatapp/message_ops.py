@@ -0,0 +1,111 @@
+# chatapp/message_ops.py
+"""
+Message edits and deletions as single conditional statements.
+
+An edit is one UPDATE filtered on the message, its author's id and the
+room, so a message that is not the sender's simply matches no row.
+
+Deleting through the ORM (Model.delete / QuerySet.delete) loads every
+message and its MediaFile rows into Python to collect the cascade.
+MediaFile is the only table referencing Message, so delete_batch()
+spells the cascade out instead: one statement deletes up to `limit`
+messages together with their media rows (foreign keys are checked at
+commit, so the order within the statement does not matter) and returns
+the deleted ids. The rooms' counters and read cursors are adjusted in
+the same transaction (room_summary.py).
+
+Bulk operations (a list of ids, clearing a room, purging a user) run
+delete_batch() until nothing matches, so each transaction, and the locks
+it holds, stays bounded at BATCH_SIZE messages however much is deleted.
+
+Clients are told with frames logged for reconnect replay:
+    message_deleted    {message_id}     one message (sent by ChatConsumer)
+    messages_deleted   {message_ids}    a batch of messages
+    user_purged        {username}       all of that user's messages
+    room_cleared       {}               every message of the room
+"""
+from collections import defaultdict
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connection, transaction
+
+from . import room_summary
+from .event_log import get_event_log
+from .frames import encoded_event
+from .metrics import group_send
+from .models import MediaFile, Message
+from .recent_messages import get_recent_messages
+
+BATCH_SIZE = 1000
+
+DELETE_SQL = """
+WITH doomed AS ({select}),
+     media AS (
+       DELETE FROM {media_table} WHERE message_id IN (SELECT id FROM doomed)
+     )
+DELETE FROM {message_table} WHERE id IN (SELECT id FROM doomed)
+RETURNING id, room_id
+"""
+
+
+def edit_message(message_id, user_id, room_id, content):
+    """True if the user's message was found (and updated)."""
+    with transaction.atomic():
+        if Message.objects.filter(id=message_id, user_id=user_id, room_id=room_id).update(content=content) != 1:
+            return False
+        room_summary.edit_message(room_id, message_id, content)
+    return True
+
+
+def delete_message(message_id, user_id, room_id):
+    """True if the user's message was found (and deleted)."""
+    return bool(delete_batch(Message.objects.filter(id=message_id, user_id=user_id, room_id=room_id), limit=1))
+
+
+def delete_batch(messages, limit=BATCH_SIZE):
+    """
+    Delete up to `limit` of the messages matched by queryset `messages`,
+    with their MediaFile rows, in one statement. Returns [(id, room_id)].
+    """
+    try:
+        select, params = messages.order_by().values("id")[:limit].query.sql_with_params()
+    except EmptyResultSet:  # e.g. id__in=[]: matches nothing, nothing to run
+        return []
+    sql = DELETE_SQL.format(
+        select=select,
+        media_table=connection.ops.quote_name(MediaFile._meta.db_table),
+        message_table=connection.ops.quote_name(Message._meta.db_table),
+    )
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        room_summary.remove_messages(rows)
+    return rows
+
+
+def delete_in_batches(messages, batch_size=BATCH_SIZE):
+    """
+    Delete every message matched by `messages`, one delete_batch() at a
+    time. Yields {room_id: [ids]} per batch.
+    """
+    while True:
+        rows = delete_batch(messages, batch_size)
+        if not rows:
+            return
+        deleted = defaultdict(list)
+        for msg_id, room_id in rows:
+            deleted[room_id].append(msg_id)
+        yield deleted
+        if len(rows) < batch_size:
+            return
+
+
+# ---------------------------------------
+# NOTIFYING ROOMS (runs on the ASGI event loop)
+# ---------------------------------------
+async def publish_deletion(room_id, room_name, frame):
+    """Drop the room's cached messages and send `frame` to its clients."""
+    await get_recent_messages().clear(room_id)
+    text = await get_event_log().append(room_name, frame)
+    await group_send(f"chat_{room_name}", encoded_event(text, seq=frame["seq"]))
@@ -0,0 +1,363 @@
+# chatapp/metrics.py
+"""
+Process-local metrics, served at /metrics in the Prometheus text format.
+
+Counters, gauges and histograms live in this process's memory: each
+Daphne worker exposes its own numbers, and Prometheus adds them up
+across targets. Updating one is a dict update under an uncontended
+lock, cheap enough for the per-frame path.
+
+    chat_connections{room}                      open WebSockets
+    chat_frames_received_total{type}            inbound frames
+    chat_frame_seconds{type}                    time ChatConsumer.receive spent on a frame
+    chat_frame_db_queries{type}                 queries run while handling a frame
+    chat_group_send_seconds                     channel layer group_send
+    chat_db_queue_wait_seconds                  database_sync_to_async: waiting for a thread
+    chat_db_execute_seconds                     database_sync_to_async: running
+    chat_blocking_io_wait_seconds / _execute_seconds   same for blocking_io.run_blocking
+    chat_http_request_seconds{view,method,status}
+    chat_upload_bytes_total{endpoint}
+    chat_channel_layer_backlog                  undelivered frames (in-memory layer)
+    chat_outbound_queued                        frames waiting in WebSocket outbound queues
+    chat_outbound_dropped_total{reason}         typing / presence frames coalesced or shed
+    chat_outbound_evictions_total{reason}       clients disconnected for falling behind
+    chat_events_total{event}                    rate_limit.counters (typing, cache hits, ...)
+
+Database queries are attributed to a frame through a context variable
+holding its profiling.RequestTrace: sync_to_async copies the caller's
+context into the worker thread, so the execute wrapper installed on
+every connection counts into whatever frame started the call. The same
+trace feeds the slow frame log.
+"""
+import bisect
+import contextvars
+import functools
+import threading
+import time
+import weakref
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from channels.db import DatabaseSyncToAsync
+from channels.layers import get_channel_layer
+from django.db.backends.signals import connection_created
+
+from .profiling import RequestTrace, current_trace, get_slow_log
+from .rate_limit import counters
+
+# Seconds; from a fast Redis round trip up to a slow upload
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+FRAME_TYPES = {
+    "message", "media", "typing", "history", "read", "edit_message", "delete_message",
+    "delete_messages", "purge_user", "clear_room",
+    "call_request", "call_accept", "call_reject", "call_timeout", "offer", "answer", "ice", "call_end",
+}
+
+_registry = []
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # label values -> value
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect  # computed at scrape time instead
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        with self.lock:
+            value = self.values.get(labels, 0) - amount
+            if value or not labels:
+                self.values[labels] = value
+            else:
+                self.values.pop(labels, None)  # e.g. a room nobody is in any more
+
+    def render(self):
+        if self.collect is not None:
+            value = self.collect()
+            if value is None:
+                return []
+            self.values = {(): value}
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self.values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Timer:
+    """with Timer(histogram, *labels): observes the block's duration."""
+
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+def _channel_layer_backlog():
+    layer = get_channel_layer()
+    channels = getattr(layer, "channels", None)  # InMemoryChannelLayer only
+    if channels is None:
+        return None
+    return sum(queue.qsize() for queue in list(channels.values()))
+
+
+outbound_queues = weakref.WeakSet()  # open outbound.OutboundQueues
+
+
+def _outbound_queued():
+    return sum(len(queue) for queue in list(outbound_queues))
+
+
+# ---------------------------------------
+# METRICS
+# ---------------------------------------
+connections = Gauge("chat_connections", "Open WebSocket connections.", ["room"])
+frames_received = Counter("chat_frames_received_total", "Inbound WebSocket frames.", ["type"])
+frame_seconds = Histogram("chat_frame_seconds", "Time spent handling an inbound frame.", ["type"])
+frame_db_queries = Histogram("chat_frame_db_queries", "Database queries run while handling a frame.", ["type"],
+                             buckets=QUERY_BUCKETS)
+group_send_seconds = Histogram("chat_group_send_seconds", "Channel layer group_send latency.")
+db_queue_wait_seconds = Histogram("chat_db_queue_wait_seconds",
+                                  "database_sync_to_async: time waiting for a worker thread.")
+db_execute_seconds = Histogram("chat_db_execute_seconds", "database_sync_to_async: time running.")
+blocking_io_wait_seconds = Histogram("chat_blocking_io_wait_seconds",
+                                     "Blocking I/O pool: time waiting for a worker thread.")
+blocking_io_execute_seconds = Histogram("chat_blocking_io_execute_seconds", "Blocking I/O pool: time running.")
+http_request_seconds = Histogram("chat_http_request_seconds", "HTTP request duration.", ["view", "method", "status"])
+upload_bytes = Counter("chat_upload_bytes_total", "Bytes received by upload endpoints.", ["endpoint"])
+channel_layer_backlog = Gauge("chat_channel_layer_backlog", "Frames waiting in the in-memory channel layer.",
+                              collect=_channel_layer_backlog)
+outbound_queued = Gauge("chat_outbound_queued", "Frames waiting in WebSocket outbound queues.",
+                        collect=_outbound_queued)
+outbound_dropped = Counter("chat_outbound_dropped_total", "Typing / presence frames not sent.", ["reason"])
+outbound_evictions = Counter("chat_outbound_evictions_total", "Clients disconnected for falling behind.", ["reason"])
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    lines += ["# HELP chat_events_total Per-process event counters.", "# TYPE chat_events_total counter"]
+    for name, value in sorted(counters.items()):
+        lines.append(f'chat_events_total{{event="{escape_label(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------
+# FRAMES AND THEIR DATABASE QUERIES
+# ---------------------------------------
+class FrameTimer:
+    """
+    with FrameTimer(frame_type, room): counts and times the frame, and
+    traces the queries run on its behalf, in this task and in the threads
+    it hands work to.
+    """
+
+    __slots__ = ("frame_type", "trace", "token", "started")
+
+    def __init__(self, frame_type, room=""):
+        self.frame_type = frame_type if frame_type in FRAME_TYPES else "other"
+        self.trace = RequestTrace("ws", self.frame_type, room)
+
+    def __enter__(self):
+        frames_received.inc(self.frame_type)
+        self.token = current_trace.set(self.trace)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        current_trace.reset(self.token)
+        frame_seconds.observe(elapsed, self.frame_type)
+        frame_db_queries.observe(self.trace.queries, self.frame_type)
+        get_slow_log().record(self.trace, elapsed)
+
+
+def _count_query(execute, sql, params, many, context):
+    trace = current_trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.add_query(sql, time.perf_counter() - started)
+
+
+def _install_query_counter(connection, **kwargs):
+    connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install_query_counter, weak=False, dispatch_uid="chatapp.metrics")
+
+
+# ---------------------------------------
+# INSTRUMENTED HELPERS
+# ---------------------------------------
+_submitted = contextvars.ContextVar("submitted", default=None)
+
+
+class TimedDatabaseSyncToAsync(DatabaseSyncToAsync):
+    """
+    database_sync_to_async, timing the wait for a worker thread apart
+    from the call itself. The submit time travels in a context variable,
+    which sync_to_async copies into the thread.
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        @functools.wraps(func)
+        def timed(*call_args, **call_kwargs):
+            started = time.perf_counter()
+            submitted = _submitted.get()
+            trace = current_trace.get()
+            if submitted is not None:
+                db_queue_wait_seconds.observe(started - submitted)
+                if trace is not None:
+                    trace.db_wait += started - submitted
+            try:
+                return func(*call_args, **call_kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                db_execute_seconds.observe(elapsed)
+                if trace is not None:
+                    trace.db_execute += elapsed
+
+        super().__init__(timed, *args, **kwargs)
+
+    async def __call__(self, *args, **kwargs):
+        _submitted.set(time.perf_counter())
+        return await super().__call__(*args, **kwargs)
+
+
+database_sync_to_async = TimedDatabaseSyncToAsync
+
+
+async def group_send(group, event):
+    """channel_layer.group_send, timed."""
+    with Timer(group_send_seconds):
+        await get_channel_layer().group_send(group, event)
+
+
+class MetricsMiddleware:
+    """Times and traces every HTTP request by view name (sync and async)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trace = RequestTrace("http", "", request.path)
+        token = current_trace.set(trace)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_trace.reset(token)
+        self._observe(request, response, started, trace)
+        return response
+
+    async def __acall__(self, request):
+        trace = RequestTrace("http", "", request.path)
+        token = current_trace.set(trace)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_trace.reset(token)
+        self._observe(request, response, started, trace)
+        return response
+
+    def _observe(self, request, response, started, trace):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        http_request_seconds.observe(elapsed, view, request.method, response.status_code)
+        trace.name = f"{request.method} {view} {response.status_code}"
+        get_slow_log().record(trace, elapsed)
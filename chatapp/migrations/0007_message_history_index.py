@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0006_rename_file_path_to_file_url'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='content',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', '-timestamp', '-id'], name='chatapp_msg_room_ts_id_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0007_message_history_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='callrecording',
+            index=models.Index(fields=['-created_at'], name='chatapp_callrec_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='callrecording',
+            index=models.Index(fields=['caller', '-created_at'], name='chatapp_callrec_caller_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='callrecording',
+            index=models.Index(fields=['receiver', '-created_at'], name='chatapp_callrec_receiver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='callrecording',
+            index=models.Index(condition=models.Q(('room_name__isnull', False), models.Q(('room_name', ''), _negated=True)), fields=['room_name', '-created_at'], name='chatapp_callrec_room_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediafile',
+            index=models.Index(fields=['-uploaded_at'], name='chatapp_media_uploaded_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:43
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# One function shared by the trigger and `manage.py reindex_search`:
+# content weighted A, attachment file names weighted B. Postgres parses
+# "quarterly-invoice.pdf" as a single token, so names are also indexed
+# split on separators to make "invoice" match.
+SEARCH_FUNCTION = """
+CREATE OR REPLACE FUNCTION chatapp_message_search_vector(content text, attachments jsonb)
+RETURNS tsvector LANGUAGE sql IMMUTABLE AS $$
+    SELECT setweight(to_tsvector('english', coalesce(content, '')), 'A')
+        || setweight(to_tsvector('english', coalesce((
+               SELECT string_agg((a->>'name') || ' ' || regexp_replace(a->>'name', '[._-]+', ' ', 'g'), ' ')
+               FROM jsonb_array_elements(
+                   CASE WHEN jsonb_typeof(attachments) = 'array' THEN attachments ELSE '[]'::jsonb END
+               ) AS a
+           ), '')), 'B')
+$$;
+
+CREATE OR REPLACE FUNCTION chatapp_message_search_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := chatapp_message_search_vector(NEW.content, NEW.attachments_json);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER chatapp_message_search_update
+    BEFORE INSERT OR UPDATE OF content, attachments_json ON chatapp_message
+    FOR EACH ROW EXECUTE FUNCTION chatapp_message_search_trigger();
+"""
+
+DROP_SEARCH_FUNCTION = """
+DROP TRIGGER IF EXISTS chatapp_message_search_update ON chatapp_message;
+DROP FUNCTION IF EXISTS chatapp_message_search_trigger();
+DROP FUNCTION IF EXISTS chatapp_message_search_vector(text, jsonb);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0010_media_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='chatapp_msg_search_idx'),
+        ),
+        # Existing rows are indexed by `manage.py reindex_search`, in batches
+        migrations.RunSQL(SEARCH_FUNCTION, DROP_SEARCH_FUNCTION),
+    ]
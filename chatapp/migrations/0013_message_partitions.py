@@ -0,0 +1,126 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+from datetime import datetime, timezone
+
+# chatapp_message is rebuilt as a table partitioned by month on timestamp
+# (see chatapp/partitions.py): the rows are copied into a new table and
+# the old one is dropped, so this holds an exclusive lock on it for as long
+# as the copy takes. Indexes, foreign keys and triggers are recreated from
+# the old table's definitions, under the same names. Monthly partitions
+# cover the existing rows up to the current month; later months are
+# created by `manage.py archive_messages`.
+TABLE = 'chatapp_message'
+NEW_TABLE = 'chatapp_message_rebuild'
+SEQUENCE = 'chatapp_message_id_seq'
+
+
+def _months(first, last):
+    month = datetime(first.year, first.month, 1, tzinfo=timezone.utc)
+    while month <= last:
+        following = datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=timezone.utc)
+        yield month, following
+        month = following
+
+
+def _rebuild(schema_editor, partitioned):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s AND indexname <> %s",
+            [TABLE, f'{TABLE}_pkey'],
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f' AND conparentid = 0",
+            [TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = %s::regclass AND NOT tgisinternal AND tgparentid = 0",
+            [TABLE],
+        )
+        triggers = [row[0] for row in cursor.fetchall()]
+        # Never hand out an id again, even of a deleted message
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        cursor.execute(f'SELECT last_value FROM {cursor.fetchone()[0]}')
+        last_id = cursor.fetchone()[0]
+        cursor.execute(f'SELECT min("timestamp") AT TIME ZONE \'UTC\', max(id) FROM {TABLE}')
+        first, max_id = cursor.fetchone()
+        first = first and first.replace(tzinfo=timezone.utc)
+        last_id = max(last_id, max_id or 0)
+
+        if partitioned:
+            cursor.execute(f'CREATE TABLE {NEW_TABLE} (LIKE {TABLE} INCLUDING CONSTRAINTS) PARTITION BY RANGE ("timestamp")')
+            now = datetime.now(timezone.utc)
+            for start, end in _months(first or now, now):
+                cursor.execute(
+                    f'CREATE TABLE {TABLE}_y{start.year}m{start.month:02d} PARTITION OF {NEW_TABLE} FOR VALUES FROM (%s) TO (%s)',
+                    [start, end],
+                )
+            cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {NEW_TABLE} DEFAULT')
+        else:
+            cursor.execute(f'CREATE TABLE {NEW_TABLE} (LIKE {TABLE} INCLUDING CONSTRAINTS)')
+
+        cursor.execute(f'INSERT INTO {NEW_TABLE} SELECT * FROM {TABLE}')
+        cursor.execute(f'DROP TABLE {TABLE}')
+        cursor.execute(f'ALTER TABLE {NEW_TABLE} RENAME TO {TABLE}')
+
+        if partitioned:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, "timestamp")')
+            # Partitioned tables cannot have identity columns before Postgres 17
+            cursor.execute(f'CREATE SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id')
+            cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+            cursor.execute('SELECT setval(%s, %s)', [SEQUENCE, max(last_id, 1)])
+        else:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id)')
+            cursor.execute(f'ALTER TABLE {TABLE} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (START WITH {last_id + 1})')
+
+        for sql in indexes + triggers:
+            cursor.execute(sql)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+        cursor.execute(f'ANALYZE {TABLE}')
+
+
+def partition_messages(apps, schema_editor):
+    _rebuild(schema_editor, partitioned=True)
+
+
+def unpartition_messages(apps, schema_editor):
+    _rebuild(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0012_room_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPartition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=63, unique=True)),
+                ('range_start', models.DateTimeField()),
+                ('range_end', models.DateTimeField()),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('room_counts', models.JSONField(default=dict)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='mediablob',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='mediafile',
+            name='message',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='media_files', to='chatapp.message'),
+        ),
+        migrations.RunPython(partition_messages, unpartition_messages),
+    ]
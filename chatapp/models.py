@@ -1,4 +1,8 @@
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -8,33 +12,126 @@ class ChatRoom(models.Model):
     name = models.CharField(max_length=255, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Maintained alongside message writes and deletes (see room_summary.py)
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_user = models.ForeignKey(User, related_name="+", on_delete=models.SET_NULL, null=True, blank=True)
+    last_message_preview = models.CharField(max_length=140, blank=True)
+
     def __str__(self):
         return self.name
 
 
 class Message(models.Model):
+    """
+    Stored in monthly range partitions on timestamp (see partitions.py),
+    so the primary key is (id, timestamp) in the database; ids still come
+    from one sequence. Months past the retention horizon are moved to
+    files by `manage.py archive_messages` (see archive.py).
+    """
     room = models.ForeignKey(ChatRoom, related_name="messages", on_delete=models.CASCADE)
     user = models.ForeignKey(User, related_name="messages", on_delete=models.SET_NULL, null=True)
     content = models.TextField(blank=True)
     attachments_json = models.JSONField(null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    # content + attachment names, maintained by a database trigger (see search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+
     class Meta:
         ordering = ["timestamp"]
+        indexes = [
+            # keyset pagination of room history (see history.py)
+            models.Index(fields=["room", "-timestamp", "-id"], name="chatapp_msg_room_ts_id_idx"),
+            # full-text search; the room filter is ANDed in from the index above
+            GinIndex(fields=["search_vector"], name="chatapp_msg_search_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user}: {self.content[:50]}"
 
 
+class ReadCursor(models.Model):
+    """
+    How far a user has read a room. read_count is how many of the room's
+    messages are up to last_read_id, so the unread count is
+    room.message_count - read_count (see room_summary.py).
+    """
+    # (user, room) below serves lookups by user; room_id has its own index
+    user = models.ForeignKey(User, related_name="read_cursors", on_delete=models.CASCADE, db_index=False)
+    room = models.ForeignKey(ChatRoom, related_name="read_cursors", on_delete=models.CASCADE)
+    last_read_id = models.BigIntegerField(default=0)
+    read_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # the upsert target, and a user's room list
+            models.UniqueConstraint(fields=["user", "room"], name="chatapp_readcursor_user_room_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.user} in {self.room}: {self.last_read_id}"
+
+
+class ArchivedPartition(models.Model):
+    """
+    A month of messages moved out of the database by
+    `manage.py archive_messages`: one gzipped JSONL file per room under
+    MESSAGE_ARCHIVE["DIR"]/<name>/ (see archive.py).
+    """
+    name = models.CharField(max_length=63, unique=True)  # the partition it was detached from
+    range_start = models.DateTimeField()
+    range_end = models.DateTimeField()
+    message_count = models.PositiveIntegerField(default=0)
+    room_counts = models.JSONField(default=dict)  # {room id: messages}
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class MediaBlob(models.Model):
+    """
+    One stored file in the content-addressed store (media_store.py).
+    Every upload of the same bytes points at the same blob; a blob is
+    referenced by the MediaFile / CallRecording rows linking to it.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=255)  # relative to MEDIA_ROOT
+    size = models.BigIntegerField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now=True)  # bumped on every dedup hit
+
+    # Lightweight variants made by media_pipeline.py (images and videos)
+    thumbnail_path = models.CharField(max_length=255, blank=True)
+    preview_path = models.CharField(max_length=255, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    # Attached to an archived message (archive.py): kept by the garbage collector
+    archived = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.path
+
+
 class MediaFile(models.Model):
     """
     FIXED MODEL — fully compatible with your JS + backend
     """
-    message = models.ForeignKey(Message, related_name="media_files", on_delete=models.CASCADE)
+    # No database constraint: Message's primary key is (id, timestamp), see partitions.py
+    message = models.ForeignKey(Message, related_name="media_files", on_delete=models.CASCADE, db_constraint=False)
 
     # Stored file path (matches your JS "url")
     file_url = models.TextField()  # Accepts any URL (local or external)
 
+    # Set when file_url points into the content-addressed store
+    blob = models.ForeignKey(MediaBlob, related_name="media_files", on_delete=models.PROTECT, null=True, blank=True)
+
     # image, video, audio, file, voice
     media_type = models.CharField(max_length=20)
 
@@ -44,6 +141,24 @@ class MediaFile(models.Model):
 
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    @property
+    def thumbnail_url(self):
+        if self.blob and self.blob.thumbnail_path:
+            return settings.MEDIA_URL + self.blob.thumbnail_path
+        return ""
+
+    @property
+    def preview_url(self):
+        if self.blob and self.blob.preview_path:
+            return settings.MEDIA_URL + self.blob.preview_path
+        return ""
+
+    class Meta:
+        indexes = [
+            # admin dashboard: newest uploads first
+            models.Index(fields=["-uploaded_at"], name="chatapp_media_uploaded_idx"),
+        ]
+
     def __str__(self):
         return f"{self.media_type}: {self.file_url}"
 
@@ -55,6 +170,7 @@ class CallRecording(models.Model):
 
     # store file as URL, not path. JS needs URL.
     file_url = models.TextField()  
+    blob = models.ForeignKey(MediaBlob, related_name="call_recordings", on_delete=models.PROTECT, null=True, blank=True)
 
     duration = models.IntegerField(null=True, blank=True)
 
@@ -62,5 +178,19 @@ class CallRecording(models.Model):
     ended_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # admin dashboard list + per-user / per-room filters, newest first
+            models.Index(fields=["-created_at"], name="chatapp_callrec_created_idx"),
+            models.Index(fields=["caller", "-created_at"], name="chatapp_callrec_caller_idx"),
+            models.Index(fields=["receiver", "-created_at"], name="chatapp_callrec_receiver_idx"),
+            # most calls are 1:1 without a room; only index the ones that have one
+            models.Index(
+                fields=["room_name", "-created_at"],
+                name="chatapp_callrec_room_idx",
+                condition=Q(room_name__isnull=False) & ~Q(room_name=""),
+            ),
+        ]
+
     def __str__(self):
         return f"{self.caller} → {self.receiver} ({self.created_at})"
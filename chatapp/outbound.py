@@ -0,0 +1,102 @@
+# chatapp/outbound.py
+"""
+Per-connection outbound queue.
+
+ChatConsumer used to await self.send for every event it handled: while
+a client on a bad link was being written to, the channel layer kept
+queueing its events, and with channels_redis a full per-channel queue
+drops messages. Now the consumer only puts frames here and returns; a
+task per connection writes them out in order.
+
+Two priorities:
+    high       everything else (messages, call signaling, replies), in order
+    droppable  typing / presence (frames.COALESCED): a newer frame for the
+               same key replaces the queued one, and all are dropped once
+               the queue is past HIGH_WATER
+
+A client that stays past HIGH_WATER for MAX_LAG seconds, or reaches
+MAX_QUEUE, is evicted: ChatConsumer sends a "reconnect" frame and closes
+the socket, and the client resumes from its last seq like after any
+other disconnect.
+
+How far a client can fall behind depends on the server: uvicorn's send
+waits for the socket to drain, so the queue fills while the link stalls;
+Daphne buffers writes in Twisted instead, and the queue mostly protects
+the channel layer.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from .metrics import outbound_dropped, outbound_queues
+
+
+class OutboundQueue:
+
+    def __init__(self, send, high_water=None, max_queue=None, max_lag=None):
+        config = settings.OUTBOUND
+        self.send = send  # async send(data), str or bytes
+        self.high_water = high_water if high_water is not None else config["HIGH_WATER"]
+        self.max_queue = max_queue if max_queue is not None else config["MAX_QUEUE"]
+        self.max_lag = max_lag if max_lag is not None else config["MAX_LAG"]
+        self.high = deque()
+        self.droppable = OrderedDict()  # coalesce key -> data
+        self.behind_since = None
+        self.closed = False
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._drain())
+        outbound_queues.add(self)
+
+    def __len__(self):
+        return len(self.high) + len(self.droppable)
+
+    def put(self, data, coalesce=None):
+        """Queue a frame. Returns why the client must be evicted, or None."""
+        if self.closed:
+            return None
+        if coalesce is None:
+            self.high.append(data)
+        else:
+            if self.droppable.pop(coalesce, None) is not None:
+                outbound_dropped.inc("coalesced")
+            self.droppable[coalesce] = data
+        self.wakeup.set()
+        return self._lagging()
+
+    def _lagging(self):
+        if len(self) > self.high_water and self.droppable:
+            outbound_dropped.inc("overflow", amount=len(self.droppable))
+            self.droppable.clear()
+        if len(self.high) <= self.high_water:
+            self.behind_since = None
+            return None
+        if len(self.high) >= self.max_queue:
+            return "queue_full"
+        now = time.monotonic()
+        if self.behind_since is None:
+            self.behind_since = now
+        if now - self.behind_since >= self.max_lag:
+            return "lagging"
+        return None
+
+    async def _drain(self):
+        while True:
+            if self.high:
+                data = self.high.popleft()
+            elif self.droppable:
+                _, data = self.droppable.popitem(last=False)
+            else:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            await self.send(data)
+
+    def close(self):
+        """Stop writing; whatever is still queued is discarded."""
+        self.closed = True
+        self.task.cancel()
+        outbound_queues.discard(self)
+        self.high.clear()
+        self.droppable.clear()
@@ -0,0 +1,121 @@
+# chatapp/partitions.py
+"""
+Monthly range partitions of chatapp_message.
+
+Migration 0013 turned the table into one partitioned on timestamp: a
+partition per calendar month (UTC), named chatapp_message_y2026m10, plus
+chatapp_message_default for rows no month partition covers. Indexes,
+foreign keys and the search trigger are declared on the parent and
+apply to every partition; the primary key is (id, timestamp), because
+Postgres only enforces uniqueness within a partition when the key
+includes the partition column. Ids are still unique: they all come from
+chatapp_message_id_seq.
+
+History pages read a room's newest partitions first and usually never
+touch the others, vacuum works a month at a time, and a month past the
+retention horizon leaves the table by detaching its partition (see
+archive.py) instead of by deleting its rows.
+
+ensure_partitions() creates the months ahead of time; `manage.py
+archive_messages` calls it on every run. Should it not run for a while,
+new messages land in the default partition and are moved into their
+month once that partition is created.
+"""
+import re
+from datetime import datetime, timezone
+
+from django.db import connection, transaction
+
+from .models import Message
+
+PARENT = Message._meta.db_table
+DEFAULT_PARTITION = f"{PARENT}_default"
+
+BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def month_start(moment):
+    moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f"{PARENT}_y{month.year}m{month.month:02d}"
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass)", [PARENT])
+        return cursor.fetchone()[0]
+
+
+def list_partitions():
+    """The attached month partitions as [(name, start, end)], oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            """,
+            [PARENT],
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = BOUNDS.search(bound)
+        if match is None:  # the default partition
+            continue
+        start, end = (datetime.fromisoformat(value).astimezone(timezone.utc) for value in match.groups())
+        partitions.append((name, start, end))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partition(month):
+    """
+    Create the partition for `month`, moving any of its rows out of the
+    default partition first (Postgres refuses to attach a range the
+    default partition has rows for).
+    """
+    quote = connection.ops.quote_name
+    start, end = month, add_months(month, 1)
+    parent, default, name = quote(PARENT), quote(DEFAULT_PARTITION), quote(partition_name(month))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT EXISTS (SELECT 1 FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s)', [start, end]
+        )
+        if not cursor.fetchone()[0]:
+            cursor.execute(f"CREATE TABLE {name} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)", [start, end])
+            return
+
+        # Writers to the table wait until this commits
+        cursor.execute(f"ALTER TABLE {parent} DETACH PARTITION {default}")
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)", [start, end])
+        cursor.execute(
+            f"""
+            WITH moved AS (DELETE FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *)
+            INSERT INTO {parent} SELECT * FROM moved
+            """,
+            [start, end],
+        )
+        cursor.execute(f"ALTER TABLE {parent} ATTACH PARTITION {default} DEFAULT")
+
+
+def ensure_partitions(months_ahead, now=None):
+    """Create the partitions from the current month through `months_ahead` later. Returns their names."""
+    current = month_start(now or datetime.now(timezone.utc))
+    existing = {name for name, _, _ in list_partitions()}
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if partition_name(month) not in existing:
+            create_partition(month)
+            created.append(partition_name(month))
+    return created
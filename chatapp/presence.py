@@ -0,0 +1,246 @@
+# chatapp/presence.py
+"""
+Room presence registry.
+
+Tracks which users are online in which room, counted per WebSocket
+connection so a user with two tabs stays online until the last one closes.
+
+Two backends share the same interface:
+- InMemoryPresence: per-process, for local development and tests
+- RedisPresence: cluster-wide, shared by every Daphne worker
+
+Pick one with settings.PRESENCE["BACKEND"].
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .frames import room_event
+from .metrics import group_send
+from .profiling import untraced_context
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class BasePresence:
+
+    async def join(self, room, username, channel_name):
+        """Register a connection. Returns True if it is the user's first one."""
+        raise NotImplementedError
+
+    async def leave(self, room, username, channel_name):
+        """Drop a connection. Returns True if the user has no connections left."""
+        raise NotImplementedError
+
+    async def online(self, room):
+        """Usernames with at least one live connection in the room."""
+        raise NotImplementedError
+
+    async def channels_for(self, room, username):
+        """Channel names of the user's connections in the room."""
+        raise NotImplementedError
+
+    async def reap(self, room):
+        """Expire connections of dead workers. Returns users that went offline."""
+        return []
+
+
+class InMemoryPresence(BasePresence):
+    """
+    Per-process only: every worker sees its own connections.
+    """
+
+    def __init__(self, **options):
+        # room -> username -> {channel_name}
+        self.rooms = defaultdict(lambda: defaultdict(set))
+
+    async def join(self, room, username, channel_name):
+        conns = self.rooms[room][username]
+        first = not conns
+        conns.add(channel_name)
+        return first
+
+    async def leave(self, room, username, channel_name):
+        users = self.rooms.get(room)
+        if not users or channel_name not in users.get(username, ()):
+            return False
+
+        users[username].discard(channel_name)
+        if users[username]:
+            return False
+
+        del users[username]
+        if not users:
+            del self.rooms[room]
+        return True
+
+    async def online(self, room):
+        return list(self.rooms.get(room, {}))
+
+    async def channels_for(self, room, username):
+        return list(self.rooms.get(room, {}).get(username, ()))
+
+
+# ---------------------------------------
+# REDIS BACKEND
+# ---------------------------------------
+# Keys per room (the {room} hash tag keeps them on one cluster slot):
+#   presence:{room}:exp          ZSET  channel -> expiry timestamp
+#   presence:{room}:owner        HASH  channel -> username
+#   presence:{room}:u:<username> SET   channels of that user
+#   presence:{room}:users        HASH  username -> connection count
+
+JOIN_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+if redis.call('SADD', ARGV[4] .. ARGV[2], ARGV[1]) == 1 then
+  return redis.call('HINCRBY', KEYS[3], ARGV[2], 1)
+end
+return 0
+"""
+
+LEAVE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+local user = redis.call('HGET', KEYS[2], ARGV[1])
+if not user then
+  return -1
+end
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('SREM', ARGV[2] .. user, ARGV[1])
+local n = redis.call('HINCRBY', KEYS[3], user, -1)
+if n <= 0 then
+  redis.call('HDEL', KEYS[3], user)
+  return 0
+end
+return n
+"""
+
+REAP_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local gone = {}
+for _, ch in ipairs(expired) do
+  redis.call('ZREM', KEYS[1], ch)
+  local user = redis.call('HGET', KEYS[2], ch)
+  if user then
+    redis.call('HDEL', KEYS[2], ch)
+    redis.call('SREM', ARGV[2] .. user, ch)
+    if redis.call('HINCRBY', KEYS[3], user, -1) <= 0 then
+      redis.call('HDEL', KEYS[3], user)
+      table.insert(gone, user)
+    end
+  end
+end
+return gone
+"""
+
+
+class RedisPresence(BasePresence):
+    """
+    Cluster-wide presence. Each connection carries an expiry that this
+    process refreshes with one heartbeat task; connections of a crashed
+    worker stop being refreshed and are reaped once their TTL passes, by
+    the next join or by the heartbeat of any process with a connection in
+    the room (a quiet room may see no join for hours).
+    """
+
+    def __init__(self, ttl=60, heartbeat=20, **options):
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat
+        # Connections owned by this process: room -> {channel_name}
+        self.local = defaultdict(set)
+        self._heartbeat_task = None
+        self._scripts = None
+
+    def _keys(self, room):
+        prefix = f"presence:{{{room}}}"
+        return (f"{prefix}:exp", f"{prefix}:owner", f"{prefix}:users"), f"{prefix}:u:"
+
+    def _get_scripts(self):
+        if self._scripts is None:
+            r = get_redis()
+            self._scripts = (
+                r.register_script(JOIN_SCRIPT),
+                r.register_script(LEAVE_SCRIPT),
+                r.register_script(REAP_SCRIPT),
+            )
+        return self._scripts
+
+    async def join(self, room, username, channel_name):
+        join, _, _ = self._get_scripts()
+        keys, user_prefix = self._keys(room)
+        count = await join(keys=keys, args=[
+            channel_name, username, time.time() + self.ttl, user_prefix,
+        ])
+
+        self.local[room].add(channel_name)
+        self._ensure_heartbeat()
+        return int(count) == 1
+
+    async def leave(self, room, username, channel_name):
+        self.local[room].discard(channel_name)
+        if not self.local[room]:
+            del self.local[room]
+
+        _, leave, _ = self._get_scripts()
+        keys, user_prefix = self._keys(room)
+        remaining = await leave(keys=keys, args=[channel_name, user_prefix])
+        return int(remaining) == 0
+
+    async def online(self, room):
+        keys, _ = self._keys(room)
+        return await get_redis().hkeys(keys[2])
+
+    async def channels_for(self, room, username):
+        _, user_prefix = self._keys(room)
+        return list(await get_redis().smembers(user_prefix + username))
+
+    async def reap(self, room):
+        _, _, reap = self._get_scripts()
+        keys, user_prefix = self._keys(room)
+        return await reap(keys=keys, args=[time.time(), user_prefix])
+
+    # Heartbeat
+    def _ensure_heartbeat(self):
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat(), context=untraced_context())
+
+    async def _heartbeat(self):
+        while self.local:
+            await asyncio.sleep(self.heartbeat_interval)
+            # One failed beat (e.g. Redis restarting) must not end the task: every connection would expire
+            try:
+                await self._beat()
+            except Exception:
+                logger.exception("Presence heartbeat failed")
+
+    async def _beat(self):
+        expiry = time.time() + self.ttl
+
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for room, channels in list(self.local.items()):
+                if channels:
+                    keys, _ = self._keys(room)
+                    pipe.zadd(keys[0], {ch: expiry for ch in channels}, xx=True)
+            await pipe.execute()
+
+        for room in list(self.local):
+            for username in await self.reap(room):
+                await group_send(f"chat_{room}", room_event({"type": "user_leave", "username": username}))
+
+
+_presence = None
+
+
+def get_presence():
+    """Process-wide presence backend configured in settings.PRESENCE."""
+    global _presence
+    if _presence is None:
+        config = dict(settings.PRESENCE)
+        backend = import_string(config.pop("BACKEND"))
+        _presence = backend(**{k.lower(): v for k, v in config.items()})
+    return _presence
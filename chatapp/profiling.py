@@ -0,0 +1,206 @@
+# chatapp/profiling.py
+"""
+On-demand diagnostics for a running Daphne process.
+
+Sampler: a thread that, for a bounded window, snapshots every thread's
+Python stack (sys._current_frames) at a fixed interval and counts the
+stacks in the "folded" format that flamegraph.pl and speedscope read:
+
+    MainThread;consumers:ChatConsumer.receive;history:fetch_page 37
+
+The event loop thread's stack includes whichever coroutine is running,
+so a handler hogging the loop shows up under its own name. Stacks of
+idle threads (the loop waiting in select, pool threads waiting for
+work) are left out unless asked for.
+
+Slow log: metrics.FrameTimer and MetricsMiddleware put a RequestTrace in
+a context variable for every WebSocket frame and HTTP request; the query
+counter, database_sync_to_async and blocking_io add to it from whatever
+thread they run in. A frame or request slower than the threshold is kept,
+with its queries and thread pool time, in a ring buffer. Tasks and timers
+that outlive the frame starting them (batch writers, expiry timers) run in
+untraced_context(), or they would keep adding to that frame's trace.
+
+Both are per process and toggled by staff at runtime (panel/profile/,
+panel/slow/); with several workers, each keeps its own.
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+from django.utils import timezone
+
+MAX_PROFILE_SECONDS = 120
+MIN_INTERVAL = 0.001
+
+# Leaf frames of a thread with nothing to do
+IDLE_LEAVES = {
+    ("selectors", "select"), ("selectors", "EpollSelector.select"), ("selectors", "KqueueSelector.select"),
+    ("threading", "Condition.wait"), ("threading", "Event.wait"), ("thread", "_worker"),
+    ("queue", "Queue.get"), ("connection", "wait"),
+}
+
+# Per slow trace, so one runaway frame cannot fill the log
+MAX_TRACE_QUERIES = 50
+MAX_SQL_LENGTH = 500
+
+
+# ---------------------------------------
+# SAMPLING PROFILER
+# ---------------------------------------
+def _frame_name(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return module, getattr(code, "co_qualname", code.co_name)
+
+
+class Sampler:
+    """One profile at a time; the last one's stacks stay readable until the next starts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.seconds = 0
+        self.interval = 0
+        self.include_idle = False
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds, interval=0.005, include_idle=False):
+        """False if a profile is already running."""
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.seconds = min(max(seconds, 0), MAX_PROFILE_SECONDS)
+            self.interval = max(interval, MIN_INTERVAL)
+            self.include_idle = include_idle
+            self.started_at = timezone.now()
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline and not self.stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                if not self.include_idle and stack and stack[0] in IDLE_LEAVES:
+                    continue
+                stack.reverse()
+                thread_name = names.get(ident, str(ident))
+                self.stacks[";".join([thread_name, *(f"{module}:{name}" for module, name in stack)])] += 1
+            self.samples += 1
+
+    def status(self):
+        return {
+            "running": self.running,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "seconds": self.seconds,
+            "interval_ms": round(self.interval * 1000, 3),
+            "include_idle": self.include_idle,
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+        }
+
+    def folded(self):
+        """The profile so far, one "frame;frame;frame count" line per distinct stack."""
+        stacks = self.stacks.copy()
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+sampler = Sampler()
+
+
+# ---------------------------------------
+# SLOW FRAME / REQUEST LOG
+# ---------------------------------------
+class RequestTrace:
+    """What one frame or request did, filled in from any thread it hands work to."""
+
+    __slots__ = ("kind", "name", "detail", "queries", "sql", "db_wait", "db_execute", "io_wait", "io_execute")
+
+    def __init__(self, kind, name, detail=""):
+        self.kind = kind        # "ws" or "http"
+        self.name = name        # frame type or view name
+        self.detail = detail    # room or path
+        self.queries = 0
+        self.sql = []           # (ms, statement), the first MAX_TRACE_QUERIES
+        self.db_wait = self.db_execute = self.io_wait = self.io_execute = 0.0
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        if len(self.sql) < MAX_TRACE_QUERIES:
+            self.sql.append((round(seconds * 1000, 3), sql[:MAX_SQL_LENGTH]))
+
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def untraced_context():
+    """
+    A copy of the current context without its trace, for create_task(context=)
+    and call_later(context=) of work done on behalf of later frames too.
+    """
+    context = contextvars.copy_context()
+    context.run(current_trace.set, None)
+    return context
+
+
+class SlowLog:
+
+    def __init__(self, threshold_ms, size):
+        self.threshold_ms = threshold_ms  # 0 = off
+        self.entries = deque(maxlen=size)
+
+    def record(self, trace, seconds):
+        ms = seconds * 1000
+        if not self.threshold_ms or ms < self.threshold_ms:
+            return
+        self.entries.append({
+            "at": timezone.now().isoformat(),
+            "kind": trace.kind,
+            "name": trace.name,
+            "detail": trace.detail,
+            "ms": round(ms, 3),
+            "queries": trace.queries,
+            "db_wait_ms": round(trace.db_wait * 1000, 3),
+            "db_execute_ms": round(trace.db_execute * 1000, 3),
+            "io_wait_ms": round(trace.io_wait * 1000, 3),
+            "io_execute_ms": round(trace.io_execute * 1000, 3),
+            "sql": [{"ms": sql_ms, "sql": sql} for sql_ms, sql in trace.sql],
+        })
+
+
+_slow_log = None
+
+
+def get_slow_log():
+    global _slow_log
+    if _slow_log is None:
+        _slow_log = SlowLog(settings.SLOW_FRAME_MS, settings.SLOW_FRAME_LOG_SIZE)
+    return _slow_log
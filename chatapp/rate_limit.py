@@ -0,0 +1,67 @@
+# chatapp/rate_limit.py
+"""
+Per-connection token buckets for inbound WebSocket frames.
+
+Every frame kind (see frame_kind) has its own bucket sized by
+settings.WS_RATE_LIMITS = {kind: (frames per second, burst)}. Frames over
+the limit are dropped. Allowed/dropped counts are kept per process in
+`counters` and shown on the staff stats page.
+"""
+import time
+from collections import Counter
+
+from django.conf import settings
+
+SIGNAL_TYPES = {
+    "call_request", "call_accept", "call_reject",
+    "call_timeout", "offer", "answer", "ice", "call_end"
+}
+
+counters = Counter()
+
+
+def frame_kind(data):
+    """Bucket a decoded frame is charged to."""
+    frame_type = data.get("type")
+    if frame_type in SIGNAL_TYPES:
+        return "signal"
+    if frame_type in ("typing", "history", "read"):
+        return frame_type
+    return "message"  # text, media, edit and delete
+
+
+class TokenBucket:
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class ConnectionLimiter:
+    """The buckets of one WebSocket connection, created on first use."""
+
+    def __init__(self, limits=None):
+        self.limits = limits or settings.WS_RATE_LIMITS
+        self.buckets = {}
+
+    def allow(self, kind):
+        bucket = self.buckets.get(kind)
+        if bucket is None:
+            bucket = self.buckets[kind] = TokenBucket(*self.limits.get(kind, self.limits["message"]))
+
+        allowed = bucket.take()
+        counters[f"{kind}.{'allowed' if allowed else 'dropped'}"] += 1
+        return allowed
@@ -0,0 +1,329 @@
+# chatapp/recent_messages.py
+"""
+Cache of each room's most recent messages, for rendering chat_room.
+
+ChatConsumer keeps it current write-through: new messages are appended
+once the write-behind batch has committed them, and edits and deletions
+are applied in place. Changes made elsewhere (Django admin) show up once
+the entry expires after TTL seconds.
+
+Concurrent misses for the same room share one database query. Every
+write bumps a per-room version; a load only stores its result if the
+version did not move while it was querying. Otherwise a write that
+landed mid-query could be lost, and the query's result is returned
+uncached.
+
+Two backends, picked with settings.RECENT_MESSAGES["BACKEND"]:
+- InMemoryRecentMessages: per-process LRU, for local development
+- RedisRecentMessages: shared by every Daphne worker
+
+Entries are dicts: id, username, content, attachments, timestamp (ISO).
+"""
+import asyncio
+import bisect
+import json
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .history import PAGE_SIZE
+from .media_pipeline import PROCESSED_TYPES, variants_for_urls
+from .models import Message
+from .rate_limit import counters
+from .redis_client import get_redis
+
+# Headroom so deletions do not immediately shrink the page below PAGE_SIZE
+CACHED_MESSAGES = PAGE_SIZE * 2
+
+
+def cache_entry(msg_id, username, content, attachments, timestamp):
+    return {
+        "id": msg_id,
+        "username": username,
+        "content": content,
+        "attachments": attachments or [],
+        "timestamp": timestamp.isoformat(),
+    }
+
+
+def load_recent(room_id):
+    """Cache entries of the room's newest messages, from the database."""
+    messages = (
+        Message.objects
+        .filter(room_id=room_id)
+        .select_related("user")
+        .only("id", "content", "attachments_json", "timestamp", "user__username")
+        .order_by("-timestamp", "-id")[:CACHED_MESSAGES][::-1]
+    )
+    entries = [
+        cache_entry(m.id, m.user.username if m.user else "", m.content, m.attachments_json, m.timestamp)
+        for m in messages
+    ]
+
+    # Cached with thumbnails instead of full-size media where rendered
+    media = [
+        att for e in entries for att in e["attachments"]
+        if att.get("type") in PROCESSED_TYPES and att.get("url")
+    ]
+    if media:
+        variants = variants_for_urls({att["url"] for att in media})
+        for att in media:
+            att.update(variants.get(att["url"], {}))
+    return entries
+
+
+class BaseRecentMessages:
+
+    def __init__(self, **options):
+        self._loading = {}  # room_id -> task loading it
+
+    async def recent(self, room_id, loader):
+        """
+        Cached messages of the room, oldest first. On a miss, `loader(room_id)`
+        (a coroutine function) is awaited once for all concurrent callers.
+        """
+        messages = await self.get(room_id)
+        if messages is not None:
+            counters["recent_messages.hit"] += 1
+            return messages
+
+        task = self._loading.get(room_id)
+        if task is None:
+            counters["recent_messages.miss"] += 1
+            task = self._loading[room_id] = asyncio.ensure_future(self._fill(room_id, loader))
+            task.add_done_callback(lambda _: self._loading.pop(room_id, None))
+        else:
+            counters["recent_messages.coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def _fill(self, room_id, loader):
+        version = await self.version(room_id)
+        messages = await loader(room_id)
+        await self.put(room_id, messages[-CACHED_MESSAGES:], version)
+        return messages
+
+    async def get(self, room_id):
+        """Cached messages, or None on a miss."""
+        raise NotImplementedError
+
+    async def version(self, room_id):
+        raise NotImplementedError
+
+    async def put(self, room_id, messages, version):
+        """Store a loaded page unless the room was written to since `version`."""
+        raise NotImplementedError
+
+    async def append(self, room_id, entry):
+        raise NotImplementedError
+
+    async def edit(self, room_id, message_id, content):
+        raise NotImplementedError
+
+    async def remove(self, room_id, message_id):
+        raise NotImplementedError
+
+    async def clear(self, room_id):
+        """Forget the room (after bulk deletions); the next read reloads it."""
+        raise NotImplementedError
+
+
+class InMemoryRecentMessages(BaseRecentMessages):
+
+    def __init__(self, rooms=1000, ttl=10 * 60, **options):
+        super().__init__()
+        self.max_rooms = rooms
+        self.ttl = ttl
+        self.rooms = OrderedDict()  # room_id -> (expires, [entry]), least recently used first
+        self.versions = {}
+
+    def _entries(self, room_id):
+        cached = self.rooms.get(room_id)
+        if cached is None:
+            return None
+        if cached[0] < time.monotonic():
+            del self.rooms[room_id]
+            return None
+        self.rooms.move_to_end(room_id)
+        return cached[1]
+
+    def _bump(self, room_id):
+        self.versions[room_id] = self.versions.get(room_id, 0) + 1
+
+    async def get(self, room_id):
+        entries = self._entries(room_id)
+        return list(entries) if entries is not None else None
+
+    async def version(self, room_id):
+        return self.versions.get(room_id, 0)
+
+    async def put(self, room_id, messages, version):
+        if self.versions.get(room_id, 0) != version:
+            return
+        self.rooms[room_id] = (time.monotonic() + self.ttl, list(messages))
+        self.rooms.move_to_end(room_id)
+        while len(self.rooms) > self.max_rooms:
+            self.rooms.popitem(last=False)
+
+    async def append(self, room_id, entry):
+        self._bump(room_id)
+        entries = self._entries(room_id)
+        if entries is None:
+            return
+        # Batches from different writers can commit out of id order
+        bisect.insort(entries, entry, key=lambda e: e["id"])
+        del entries[:-CACHED_MESSAGES]
+
+    async def edit(self, room_id, message_id, content):
+        self._bump(room_id)
+        for entry in self._entries(room_id) or ():
+            if entry["id"] == message_id:
+                entry["content"] = content
+
+    async def remove(self, room_id, message_id):
+        self._bump(room_id)
+        entries = self._entries(room_id)
+        if entries is None:
+            return
+        entries[:] = [e for e in entries if e["id"] != message_id]
+        if len(entries) < PAGE_SIZE:
+            # Older messages are not cached: reload rather than show a short page
+            del self.rooms[room_id]
+
+    async def clear(self, room_id):
+        self._bump(room_id)
+        self.rooms.pop(room_id, None)
+
+
+# ---------------------------------------
+# REDIS BACKEND
+# ---------------------------------------
+# Keys per room:
+#   recent:{room_id}:msgs  ZSET    entry JSON scored by message id, plus the
+#                                  member "-" (score 0) marking a loaded room
+#   recent:{room_id}:ver   STRING  write counter
+
+PUT_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+  return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('ZADD', KEYS[1], 0, '-')
+for i = 3, #ARGV, 2 do
+  redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+APPEND_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+  redis.call('ZREMRANGEBYRANK', KEYS[1], 1, -1 - tonumber(ARGV[4]))
+end
+"""
+
+# Swaps old -> new members; a member edited concurrently drops the room
+EDIT_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+for i = 3, #ARGV, 2 do
+  if redis.call('ZREM', KEYS[1], ARGV[i]) == 1 then
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[i + 1])
+  else
+    redis.call('DEL', KEYS[1])
+  end
+end
+"""
+
+REMOVE_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  redis.call('ZREMRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1])
+  if redis.call('ZCARD', KEYS[1]) - 1 < tonumber(ARGV[3]) then
+    redis.call('DEL', KEYS[1])
+  end
+end
+"""
+
+
+class RedisRecentMessages(BaseRecentMessages):
+    """
+    Concurrent misses are coalesced per process; each worker still runs
+    its own query for a room it has not loaded.
+    """
+
+    def __init__(self, ttl=10 * 60, **options):
+        super().__init__()
+        self.ttl = ttl
+        self._scripts = None
+
+    def _keys(self, room_id):
+        prefix = f"recent:{{{room_id}}}"
+        return [f"{prefix}:msgs", f"{prefix}:ver"]
+
+    def _get_scripts(self):
+        if self._scripts is None:
+            r = get_redis()
+            self._scripts = tuple(
+                r.register_script(script)
+                for script in (PUT_SCRIPT, APPEND_SCRIPT, EDIT_SCRIPT, REMOVE_SCRIPT)
+            )
+        return self._scripts
+
+    async def get(self, room_id):
+        members = await get_redis().zrange(self._keys(room_id)[0], 0, -1)
+        if not members:
+            return None
+        return [json.loads(m) for m in members[1:]]
+
+    async def version(self, room_id):
+        return await get_redis().get(self._keys(room_id)[1]) or "0"
+
+    async def put(self, room_id, messages, version):
+        put, _, _, _ = self._get_scripts()
+        args = [version, self.ttl]
+        for entry in messages:
+            args += [entry["id"], json.dumps(entry)]
+        await put(keys=self._keys(room_id), args=args)
+
+    async def append(self, room_id, entry):
+        _, append, _, _ = self._get_scripts()
+        await append(keys=self._keys(room_id), args=[entry["id"], json.dumps(entry), self.ttl, CACHED_MESSAGES])
+
+    async def edit(self, room_id, message_id, content):
+        _, _, edit, _ = self._get_scripts()
+        keys = self._keys(room_id)
+        args = [message_id, self.ttl]
+        for member in await get_redis().zrangebyscore(keys[0], message_id, message_id):
+            entry = json.loads(member)
+            entry["content"] = content
+            args += [member, json.dumps(entry)]
+        await edit(keys=keys, args=args)
+
+    async def remove(self, room_id, message_id):
+        _, _, _, remove = self._get_scripts()
+        await remove(keys=self._keys(room_id), args=[message_id, self.ttl, PAGE_SIZE])
+
+    async def clear(self, room_id):
+        msgs_key, ver_key = self._keys(room_id)
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.incr(ver_key).expire(ver_key, self.ttl).delete(msgs_key)
+            await pipe.execute()
+
+
+_cache = None
+
+
+def get_recent_messages():
+    """Process-wide cache configured in settings.RECENT_MESSAGES."""
+    global _cache
+    if _cache is None:
+        config = dict(settings.RECENT_MESSAGES)
+        backend = import_string(config.pop("BACKEND"))
+        _cache = backend(**{k.lower(): v for k, v in config.items()})
+    return _cache
@@ -0,0 +1,16 @@
+# chatapp/redis_client.py
+from django.conf import settings
+
+_async_client = None
+
+
+def get_redis():
+    """
+    Shared asyncio Redis client built from settings.REDIS_URL.
+    Only use it from code running on the ASGI event loop (consumers).
+    """
+    global _async_client
+    if _async_client is None:
+        import redis.asyncio as aioredis
+        _async_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _async_client
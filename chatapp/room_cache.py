@@ -0,0 +1,60 @@
+# chatapp/room_cache.py
+"""
+Process-level LRU cache of room name -> ChatRoom id.
+
+Rooms are created on first use and almost never change, so consumers and
+views resolve them here instead of running get_or_create on every request.
+Entries are invalidated when a room is renamed or deleted (see signals.py):
+right away in the process that did it and in every process with a socket in
+the room (they get a room.deleted event), within `ttl` seconds elsewhere.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import ChatRoom
+
+
+class RoomCache:
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ids = OrderedDict()   # name -> (id, expiry), least recently used first
+        self.names = {}            # id -> name, for invalidation by id
+        # Views call this from several threads
+        self.lock = threading.Lock()
+
+    def get_room_id(self, name):
+        with self.lock:
+            room_id, expiry = self.ids.get(name, (None, 0))
+            if expiry > time.monotonic():
+                self.ids.move_to_end(name)
+                return room_id
+
+        room_id = ChatRoom.objects.get_or_create(name=name)[0].id
+
+        with self.lock:
+            self.ids[name] = (room_id, time.monotonic() + self.ttl)
+            self.ids.move_to_end(name)
+            self.names[room_id] = name
+            while len(self.ids) > self.maxsize:
+                _, (evicted, _) = self.ids.popitem(last=False)
+                self.names.pop(evicted, None)
+        return room_id
+
+    def invalidate(self, room_id):
+        with self.lock:
+            name = self.names.pop(room_id, None)
+            if name is not None:
+                self.ids.pop(name, None)
+
+
+room_cache = RoomCache(maxsize=settings.ROOM_CACHE_SIZE, ttl=settings.ROOM_CACHE_TTL)
+
+
+def get_room_id(name):
+    """Id of the room called `name`, creating the room if needed."""
+    return room_cache.get_room_id(name)
@@ -0,0 +1,246 @@
+# chatapp/room_summary.py
+"""
+Room summaries and read cursors, kept up to date as messages come and go
+so that listing rooms never scans Message.
+
+ChatRoom carries message_count and its last message (id, time, author,
+preview). write_batch() adds to them in the transaction inserting the
+messages, message_ops.delete_batch() subtracts in the transaction
+deleting them, and ORM deletes do the same through post_delete.
+
+A ReadCursor is how far a user has read a room: last_read_id, and
+read_count, the number of the room's messages up to it. The unread
+count is room.message_count - read_count, read from the cursor row and
+its room in one join. Deleting messages a user had already read lowers
+their read_count as well.
+
+Read marks arrive with every message a user sees. ReadCursorWriter keeps
+the newest mark per (user, room) and writes them all with one upsert
+every FLUSH_INTERVAL; a crash loses at most that window of marks.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .archive import archived_count
+from .metrics import database_sync_to_async
+from .models import ChatRoom, Message, ReadCursor
+from .profiling import untraced_context
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 140
+
+# Marks for every room up to its newest message are clamped to this
+LATEST = 2 ** 62
+
+# greatest(..., 0): messages inserted behind write_batch()'s back (fixtures,
+# benchmarks) are not counted until `manage.py recount_rooms`
+MARK_SQL = """
+INSERT INTO {cursors} (user_id, room_id, last_read_id, read_count, updated_at)
+SELECT mark.user_id, room.id, upto.id,
+       greatest(room.message_count - (SELECT count(*) FROM {messages} m WHERE m.room_id = room.id AND m.id > upto.id), 0),
+       now()
+FROM unnest(%s::bigint[], %s::bigint[], %s::bigint[]) AS mark(user_id, room_id, message_id)
+JOIN {rooms} room ON room.id = mark.room_id
+CROSS JOIN LATERAL (SELECT LEAST(mark.message_id, coalesce(room.last_message_id, 0)) AS id) AS upto
+ON CONFLICT (user_id, room_id) DO UPDATE
+SET last_read_id = EXCLUDED.last_read_id, read_count = EXCLUDED.read_count, updated_at = EXCLUDED.updated_at
+WHERE {cursors}.last_read_id < EXCLUDED.last_read_id
+"""
+
+# Cursors of a room that had read some of the deleted ids
+UNREAD_SQL = """
+UPDATE {cursors}
+SET read_count = greatest(read_count - (SELECT count(*) FROM unnest(%s::bigint[]) AS gone(id) WHERE gone.id <= last_read_id), 0)
+WHERE room_id = %s AND last_read_id >= %s
+"""
+
+# Plus the room's archived messages, all older than any cursor still in use
+RECOUNT_CURSORS_SQL = """
+UPDATE {cursors} c
+SET read_count = %s + (SELECT count(*) FROM {messages} m WHERE m.room_id = c.room_id AND m.id <= c.last_read_id)
+WHERE c.room_id = %s
+"""
+
+
+def _sql(template):
+    quote = connection.ops.quote_name
+    return template.format(
+        cursors=quote(ReadCursor._meta.db_table),
+        messages=quote(Message._meta.db_table),
+        rooms=quote(ChatRoom._meta.db_table),
+    )
+
+
+def message_preview(content, attachments):
+    if content:
+        return content[:PREVIEW_LENGTH]
+    if attachments:
+        return f"[{attachments[0].get('type') or 'file'}]"
+    return ""
+
+
+def _last_message_fields(message):
+    if message is None:
+        return {"last_message_id": None, "last_message_at": None, "last_message_user_id": None, "last_message_preview": ""}
+    return {
+        "last_message_id": message.id,
+        "last_message_at": message.timestamp,
+        "last_message_user_id": message.user_id,
+        "last_message_preview": message_preview(message.content, message.attachments_json),
+    }
+
+
+# ---------------------------------------
+# ROOM COUNTERS (inside the writing transaction)
+# ---------------------------------------
+def add_messages(messages):
+    """Count just-inserted `messages` into their rooms."""
+    by_room = defaultdict(list)
+    for message in messages:
+        by_room[message.room_id].append(message)
+
+    for room_id in sorted(by_room):  # same lock order in every process
+        added = by_room[room_id]
+        last = max(added, key=lambda m: m.id)
+        # Another process may have committed a newer message first
+        newer = Q(last_message_id__isnull=True) | Q(last_message_id__lt=last.id)
+        fields = {}
+        for name, value in _last_message_fields(last).items():
+            field = ChatRoom._meta.get_field(name)
+            fields[name] = Case(When(newer, then=Value(value)), default=F(name), output_field=field)
+        ChatRoom.objects.filter(id=room_id).update(message_count=F("message_count") + len(added), **fields)
+
+
+def remove_messages(rows):
+    """Uncount deleted messages, given as [(id, room_id)]."""
+    by_room = defaultdict(list)
+    for msg_id, room_id in rows:
+        by_room[room_id].append(msg_id)
+
+    for room_id in sorted(by_room):
+        ids = by_room[room_id]
+        ChatRoom.objects.filter(id=room_id).update(message_count=Greatest(F("message_count") - len(ids), 0))
+        with connection.cursor() as cursor:
+            cursor.execute(_sql(UNREAD_SQL), [ids, room_id, min(ids)])
+        if ChatRoom.objects.filter(id=room_id, last_message_id__in=ids).exists():
+            latest = Message.objects.filter(room_id=room_id).order_by("-timestamp", "-id").first()
+            ChatRoom.objects.filter(id=room_id).update(**_last_message_fields(latest))
+
+
+def edit_message(room_id, message_id, content):
+    if content:
+        ChatRoom.objects.filter(id=room_id, last_message_id=message_id).update(
+            last_message_preview=message_preview(content, None)
+        )
+
+
+def recount_room(room_id):
+    """Rebuild one room's counters and its cursors' read counts from Message and the archive."""
+    with transaction.atomic():
+        # Writers wait on the room row until this commits, then add to it
+        ChatRoom.objects.select_for_update().filter(id=room_id).exists()
+        messages = Message.objects.filter(room_id=room_id)
+        archived = archived_count(room_id)
+        latest = messages.order_by("-timestamp", "-id").first()
+        # With every message archived, the last one stays as it was
+        last = _last_message_fields(latest) if latest is not None or not archived else {}
+        ChatRoom.objects.filter(id=room_id).update(message_count=archived + messages.count(), **last)
+        with connection.cursor() as cursor:
+            cursor.execute(_sql(RECOUNT_CURSORS_SQL), [archived, room_id])
+
+
+# ---------------------------------------
+# READ CURSORS
+# ---------------------------------------
+def save_marks(marks):
+    """
+    Upsert {(user_id, room_id): message_id} into ReadCursor in one
+    statement; None means up to the room's newest message. Cursors only
+    move forward.
+    """
+    keys = sorted(marks)
+    with connection.cursor() as cursor:
+        cursor.execute(_sql(MARK_SQL), [
+            [user_id for user_id, _ in keys],
+            [room_id for _, room_id in keys],
+            [LATEST if marks[key] is None else marks[key] for key in keys],
+        ])
+
+
+def room_list(user_id):
+    """The rooms `user_id` has a cursor in, most recently active first, with unread counts."""
+    cursors = (
+        ReadCursor.objects.filter(user_id=user_id)
+        .select_related("room", "room__last_message_user")
+        .order_by(F("room__last_message_at").desc(nulls_last=True), "room__name")
+    )
+    rooms = []
+    for cursor in cursors:
+        room = cursor.room
+        last = None
+        if room.last_message_id is not None:
+            last = {
+                "id": room.last_message_id,
+                "username": room.last_message_user.username if room.last_message_user else None,
+                "preview": room.last_message_preview,
+                "timestamp": room.last_message_at.isoformat(),
+            }
+        rooms.append({
+            "name": room.name,
+            "message_count": room.message_count,
+            "unread": max(room.message_count - cursor.read_count, 0),
+            "last_read_id": cursor.last_read_id,
+            "last_message": last,
+        })
+    return rooms
+
+
+class ReadCursorWriter:
+    """Coalesces read marks from every consumer of the process (runs on the ASGI loop)."""
+
+    def __init__(self, flush_interval=1.0):
+        self.flush_interval = flush_interval
+        self.pending = {}  # (user_id, room_id) -> message_id, None = newest
+        self._task = None
+
+    def mark(self, user_id, room_id, message_id=None):
+        key = (user_id, room_id)
+        if key in self.pending:
+            current = self.pending[key]
+            if current is None or (message_id is not None and message_id <= current):
+                return
+        self.pending[key] = message_id
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), context=untraced_context())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        marks, self.pending = self.pending, {}
+        try:
+            await database_sync_to_async(save_marks)(marks)
+        except Exception:
+            logger.exception("Failed to save %d read marks", len(marks))
+
+
+_writer = None
+
+
+def get_read_cursors():
+    """Process-wide writer configured by settings.READ_CURSORS."""
+    global _writer
+    if _writer is None:
+        _writer = ReadCursorWriter(flush_interval=settings.READ_CURSORS["FLUSH_INTERVAL"])
+    return _writer
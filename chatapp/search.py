@@ -0,0 +1,105 @@
+# chatapp/search.py
+"""
+Full-text message search (PostgreSQL).
+
+Message.search_vector holds the content (weight A) and attachment file
+names (weight B). A database trigger recomputes it whenever a row is
+inserted or its content / attachments change, so bulk_create in the
+write-behind path and edits are indexed without any Python involvement.
+Rows written before the trigger existed are filled in by
+`manage.py reindex_search`.
+
+Results are ranked with ts_rank and paginated by keyset on (rank, id);
+the cursor is opaque to clients, like history cursors. Only the newest
+RANK_WINDOW matches are ranked: ts_rank reads every candidate's vector,
+so a common word in a busy room would otherwise cost one read per match.
+"""
+import base64
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Cast, Replace
+
+from .history import serialize_message
+from .models import Message
+
+SEARCH_CONFIG = "english"  # must match chatapp_message_search_vector()
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+RANK_WINDOW = 5000
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_STOP = "</mark>"
+
+
+def encode_cursor(rank, msg_id):
+    raw = f"{rank!r}|{msg_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns (rank, id). Raises ValueError on a malformed cursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, msg_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return float(rank), int(msg_id)
+    except (TypeError, UnicodeDecodeError, base64.binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def escaped(field):
+    """HTML-escape a text column in SQL, so only our <mark> tags are markup."""
+    expression = F(field)
+    for char, entity in (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#x27;")):
+        expression = Replace(expression, Value(char), Value(entity))
+    return expression
+
+
+def search_messages(room_id, query, after=None, limit=PAGE_SIZE):
+    """
+    Messages of the room matching `query` (websearch syntax: words,
+    "phrases", -exclusions, OR), best match first. Returns
+    (results, next_cursor). Each result is a history message plus
+    "highlight": HTML-safe content with matches wrapped in <mark>.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    tsquery = SearchQuery(query, search_type="websearch", config=SEARCH_CONFIG)
+
+    matches = Message.objects.filter(room_id=room_id, search_vector=tsquery)
+
+    # Where the newest RANK_WINDOW matches start. Walks
+    # chatapp_msg_room_ts_id_idx for common words, the GIN index for rare ones.
+    window_start = list(
+        matches.order_by("-timestamp", "-id").values_list("timestamp", flat=True)[RANK_WINDOW - 1:RANK_WINDOW]
+    )
+    if window_start:
+        matches = matches.filter(timestamp__gte=window_start[0])
+
+    qs = (
+        matches
+        .annotate(rank=Cast(SearchRank(F("search_vector"), tsquery), FloatField()))
+        .select_related("user")
+        .prefetch_related("media_files__blob")
+        .only("id", "content", "timestamp", "user__username")
+        .order_by("-rank", "-id")
+    )
+    if after:
+        rank, msg_id = decode_cursor(after)
+        qs = qs.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=msg_id))
+
+    # Headlines are costly: computed for the returned page only
+    rows = list(qs.annotate(highlight=SearchHeadline(
+        escaped("content"), tsquery, config=SEARCH_CONFIG,
+        start_sel=HIGHLIGHT_START, stop_sel=HIGHLIGHT_STOP, max_fragments=2,
+    ))[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    results = []
+    for msg in rows:
+        result = serialize_message(msg)
+        result["highlight"] = msg.highlight
+        results.append(result)
+
+    next_cursor = encode_cursor(rows[-1].rank, rows[-1].id) if has_more else None
+    return results, next_cursor
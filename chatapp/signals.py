@@ -0,0 +1,28 @@
+# chatapp/signals.py
+from asgiref.sync import async_to_sync
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .metrics import group_send
+from .models import ChatRoom, Message
+from .room_cache import room_cache
+from .room_summary import remove_messages
+
+
+@receiver(post_save, sender=ChatRoom)
+@receiver(post_delete, sender=ChatRoom)
+def invalidate_room_cache(sender, instance, **kwargs):
+    # A rename or delete makes the cached name -> id mapping stale
+    room_cache.invalidate(instance.id)
+
+
+@receiver(post_delete, sender=ChatRoom)
+def close_room_sockets(sender, instance, **kwargs):
+    # Sockets in every worker hold the deleted id (and their workers cache it): reconnect to a fresh room
+    async_to_sync(group_send)(f"chat_{instance.name}", {"type": "room.deleted", "room_id": instance.id})
+
+
+@receiver(post_delete, sender=Message)
+def uncount_message(sender, instance, **kwargs):
+    # message_ops deletes with SQL and adjusts the counters itself; this covers ORM deletes
+    remove_messages([(instance.id, instance.room_id)])
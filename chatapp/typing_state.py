@@ -0,0 +1,70 @@
+# chatapp/typing_state.py
+"""
+Typing indicator state, per process.
+
+Clients send {"type": "typing"} while the user types. Instead of fanning
+out every one of those frames, the room only hears about transitions:
+"start" on the first frame, "stop" once no frame arrived for
+TYPING_EXPIRY seconds (or the user sent the message / disconnected).
+"""
+import asyncio
+
+from django.conf import settings
+
+from .frames import room_event
+from .metrics import group_send
+from .profiling import untraced_context
+from .rate_limit import counters
+
+
+class TypingTracker:
+
+    def __init__(self, expiry):
+        self.expiry = expiry
+        self.active = {}  # (room, username) -> expiry TimerHandle
+        self._tasks = set()
+
+    def touch(self, room, username):
+        """Record activity. Returns True if the user just started typing."""
+        key = (room, username)
+        handle = self.active.pop(key, None)
+        if handle:
+            handle.cancel()
+            counters["typing.coalesced"] += 1
+        self.active[key] = asyncio.get_running_loop().call_later(
+            self.expiry, self._expire, key, context=untraced_context()
+        )
+        return handle is None
+
+    def clear(self, room, username):
+        """Forget the user's typing state. Returns True if they were typing."""
+        handle = self.active.pop((room, username), None)
+        if handle:
+            handle.cancel()
+        return handle is not None
+
+    def _expire(self, key):
+        del self.active[key]
+        task = asyncio.get_running_loop().create_task(broadcast(*key, "stop"))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+async def broadcast(room, username, state):
+    counters[f"typing.{state}"] += 1
+    await group_send(f"chat_{room}", room_event({
+        "type": "typing",
+        "username": username,
+        "state": state
+    }, exclude=username))
+
+
+_tracker = None
+
+
+def get_typing_tracker():
+    """Process-wide tracker configured by settings.TYPING_EXPIRY."""
+    global _tracker
+    if _tracker is None:
+        _tracker = TypingTracker(settings.TYPING_EXPIRY)
+    return _tracker
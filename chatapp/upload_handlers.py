@@ -0,0 +1,77 @@
+# chatapp/upload_handlers.py
+"""
+Upload handler writing multipart file fields straight into the media store.
+
+Django's default handlers keep a small file in memory or write a large
+one to a temp file, and the view then copied it into the store: every
+byte was written twice. StoreUploadHandler streams each file into the
+store's spool directory as the body is parsed, hashing it on the way, so
+the view only has to rename it into place (media_store.ingest_file).
+
+A file growing past MAX_UPLOAD_SIZE stops the parse right there with
+UploadError(413), and its partial spool file is removed.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .media_store import spool_dir
+from .upload_sessions import UploadError
+
+
+class StoredUpload(UploadedFile):
+    """A file spooled into the media store by StoreUploadHandler, with its SHA-256."""
+
+    def __init__(self, path, name, content_type, size, charset, content_type_extra, sha256):
+        super().__init__(open(path, "rb"), name, content_type, size, charset, content_type_extra)
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        # Django closes request files after the response. ingest_file() has
+        # consumed the spool file by then, unless the view never stored it.
+        try:
+            return self.file.close()
+        finally:
+            try:
+                os.unlink(self.file.name)
+            except FileNotFoundError:
+                pass
+
+
+class StoreUploadHandler(FileUploadHandler):
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        # Same filesystem as the store, so ingest_file() can rename into place
+        fd, self.path = tempfile.mkstemp(dir=spool_dir())
+        self.file = os.fdopen(fd, "wb")
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > settings.MAX_UPLOAD_SIZE:
+            self.upload_interrupted()
+            raise UploadError("File too large", status=413)
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        # Consumed: no later handler sees the chunk
+
+    def file_complete(self, file_size):
+        self.file.close()
+        return StoredUpload(
+            self.path, self.file_name, self.content_type, file_size,
+            self.charset, self.content_type_extra, self.digest.hexdigest(),
+        )
+
+    def upload_interrupted(self):
+        if getattr(self, "file", None) is not None and not self.file.closed:
+            self.file.close()
+            os.unlink(self.path)
@@ -0,0 +1,265 @@
+# chatapp/upload_sessions.py
+"""
+Resumable chunked upload sessions.
+
+A session is three files under UPLOAD_SESSION_DIR:
+    <id>.json   metadata (owner, filename, size, chunk size, ...)
+    <id>.part   the target file, preallocated to its final size
+    <id>.map    one byte per chunk, set to 1 once that chunk is stored
+
+Chunks are written with positional writes at index * chunk_size, so they
+can arrive in any order or more than once; a chunk already stored is not
+written again. Chunk writes and finalize() take the same flock on the
+metadata file: a chunk of a session is never written while another one
+is, nor after its file has moved into the media store. The request body
+is already spooled locally by then, so that only serializes disk copies.
+
+Each user may have UPLOAD_SESSION_MAX_OPEN sessions open, preallocating
+at most UPLOAD_SESSION_MAX_BYTES between them.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.utils.text import get_valid_filename
+
+from .media_store import ingest_file
+
+READ_BLOCK = 64 * 1024
+UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    """Rejected upload operation; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadSession:
+
+    def __init__(self, upload_id, meta):
+        self.id = upload_id
+        self.meta = meta
+        base = settings.UPLOAD_SESSION_DIR / upload_id
+        self.part_path = base.with_suffix(".part")
+        self.map_path = base.with_suffix(".map")
+        self.meta_path = base.with_suffix(".json")
+
+    @property
+    def size(self):
+        return self.meta["size"]
+
+    @property
+    def chunk_size(self):
+        return self.meta["chunk_size"]
+
+    @property
+    def total_chunks(self):
+        return self.meta["total_chunks"]
+
+    @property
+    def filename(self):
+        return self.meta["filename"]
+
+    # ---------------------------------------
+    # LIFECYCLE
+    # ---------------------------------------
+    @classmethod
+    def create(cls, user_id, filename, size, chunk_size=None, sha256=None):
+        if size <= 0:
+            raise UploadError("File is empty")
+        if size > settings.MAX_UPLOAD_SIZE:
+            raise UploadError("File too large", status=413)
+
+        chunk_size = min(max(chunk_size or settings.UPLOAD_CHUNK_SIZE, settings.UPLOAD_MIN_CHUNK_SIZE),
+                         settings.UPLOAD_MAX_CHUNK_SIZE)
+        total_chunks = (size + chunk_size - 1) // chunk_size
+
+        os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+        cls.purge_expired()
+
+        with open(settings.UPLOAD_SESSION_DIR / f"user-{user_id}.lock", "w") as lock:
+            # Concurrent creates by one user must not both pass the quota check
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            open_sessions = cls.open_sizes(user_id)
+            if len(open_sessions) >= settings.UPLOAD_SESSION_MAX_OPEN:
+                raise UploadError(f"Too many unfinished uploads (at most {settings.UPLOAD_SESSION_MAX_OPEN})", status=429)
+            if sum(open_sessions) + size > settings.UPLOAD_SESSION_MAX_BYTES:
+                raise UploadError("Unfinished uploads would take too much space", status=413)
+            return cls._start(user_id, filename, size, chunk_size, total_chunks, sha256)
+
+    @classmethod
+    def _start(cls, user_id, filename, size, chunk_size, total_chunks, sha256):
+        session = cls(uuid.uuid4().hex, {
+            "user_id": user_id,
+            "filename": get_valid_filename(os.path.basename(filename)) or "upload",
+            "size": size,
+            "chunk_size": chunk_size,
+            "total_chunks": total_chunks,
+            "sha256": sha256.lower() if sha256 else None,
+            "created_at": time.time(),
+        })
+
+        with open(session.part_path, "wb") as f:
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except (AttributeError, OSError):
+                f.truncate(size)  # sparse file where fallocate is unsupported
+        with open(session.map_path, "wb") as f:
+            f.write(b"\0" * total_chunks)
+        with open(session.meta_path, "w") as f:
+            json.dump(session.meta, f)
+
+        return session
+
+    @classmethod
+    def load(cls, upload_id, user_id):
+        """The caller's session, or UploadError(404)."""
+        if not UPLOAD_ID.match(upload_id or ""):
+            raise UploadError("Unknown upload", status=404)
+        try:
+            with open(settings.UPLOAD_SESSION_DIR / f"{upload_id}.json") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise UploadError("Unknown upload", status=404)
+
+        if meta["user_id"] != user_id:
+            raise UploadError("Unknown upload", status=404)
+        return cls(upload_id, meta)
+
+    @classmethod
+    def open_sizes(cls, user_id):
+        """Sizes of the user's unfinished sessions."""
+        sizes = []
+        for meta_path in settings.UPLOAD_SESSION_DIR.glob("*.json"):
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue  # finished meanwhile, or being written
+            if meta.get("user_id") == user_id:
+                sizes.append(meta["size"])
+        return sizes
+
+    @classmethod
+    def purge_expired(cls):
+        """Remove sessions idle for longer than UPLOAD_SESSION_TTL."""
+        cutoff = time.time() - settings.UPLOAD_SESSION_TTL
+        for meta_path in settings.UPLOAD_SESSION_DIR.glob("*.json"):
+            part_path = meta_path.with_suffix(".part")
+            try:
+                last_activity = max(meta_path.stat().st_mtime, part_path.stat().st_mtime)
+            except FileNotFoundError:
+                last_activity = 0
+            if last_activity < cutoff:
+                cls(meta_path.stem, {}).abort()
+
+    def abort(self):
+        for path in (self.meta_path, self.map_path, self.part_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    # ---------------------------------------
+    # CHUNKS
+    # ---------------------------------------
+    def chunk_length(self, index):
+        if index == self.total_chunks - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    def write_chunk(self, index, stream, length, sha256=None):
+        """
+        Store chunk `index` read from `stream` (exactly `length` bytes).
+        `sha256` is the hex digest the client computed for the chunk.
+        Returns False if the chunk was already stored (it is left as is).
+        """
+        if not 0 <= index < self.total_chunks:
+            raise UploadError("Chunk index out of range")
+        if length != self.chunk_length(index):
+            raise UploadError(f"Chunk {index} must be {self.chunk_length(index)} bytes")
+
+        try:
+            lock = open(self.meta_path)
+        except FileNotFoundError:
+            raise UploadError("Unknown upload", status=404)
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not self.part_path.exists():
+                raise UploadError("Upload already finalized", status=409)
+            # A failed retry must not overwrite bytes that were accepted
+            if index in self.received():
+                return False
+            self._write(index, stream, length, sha256)
+        return True
+
+    def _write(self, index, stream, length, sha256):
+        digest = hashlib.sha256()
+        offset = index * self.chunk_size
+        remaining = length
+
+        fd = os.open(self.part_path, os.O_WRONLY)
+        try:
+            while remaining:
+                block = stream.read(min(READ_BLOCK, remaining))
+                if not block:
+                    raise UploadError("Chunk body ended early")
+                os.pwrite(fd, block, offset)
+                digest.update(block)
+                offset += len(block)
+                remaining -= len(block)
+        finally:
+            os.close(fd)
+
+        if sha256 and digest.hexdigest() != sha256.lower():
+            raise UploadError(f"Checksum mismatch for chunk {index}", status=422)
+
+        fd = os.open(self.map_path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, b"\1", index)
+        finally:
+            os.close(fd)
+
+    def received(self):
+        """Indexes of chunks stored so far."""
+        with open(self.map_path, "rb") as f:
+            return [i for i, flag in enumerate(f.read()) if flag]
+
+    # ---------------------------------------
+    # FINALIZE
+    # ---------------------------------------
+    def finalize(self):
+        """
+        Verify every chunk arrived and move the file into the media store
+        (a rename, the bytes are not copied). Returns (blob, deduplicated).
+        """
+        with open(self.meta_path) as lock:
+            # Two concurrent "complete" calls must not both move the file
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not self.part_path.exists():
+                raise UploadError("Upload already finalized", status=409)
+
+            missing = self.total_chunks - len(self.received())
+            if missing:
+                raise UploadError(f"{missing} chunks missing", status=409)
+
+            digest = hashlib.sha256()
+            with open(self.part_path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+            if self.meta.get("sha256") and digest.hexdigest() != self.meta["sha256"]:
+                raise UploadError("Checksum mismatch for file", status=422)
+
+            ext = os.path.splitext(self.filename)[1]
+            result = ingest_file(self.part_path, digest.hexdigest(), self.size, ext)
+
+        self.abort()
+        return result
@@ -1,6 +1,7 @@
 from django.urls import path
 from .views_call_recording import save_call_recording
 from .views_media import upload_media
+from . import views_upload
 from . import views
 
 urlpatterns = [
@@ -9,13 +10,30 @@ urlpatterns = [
 
     # Chat room
     path("chat/<str:room_name>/", views.chat_room, name="chat_room"),
+    path("chat/<str:room_name>/history/", views.message_history, name="message_history"),
+    path("chat/<str:room_name>/search/", views.message_search, name="message_search"),
+
+    # Rooms the user is in, with unread counts
+    path("api/rooms/", views.rooms, name="rooms"),
+    path("api/rooms/<str:room_name>/read/", views.mark_room_read, name="mark_room_read"),
 
     # Admin panel create user
     path("panel/create-user/", views.admin_create_user, name="admin_create_user"),
+    path("panel/ws-stats/", views.ws_stats, name="ws_stats"),
+    path("panel/profile/", views.profile, name="profile"),
+    path("panel/profile/folded/", views.profile_folded, name="profile_folded"),
+    path("panel/slow/", views.slow_frames, name="slow_frames"),
+    path("metrics/", views.metrics, name="metrics"),
 
     # Call recording upload endpoint
     path("call/record/", save_call_recording, name="save_call_recording"),
     #media upload
     path("media/upload/", upload_media, name="upload_media"),
 
+    # Resumable chunked uploads
+    path("media/upload/sessions/", views_upload.create_upload, name="create_upload"),
+    path("media/upload/sessions/<str:upload_id>/", views_upload.upload_status, name="upload_status"),
+    path("media/upload/sessions/<str:upload_id>/chunks/<int:index>/", views_upload.upload_chunk, name="upload_chunk"),
+    path("media/upload/sessions/<str:upload_id>/complete/", views_upload.complete_upload, name="complete_upload"),
+
 ]
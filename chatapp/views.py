@@ -1,11 +1,28 @@
+from datetime import datetime
+
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, redirect
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
+from django.views.decorators.http import require_POST
 from django import forms
 from django.db.models import Q
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 
-from .models import ChatRoom, MediaFile, CallRecording
+from . import async_views
+from .metrics import database_sync_to_async, render as render_metrics
+from .models import MediaFile, CallRecording
+from .profiling import get_slow_log, sampler
+from .room_cache import get_room_id
+from .history import PAGE_SIZE, encode_cursor, fetch_page
+from .search import PAGE_SIZE as SEARCH_PAGE_SIZE, search_messages
+from .media_pipeline import PROCESSED_TYPES, variants_for_urls
+from .rate_limit import counters as frame_counters
+from .recent_messages import get_recent_messages, load_recent
+from .room_summary import room_list, save_marks
 
 
 # -----------------------------------------
@@ -18,22 +35,106 @@ def redirect_to_login(request):
 # -----------------------------------------
 # CHAT ROOM VIEW
 # -----------------------------------------
-@login_required
-def chat_room(request, room_name):
-    room, _ = ChatRoom.objects.get_or_create(name=room_name)
-    messages = (
-        room.messages
-        .select_related("user")
-        .all()
-        .order_by("-timestamp")[:50][::-1]
-    )
+@async_views.login_required
+async def chat_room(request, room_name):
+    room_id = await database_sync_to_async(get_room_id)(room_name)
+    if isinstance(request, ASGIRequest):
+        # Hot rooms are served from the cache; concurrent misses share one query
+        entries = await get_recent_messages().recent(room_id, database_sync_to_async(load_recent))
+    else:
+        # No long-lived event loop to share the cache with
+        entries = await database_sync_to_async(load_recent)(room_id)
+    messages = [
+        {**e, "timestamp": datetime.fromisoformat(e["timestamp"])}
+        for e in entries[-PAGE_SIZE:]
+    ]
+
+    # Thumbnails rendered after the message was cached
+    pending = {
+        att["url"] for m in messages for att in m["attachments"]
+        if att.get("type") in PROCESSED_TYPES and att.get("url") and "thumb" not in att
+    }
+    if pending:
+        variants = await database_sync_to_async(variants_for_urls)(pending)
+        for m in messages:
+            m["attachments"] = [{**att, **variants.get(att.get("url"), {})} for att in m["attachments"]]
+
+    # Opening the room reads it (and lists it among the user's rooms)
+    await database_sync_to_async(save_marks)({(request.user.id, room_id): None})
+
+    # Where "load older messages" continues from
+    history_cursor = ""
+    if len(messages) == PAGE_SIZE:
+        history_cursor = encode_cursor(messages[0]["timestamp"], messages[0]["id"])
 
     return render(request, "chat_room.html", {
         "room_name": room_name,
-        "messages": messages
+        "messages": messages,
+        "history_cursor": history_cursor,
     })
 
 
+# -----------------------------------------
+# MESSAGE HISTORY (JSON, keyset paginated)
+# -----------------------------------------
+@login_required
+def message_history(request, room_name):
+    try:
+        limit = int(request.GET.get("limit", PAGE_SIZE))
+        messages, next_cursor = fetch_page(
+            get_room_id(room_name),
+            before=request.GET.get("before") or None,
+            limit=limit,
+        )
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor or limit"}, status=400)
+
+    return JsonResponse({"messages": messages, "next": next_cursor})
+
+
+# -----------------------------------------
+# ROOMS (JSON, with unread counts)
+# -----------------------------------------
+@login_required
+def rooms(request):
+    return JsonResponse({"rooms": room_list(request.user.id)})
+
+
+@login_required
+@require_POST
+def mark_room_read(request, room_name):
+    """POST [message_id]: read up to that message, else up to the newest."""
+    try:
+        message_id = int(request.POST["message_id"]) if request.POST.get("message_id") else None
+    except ValueError:
+        return JsonResponse({"error": "message_id must be an integer"}, status=400)
+    save_marks({(request.user.id, get_room_id(room_name)): message_id})
+    return JsonResponse({"ok": True})
+
+
+# -----------------------------------------
+# MESSAGE SEARCH (JSON, full-text, ranked)
+# -----------------------------------------
+@login_required
+def message_search(request, room_name):
+    query = request.GET.get("q", "").strip()
+    if not query:
+        return JsonResponse({"results": [], "next": None})
+
+    try:
+        limit = int(request.GET.get("limit", SEARCH_PAGE_SIZE))
+        results, next_cursor = search_messages(
+            get_room_id(room_name),
+            query,
+            after=request.GET.get("cursor") or None,
+            limit=limit,
+        )
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor or limit"}, status=400)
+
+    return JsonResponse({"results": results, "next": next_cursor})
+
+
 # -----------------------------------------
 # ADMIN CHECK
 # -----------------------------------------
@@ -98,3 +199,70 @@ def admin_create_user(request):
         "media": media,
         "call_records": call_records,
     })
+
+
+# -----------------------------------------
+# WEBSOCKET FRAME COUNTERS (this process)
+# -----------------------------------------
+@user_passes_test(is_admin)
+def ws_stats(request):
+    return JsonResponse({"counters": dict(sorted(frame_counters.items()))})
+
+
+# -----------------------------------------
+# PROMETHEUS METRICS (this process)
+# -----------------------------------------
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    authorized = token and constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}")
+    if not (authorized or is_admin(request.user)):
+        return HttpResponse("Forbidden", status=403, content_type="text/plain")
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# -----------------------------------------
+# PROFILER AND SLOW FRAMES (this process)
+# -----------------------------------------
+@user_passes_test(is_admin)
+def profile(request):
+    """
+    GET: the profiler's status. POST seconds, [interval_ms], [idle]: start
+    sampling; POST stop: end it early.
+    """
+    if request.method == "POST":
+        if request.POST.get("stop"):
+            sampler.stop()
+        else:
+            try:
+                seconds = float(request.POST.get("seconds") or 10)
+                interval = float(request.POST.get("interval_ms") or 5) / 1000
+            except ValueError:
+                return JsonResponse({"error": "seconds and interval_ms must be numbers"}, status=400)
+            if not sampler.start(seconds, interval, include_idle=bool(request.POST.get("idle"))):
+                return JsonResponse({"error": "A profile is already running", **sampler.status()}, status=409)
+    return JsonResponse(sampler.status())
+
+
+@user_passes_test(is_admin)
+def profile_folded(request):
+    """The last profile as folded stacks, for flamegraph.pl or speedscope."""
+    response = HttpResponse(sampler.folded(), content_type="text/plain; charset=utf-8")
+    response["Content-Disposition"] = 'attachment; filename="profile.folded"'
+    return response
+
+
+@user_passes_test(is_admin)
+def slow_frames(request):
+    """
+    GET: frames and requests over the threshold, newest first.
+    POST threshold_ms (0 = off), [clear]: change the threshold.
+    """
+    log = get_slow_log()
+    if request.method == "POST":
+        try:
+            log.threshold_ms = max(0, int(request.POST.get("threshold_ms", log.threshold_ms)))
+        except ValueError:
+            return JsonResponse({"error": "threshold_ms must be an integer"}, status=400)
+        if request.POST.get("clear"):
+            log.entries.clear()
+    return JsonResponse({"threshold_ms": log.threshold_ms, "entries": list(reversed(log.entries))})
@@ -1,17 +1,19 @@
 # chatapp/views_call_recording.py
-import os
-import uuid
 import logging
 from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
-from django.conf import settings
+from .async_views import csrf_exempt, read_form
+from .blocking_io import run_blocking
+from .media_store import blob_url, ingest_file
+from .metrics import upload_bytes
 from .models import CallRecording
+from .upload_handlers import StoreUploadHandler
+from .upload_sessions import UploadError
 
 logger = logging.getLogger(__name__)
 
 
 @csrf_exempt
-def save_call_recording(request):
+async def save_call_recording(request):
     """
     Accepts audio blob from JS and stores file + DB record
     """
@@ -19,39 +21,38 @@ def save_call_recording(request):
         logger.warning("save_call_recording called with non-POST method")
         return JsonResponse({"error": "POST required"}, status=400)
 
-    caller = request.POST.get("caller")
-    receiver = request.POST.get("receiver")
-    room_name = request.POST.get("room_name", "")
-    duration = request.POST.get("duration", 0)
+    try:
+        post, files = await read_form(request, [StoreUploadHandler(request)])
+    except UploadError as e:
+        logger.warning(f"Rejected call recording upload: {e}")
+        return JsonResponse({"error": str(e)}, status=e.status)
+    caller = post.get("caller")
+    receiver = post.get("receiver")
+    room_name = post.get("room_name", "")
+    duration = post.get("duration", 0)
 
     logger.info(f"Attempting to save call recording: caller={caller}, receiver={receiver}, room_name={room_name}, duration={duration}")
 
-    audio_file = request.FILES.get("recording")
+    audio_file = files.get("recording")
     if not audio_file:
         logger.error("No recording file provided in request")
         return JsonResponse({"error": "No file"}, status=400)
 
     try:
-        # Generate file name
-        filename = f"recordings/{uuid.uuid4()}.webm"
-        file_path = os.path.join(settings.MEDIA_ROOT, filename)
-
-        # Ensure recordings directory exists
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-        # Save file manually
-        with open(file_path, "wb+") as f:
-            for chunk in audio_file.chunks():
-                f.write(chunk)
-
-        file_url = settings.MEDIA_URL + filename
+        # Move into the content-addressed store
+        blob, _ = await run_blocking(
+            ingest_file, audio_file.temporary_file_path(), audio_file.sha256, audio_file.size, ".webm"
+        )
+        upload_bytes.inc("recording", amount=audio_file.size)
+        file_url = blob_url(blob)
 
         # Save to DB
-        rec = CallRecording.objects.create(
+        rec = await CallRecording.objects.acreate(
             caller=caller,
             receiver=receiver,
             room_name=room_name,
             file_url=file_url,
+            blob=blob,
             duration=duration
         )
 
@@ -1,64 +1,72 @@
 # chatapp/views_media.py
 import os
 import mimetypes
+from django.core.handlers.asgi import ASGIRequest
 from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
-from django.utils import timezone
-from django.conf import settings
-from django.contrib.auth.models import User
 
-from .models import ChatRoom, MediaFile
+from . import media_pipeline
+from .async_views import csrf_exempt, read_form
+from .blocking_io import run_blocking
+from .media_store import blob_url, ingest_file
+from .metrics import database_sync_to_async, upload_bytes
+from .room_cache import get_room_id
+from .upload_handlers import StoreUploadHandler
+from .upload_sessions import UploadError
+
+
+def detect_media_type(filename):
+    """image / video / audio / file, from the file name."""
+    mime, _ = mimetypes.guess_type(filename)
+    if mime is None:
+        return "file"
+    elif mime.startswith("image"):
+        return "image"
+    elif mime.startswith("video"):
+        return "video"
+    elif mime.startswith("audio"):
+        return "audio"
+    return "file"
 
 
 @csrf_exempt
-def upload_media(request):
+async def upload_media(request):
     """
     Handles media uploads from inputbar.html
-    Saves image/video/audio/files to MEDIA/chat/
+    Saves image/video/audio/files to MEDIA/cas/ (content-addressed)
     Returns public URL for WebSocket broadcast.
     """
 
     if request.method != "POST":
         return JsonResponse({"error": "Invalid request"}, status=400)
 
-    if "file" not in request.FILES:
+    try:
+        post, files = await read_form(request, [StoreUploadHandler(request)])
+    except UploadError as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+    if "file" not in files:
         return JsonResponse({"error": "No file uploaded"}, status=400)
 
-    file = request.FILES["file"]
-    room_name = request.POST.get("room")
-    user = request.user if request.user.is_authenticated else None
+    file = files["file"]
+    room_name = post.get("room")
 
-    room, _ = ChatRoom.objects.get_or_create(name=room_name)
+    await database_sync_to_async(get_room_id)(room_name)  # make sure the room exists
 
     # Detect file type
-    mime, _ = mimetypes.guess_type(file.name)
-    if mime is None:
-        media_type = "file"
-    elif mime.startswith("image"):
-        media_type = "image"
-    elif mime.startswith("video"):
-        media_type = "video"
-    elif mime.startswith("audio"):
-        media_type = "audio"
-    else:
-        media_type = "file"
-
-    # Save the file to MEDIA_ROOT
-    from django.core.files.storage import default_storage
-    from django.conf import settings
-    import os
+    media_type = detect_media_type(file.name)
 
-    # Generate a unique filename
+    # Move into the content-addressed store (duplicates reuse the stored blob)
     ext = os.path.splitext(file.name)[1]
-    filename = f"{room_name}_{timezone.now().strftime('%Y%m%d_%H%M%S')}_{file.name}"
-    file_path = os.path.join('media', filename)
-    saved_path = default_storage.save(file_path, file)
+    blob, deduplicated = await run_blocking(ingest_file, file.temporary_file_path(), file.sha256, file.size, ext)
+    upload_bytes.inc("media", amount=file.size)
 
-    # Get the URL
-    file_url = default_storage.url(saved_path)
+    # Thumbnails / previews are rendered in the background on the ASGI loop
+    if isinstance(request, ASGIRequest):
+        await media_pipeline.schedule(blob, media_type, room_name)
 
     return JsonResponse({
         "success": True,
-        "url": file_url,
-        "media_type": media_type
+        "url": blob_url(blob),
+        "media_type": media_type,
+        "sha256": blob.sha256,
+        "deduplicated": deduplicated
     })
@@ -1,43 +1,122 @@
-import os
-from django.core.files.storage import default_storage
+# chatapp/views_upload.py
+from functools import wraps
+
+from django.core.handlers.asgi import ASGIRequest
 from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
-from django.conf import settings
 
-UPLOAD_DIR = settings.MEDIA_ROOT / "uploads"
+from . import media_pipeline
+from .async_views import csrf_exempt, is_authenticated, read_form, require_http_methods
+from .blocking_io import run_blocking
+from .media_store import blob_url
+from .metrics import upload_bytes
+from .upload_sessions import UploadError, UploadSession
+from .views_media import detect_media_type
+
+
+def _session_response(session, received):
+    return JsonResponse({
+        "upload_id": session.id,
+        "filename": session.filename,
+        "size": session.size,
+        "chunk_size": session.chunk_size,
+        "total_chunks": session.total_chunks,
+        "received": received,
+        "complete": len(received) == session.total_chunks,
+    })
+
 
+def _upload_view(view):
+    """Login check + UploadError -> JSON error response."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await is_authenticated(request):
+            return JsonResponse({"error": "Login required"}, status=401)
+        try:
+            return await view(request, *args, **kwargs)
+        except UploadError as e:
+            return JsonResponse({"error": str(e)}, status=e.status)
+    return csrf_exempt(wrapper)
 
-@csrf_exempt
-def chunk_upload(request):
+
+@_upload_view
+@require_http_methods(["POST"])
+async def create_upload(request):
     """
-    Handles large uploads using chunks:
-    - "file" uploaded in request.FILES
-    - "filename" in POST
-    - "chunk_index"
-    - "total_chunks"
+    Starts a resumable upload.
+    POST: filename, size, [chunk_size], [sha256 of the whole file]
+    Returns upload_id and the chunk size the server picked.
     """
+    post, _ = await read_form(request)
+    try:
+        size = int(post.get("size", ""))
+        chunk_size = int(post.get("chunk_size") or 0)
+    except ValueError:
+        return JsonResponse({"error": "size and chunk_size must be integers"}, status=400)
 
-    if request.method != "POST":
-        return JsonResponse({"error": "Invalid method"}, status=405)
+    # Preallocates the file (and purges expired sessions)
+    session = await run_blocking(
+        UploadSession.create,
+        request.user.id,
+        post.get("filename", ""),
+        size,
+        chunk_size=chunk_size,
+        sha256=post.get("sha256") or None,
+    )
+    return _session_response(session, [])
 
-    file = request.FILES.get("file")
-    filename = request.POST.get("filename")
-    chunk = int(request.POST.get("chunk_index"))
-    total = int(request.POST.get("total_chunks"))
 
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    temp_path = UPLOAD_DIR / f"{filename}.part"
+@_upload_view
+@require_http_methods(["GET", "DELETE"])
+async def upload_status(request, upload_id):
+    """
+    GET: which chunks the server already has (for resuming).
+    DELETE: abort the upload.
+    """
+    session = await run_blocking(UploadSession.load, upload_id, request.user.id)
+    if request.method == "DELETE":
+        await run_blocking(session.abort)
+        return JsonResponse({"aborted": True})
+    return _session_response(session, await run_blocking(session.received))
 
-    # Append chunk to temp file
-    with open(temp_path, "ab") as f:
-        for chunk_part in file.chunks():
-            f.write(chunk_part)
 
-    # Final assembly
-    if chunk + 1 == total:
-        final_path = UPLOAD_DIR / filename
-        os.rename(temp_path, final_path)
+@_upload_view
+@require_http_methods(["PUT"])
+async def upload_chunk(request, upload_id, index):
+    """
+    Stores one chunk. Raw request body, optional X-Chunk-SHA256 header.
+    Chunks may be sent in any order and in parallel; re-sending is safe.
+    """
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return JsonResponse({"error": "Invalid Content-Length"}, status=400)
+    session = await run_blocking(UploadSession.load, upload_id, request.user.id)
+    stored = await run_blocking(session.write_chunk, index, request, length, sha256=request.headers.get("X-Chunk-SHA256"))
+    if stored:
+        upload_bytes.inc("chunk", amount=length)
+    return JsonResponse({"chunk_received": index})
+
+
+@_upload_view
+@require_http_methods(["POST"])
+async def complete_upload(request, upload_id):
+    """
+    Verifies every chunk arrived and moves the file into the media store.
+    Optional POST "room" is notified when thumbnails are ready.
+    Returns the same shape as upload_media.
+    """
+    post, _ = await read_form(request)
+    session = await run_blocking(UploadSession.load, upload_id, request.user.id)
+    blob, deduplicated = await run_blocking(session.finalize)
+    media_type = detect_media_type(session.filename)
 
-        return JsonResponse({"completed": True, "file_url": f"/media/uploads/{filename}"})
+    if isinstance(request, ASGIRequest):
+        await media_pipeline.schedule(blob, media_type, post.get("room"))
 
-    return JsonResponse({"chunk_received": chunk})
+    return JsonResponse({
+        "success": True,
+        "url": blob_url(blob),
+        "media_type": media_type,
+        "sha256": blob.sha256,
+        "deduplicated": deduplicated,
+    })
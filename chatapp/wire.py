@@ -0,0 +1,120 @@
+# chatapp/wire.py
+"""
+WebSocket wire protocols.
+
+Clients pick an encoding with the Sec-WebSocket-Protocol header; without
+one (the chat page) they get plain JSON text frames as before.
+
+    chat.json            JSON text frames
+    chat.json.short      JSON text frames with short keys
+    chat.msgpack         MessagePack binary frames
+    chat.msgpack.short   MessagePack binary frames with short keys
+
+Short keys rename the field names repeated in every frame (see SHORT_KEYS)
+in both directions; values are untouched.
+
+Room broadcasts arrive as pre-encoded JSON text (see frames.room_event).
+Codec.transcode() converts that text once per process and codec: the
+result is memoized, so a room with a thousand msgpack clients still pays
+for one conversion per event.
+"""
+from functools import lru_cache
+
+from .frames import decode as json_decode, encode as json_encode
+
+try:
+    import msgpack
+except ImportError:  # binary protocols are then simply not offered
+    msgpack = None
+
+SHORT_KEYS = {
+    "type": "t",
+    "message": "m",
+    "username": "u",
+    "attachments": "a",
+    "message_id": "i",
+    "message_ids": "is",
+    "reply_to": "r",
+    "timestamp": "ts",
+    "content": "c",
+    "url": "l",
+    "name": "n",
+    "duration": "d",
+    "thumb": "th",
+    "preview": "p",
+    "media_type": "mt",
+    "media_url": "mu",
+    "target": "to",
+    "from": "f",
+    "users": "us",
+    "state": "s",
+    "messages": "ms",
+    "next": "nx",
+    "seq": "q",
+}
+LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+
+
+def rename_keys(value, mapping):
+    if isinstance(value, dict):
+        return {mapping.get(k, k): rename_keys(v, mapping) for k, v in value.items()}
+    if isinstance(value, list):
+        return [rename_keys(v, mapping) for v in value]
+    return value
+
+
+class Codec:
+    """Frame encoding of one connection. encode() returns str or bytes."""
+
+    def __init__(self, subprotocol=None, binary=False, short=False):
+        self.subprotocol = subprotocol
+        self.binary = binary
+        self.short = short
+        self._memo = lru_cache(maxsize=512)(self._transcode)
+
+    def encode(self, frame):
+        if self.short:
+            frame = rename_keys(frame, SHORT_KEYS)
+        if self.binary:
+            return msgpack.packb(frame)
+        return json_encode(frame)
+
+    def decode(self, data):
+        """Raises ValueError on a malformed frame."""
+        try:
+            frame = msgpack.unpackb(data) if self.binary else json_decode(data)
+        except Exception as e:
+            raise ValueError("Malformed frame") from e
+        if not isinstance(frame, dict):
+            raise ValueError("Frame must be an object")
+        return rename_keys(frame, LONG_KEYS) if self.short else frame
+
+    def transcode(self, text):
+        """Encoded form of a frame given as JSON text (memoized)."""
+        return self._memo(text)
+
+    def _transcode(self, text):
+        return self.encode(json_decode(text))
+
+
+class JsonCodec(Codec):
+    """The default protocol: broadcasts are forwarded verbatim."""
+
+    def transcode(self, text):
+        return text
+
+
+DEFAULT_CODEC = JsonCodec()
+
+CODECS = {"chat.json": JsonCodec("chat.json"), "chat.json.short": Codec("chat.json.short", short=True)}
+if msgpack is not None:
+    CODECS["chat.msgpack"] = Codec("chat.msgpack", binary=True)
+    CODECS["chat.msgpack.short"] = Codec("chat.msgpack.short", binary=True, short=True)
+
+
+def negotiate(subprotocols):
+    """First protocol offered by the client that we speak, else plain JSON."""
+    for name in subprotocols:
+        if name in CODECS:
+            return CODECS[name]
+    return DEFAULT_CODEC
@@ -0,0 +1,324 @@
+# chatapp/write_behind.py
+"""
+Write-behind message persistence.
+
+ChatConsumer hands messages to one MessageWriter per process instead of
+saving each one on the thread pool. The writer coalesces messages from all
+consumers and flushes them with bulk_create when the batch is full or the
+oldest message has waited FLUSH_INTERVAL seconds. submit() resolves with the
+new message's id and timestamp once its batch is committed, so senders still
+get an id (and caches the timestamp history pages are keyed on).
+
+Every submitted message is first appended to a local spool file. Each flush
+appends an ack line; on startup, spools left behind by a crashed process are
+replayed so messages accepted before the crash are not lost (at-least-once:
+a crash between commit and ack can replay a batch).
+
+A batch the database refuses as a whole for bad data (e.g. a room deleted
+by another worker) is retried a message at a time; messages it still
+refuses are moved to a dead-letter file (SPOOL_DIR/rejected.jsonl) and
+their submit() calls raise RejectedError. A batch that fails for any other
+reason after its retries is not acked: its submit() calls raise
+PersistError, and it stays in the spool, retried by the next successful
+flush or replayed once the process is gone.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
+
+from .media_store import blob_ids_for_urls
+from .metrics import database_sync_to_async
+from .models import Message, MediaFile
+from .profiling import untraced_context
+from .room_summary import add_messages
+
+logger = logging.getLogger(__name__)
+
+
+class PersistError(Exception):
+    """The message's batch could not be committed; it stays spooled for replay."""
+
+
+class RejectedError(PersistError):
+    """The database refused the message itself; it was moved to the dead-letter file."""
+
+
+def write_batch(records):
+    """
+    Persist a batch of message records in one transaction.
+    Returns the new messages' (id, timestamp) in record order.
+    """
+    with transaction.atomic():
+        messages = Message.objects.bulk_create([
+            Message(
+                room_id=r["room_id"],
+                user_id=r["user_id"],
+                content=r["content"] or "",
+                attachments_json=r["attachments"] or [],
+            )
+            for r in records
+        ])
+
+        # Save media separately, linked to their stored blobs
+        blob_ids = blob_ids_for_urls({
+            att["url"] for r in records for att in r["attachments"] or [] if att.get("url")
+        })
+        MediaFile.objects.bulk_create([
+            MediaFile(
+                message_id=msg.id,
+                file_url=att["url"],
+                blob_id=blob_ids.get(att["url"]),
+                media_type=att.get("type", "file"),
+                duration=att.get("duration", ""),
+                name=att.get("name", ""),
+            )
+            for msg, r in zip(messages, records)
+            for att in r["attachments"] or []
+            if att.get("url")
+        ])
+
+        # Room counters and last message, committed with the messages
+        add_messages(messages)
+
+    return [(msg.id, msg.timestamp) for msg in messages]
+
+
+def write_or_reject(records, directory):
+    """
+    write_batch(), falling back to one transaction per record when the
+    database refuses the batch's data. Records it still refuses are
+    appended to `directory`/rejected.jsonl. Returns the new messages'
+    (id, timestamp) in record order, None for rejected records.
+    """
+    try:
+        return write_batch(records)
+    except (IntegrityError, DataError):
+        if len(records) == 1:
+            ids = [None]
+        else:
+            logger.warning("Batch of %d messages refused; saving them one at a time", len(records))
+            ids = [write_or_reject([record], directory)[0] for record in records]
+    if ids == [None]:
+        _reject(records[0], directory)
+    return ids
+
+
+def _reject(record, directory):
+    logger.error("Message refused by the database, moved to rejected.jsonl: %r", record)
+    with open(Path(directory) / "rejected.jsonl", "a", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps({"record": record}) + "\n")
+
+
+class Spool:
+    """
+    Append-only JSONL file owned (flock'ed) by this process.
+
+    Lines are {"seq": n, "record": {...}} for accepted messages and
+    {"from": m, "ack": n} once the records m to n are committed (older
+    spools ack with {"ack": n}: every record up to n).
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / f"messages-{os.getpid()}-{uuid.uuid4().hex[:8]}.spool"
+        self.file = open(self.path, "a+", encoding="utf-8")
+        fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def append(self, seq, record):
+        self.file.write(json.dumps({"seq": seq, "record": record}) + "\n")
+        self.file.flush()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+
+    def ack(self, first, last, compact=False):
+        if compact:
+            # Everything accepted so far is committed: start over
+            self.file.truncate(0)
+        else:
+            self.file.write(json.dumps({"from": first, "ack": last}) + "\n")
+        self.file.flush()
+
+    def recover_orphans(self):
+        """Replay spools whose owning process is gone."""
+        for path in self.directory.glob("messages-*.spool"):
+            if path == self.path:
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # owner still alive
+
+                records, acked = [], []
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn write at crash time
+                    if "ack" in entry:
+                        acked.append((entry.get("from", 0), entry["ack"]))
+                    else:
+                        records.append(entry)
+
+                pending = [
+                    e["record"] for e in records
+                    if not any(first <= e["seq"] <= last for first, last in acked)
+                ]
+                if pending:
+                    write_or_reject(pending, self.directory)
+                    logger.warning("Replayed %d spooled messages from %s", len(pending), path.name)
+            path.unlink()
+
+
+class MessageWriter:
+
+    retries = 3
+
+    def __init__(self, batch_size=200, flush_interval=0.05, spool_dir=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_dir = spool_dir
+        self.spool = None
+        self.pending = []  # [(seq, record, future)]
+        self.seq = 0
+        self.failed = []  # [(seq, record)] of batches left unacked in the spool
+        self._task = None
+
+    async def submit(self, room_id, user_id, content, attachments):
+        """
+        Queue a message. Returns its (id, timestamp) once the batch is
+        committed; raises PersistError if it cannot be.
+        """
+        if self._task is None:
+            await self._start()
+
+        record = {
+            "room_id": room_id,
+            "user_id": user_id,
+            "content": content,
+            "attachments": attachments,
+        }
+        self.seq += 1
+        self.spool.append(self.seq, record)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((self.seq, record, future))
+        self._has_pending.set()
+        if len(self.pending) >= self.batch_size:
+            self._batch_full.set()
+
+        return await future
+
+    async def _start(self):
+        self.spool = Spool(self.spool_dir)
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        # Flushes other consumers' messages too: not part of this frame's trace
+        self._task = asyncio.get_running_loop().create_task(self._run(), context=untraced_context())
+
+        # Left for the next process to retry: this one still has messages to save
+        try:
+            await database_sync_to_async(self.spool.recover_orphans)()
+        except Exception:
+            logger.exception("Failed to replay orphaned spools")
+
+    async def _run(self):
+        while True:
+            await self._has_pending.wait()
+
+            # Give other consumers up to flush_interval to fill the batch
+            if len(self.pending) < self.batch_size:
+                self._batch_full.clear()
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self.pending[:self.batch_size]
+            self.pending = self.pending[self.batch_size:]
+            if not self.pending:
+                self._has_pending.clear()
+
+            # One bad flush must not stop the writer: later submit()s would wait forever
+            try:
+                await self._flush(batch)
+            except Exception:
+                logger.exception("Failed to flush %d messages", len(batch))
+                self._fail(batch)
+
+    async def _flush(self, batch):
+        records = [record for _, record, _ in batch]
+
+        for attempt in range(self.retries + 1):
+            try:
+                saved = await database_sync_to_async(self._commit)(records)
+                break
+            except Exception:
+                logger.exception("Failed to persist %d messages (attempt %d)", len(batch), attempt + 1)
+                if attempt < self.retries:
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+        else:
+            # Not acked: the records stay in the spool until a later flush saves them
+            self.failed.extend((seq, record) for seq, record, _ in batch)
+            self._fail(batch)
+            return
+
+        if self.failed:
+            await self._retry_failed()
+        self.spool.ack(batch[0][0], batch[-1][0], compact=not self.pending and not self.failed)
+
+        for (_, _, future), message in zip(batch, saved):
+            if future.done():
+                continue
+            if message is None:
+                future.set_exception(RejectedError("Message could not be saved"))
+            else:
+                future.set_result(message)
+
+    async def _retry_failed(self):
+        """Save the batches that failed earlier (once: the database just took a batch)."""
+        failed, self.failed = self.failed, []
+        try:
+            await database_sync_to_async(self._commit)([record for _, record in failed])
+        except Exception:
+            logger.exception("Failed to persist %d messages of earlier batches", len(failed))
+            self.failed = failed
+            return
+        logger.warning("Saved %d messages of earlier failed batches", len(failed))
+        # Everything between them is committed too: acked batches or these
+        self.spool.ack(failed[0][0], failed[-1][0])
+
+    def _fail(self, batch):
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(PersistError("Message could not be saved; it will be retried"))
+
+    def _commit(self, records):
+        self.spool.sync()
+        return write_or_reject(records, self.spool.directory)
+
+
+_writer = None
+
+
+def get_message_writer():
+    """Process-wide writer configured by settings.WRITE_BEHIND."""
+    global _writer
+    if _writer is None:
+        config = settings.WRITE_BEHIND
+        _writer = MessageWriter(
+            batch_size=config["BATCH_SIZE"],
+            flush_interval=config["FLUSH_INTERVAL"],
+            spool_dir=config["SPOOL_DIR"],
+        )
+    return _writer
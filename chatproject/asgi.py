@@ -7,12 +7,14 @@ from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 
-django_asgi_app = get_asgi_application()
+get_asgi_application()  # sets Django up before the app modules are imported
 
 import chatapp.routing
+from chatapp.async_views import ASGIHandler
+from chatapp.media_serving import MediaFilesHandler
 
 application = ProtocolTypeRouter({
-    "http": django_asgi_app,
+    "http": MediaFilesHandler(ASGIHandler()),
     "websocket": AuthMiddlewareStack(
         URLRouter(
             chatapp.routing.websocket_urlpatterns
@@ -0,0 +1,56 @@
+# chatproject/server.py
+"""
+Daphne with WebSocket permessage-deflate enabled.
+
+Daphne's own command line does not expose autobahn's compression options,
+so this wraps it with a Server subclass that accepts the client's deflate
+offer. Usage is identical to the `daphne` command:
+
+    python -m chatproject.server -b 0.0.0.0 -p 8000 chatproject.asgi:application
+
+Compression costs CPU and a zlib context per connection; the window is
+capped to keep that memory small. Set WS_DEFLATE=0 to turn it off.
+"""
+import os
+
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne.cli import CommandLineInterface as DaphneCommandLineInterface
+from daphne.server import Server
+from twisted.internet import reactor
+
+# 2**11 byte window / memLevel 4: ~10 KB of zlib state per connection
+# instead of ~256 KB, still plenty for chat-sized JSON frames
+WINDOW_BITS = 11
+MEM_LEVEL = 4
+
+
+def accept_deflate(offers):
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(
+                offer,
+                request_max_window_bits=WINDOW_BITS if offer.accept_max_window_bits else 0,
+                window_bits=WINDOW_BITS,
+                mem_level=MEM_LEVEL,
+            )
+    return None
+
+
+class CompressingServer(Server):
+
+    def run(self):
+        # The factory is built inside Server.run(); connections are only
+        # accepted once the reactor runs, so options set then apply to all
+        reactor.callWhenRunning(self.enable_deflate)
+        super().run()
+
+    def enable_deflate(self):
+        self.ws_factory.setProtocolOptions(perMessageCompressionAccept=accept_deflate)
+
+
+class CommandLineInterface(DaphneCommandLineInterface):
+    server_class = CompressingServer if os.getenv("WS_DEFLATE", "1") != "0" else Server
+
+
+if __name__ == "__main__":
+    CommandLineInterface.entrypoint()
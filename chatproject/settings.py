@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",   # full-text search
 
     "channels",      # WebSockets
     "chatapp",       # Your chat app
@@ -48,6 +49,7 @@ INSTALLED_APPS = [
 # Middleware
 # -------------------------------------------------------
 MIDDLEWARE = [
+    "chatapp.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -117,6 +119,120 @@ else:
         },
     }
 
+# -------------------------------------------------------
+# Presence — who is online in each room
+# -------------------------------------------------------
+if REDIS_URL:
+    PRESENCE = {
+        "BACKEND": "chatapp.presence.RedisPresence",
+        "TTL": int(os.getenv("PRESENCE_TTL", "60")),            # seconds without heartbeat
+        "HEARTBEAT": int(os.getenv("PRESENCE_HEARTBEAT", "20")),
+    }
+else:
+    PRESENCE = {
+        "BACKEND": "chatapp.presence.InMemoryPresence",
+    }
+
+# -------------------------------------------------------
+# Calls — ringing/active state of one-to-one calls
+# -------------------------------------------------------
+if REDIS_URL:
+    CALLS = {
+        "BACKEND": "chatapp.calls.RedisCallRegistry",
+        "RING_TIMEOUT": int(os.getenv("CALL_RING_TIMEOUT", "30")),   # seconds unanswered
+    }
+else:
+    CALLS = {
+        "BACKEND": "chatapp.calls.InMemoryCallRegistry",
+        "RING_TIMEOUT": int(os.getenv("CALL_RING_TIMEOUT", "30")),
+    }
+
+# -------------------------------------------------------
+# Reconnect catch-up — recent room events kept for replay
+# -------------------------------------------------------
+if REDIS_URL:
+    EVENT_LOG = {
+        "BACKEND": "chatapp.event_log.RedisEventLog",
+        "SIZE": int(os.getenv("EVENT_LOG_SIZE", "1000")),   # events per room
+        "TTL": int(os.getenv("EVENT_LOG_TTL", "3600")),     # seconds after the last event
+    }
+else:
+    EVENT_LOG = {
+        "BACKEND": "chatapp.event_log.InMemoryEventLog",
+        "SIZE": int(os.getenv("EVENT_LOG_SIZE", "1000")),
+    }
+
+# -------------------------------------------------------
+# Recent messages of hot rooms, for rendering chat_room
+# -------------------------------------------------------
+if REDIS_URL:
+    RECENT_MESSAGES = {
+        "BACKEND": "chatapp.recent_messages.RedisRecentMessages",
+        "TTL": int(os.getenv("RECENT_MESSAGES_TTL", "600")),   # seconds
+    }
+else:
+    RECENT_MESSAGES = {
+        "BACKEND": "chatapp.recent_messages.InMemoryRecentMessages",
+        "ROOMS": int(os.getenv("RECENT_MESSAGES_ROOMS", "1000")),
+        "TTL": int(os.getenv("RECENT_MESSAGES_TTL", "600")),
+    }
+
+# -------------------------------------------------------
+# Message persistence — write-behind batching
+# -------------------------------------------------------
+WRITE_BEHIND = {
+    "BATCH_SIZE": int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200")),
+    "FLUSH_INTERVAL": float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.05")),  # seconds
+    "SPOOL_DIR": Path(os.getenv("WRITE_BEHIND_SPOOL_DIR", BASE_DIR / "spool")),
+}
+
+# -------------------------------------------------------
+# Message partitions and archive (see chatapp/partitions.py, chatapp/archive.py)
+# -------------------------------------------------------
+MESSAGE_ARCHIVE = {
+    "DIR": Path(os.getenv("MESSAGE_ARCHIVE_DIR", BASE_DIR / "archive")),
+    "RETENTION_MONTHS": int(os.getenv("MESSAGE_RETENTION_MONTHS", "12")),  # months kept in the database
+    "MONTHS_AHEAD": 3,     # partitions created ahead of time by archive_messages
+    "INDEX_TTL": 60,       # seconds history reads trust their copy of the archive index
+}
+
+# Room name -> id cache shared by consumers and views (per process)
+ROOM_CACHE_SIZE = int(os.getenv("ROOM_CACHE_SIZE", "1024"))
+ROOM_CACHE_TTL = int(os.getenv("ROOM_CACHE_TTL", "60"))  # seconds; bounds staleness in other processes
+
+# -------------------------------------------------------
+# WebSocket inbound limits
+# -------------------------------------------------------
+# Per connection, by frame kind: (frames per second, burst)
+WS_RATE_LIMITS = {
+    "message": (5, 20),      # text, media, edit, delete
+    "typing": (2, 5),
+    "signal": (50, 200),     # WebRTC offers/answers/ICE come in bursts
+    "history": (2, 5),
+    "read": (2, 10),         # read marks, coalesced before they are written
+}
+
+# Read cursor marks are written once per interval, per process (see chatapp/room_summary.py)
+READ_CURSORS = {
+    "FLUSH_INTERVAL": float(os.getenv("READ_CURSORS_FLUSH_INTERVAL", "1")),  # seconds
+}
+
+# -------------------------------------------------------
+# WebSocket outbound queues (see chatapp/outbound.py)
+# -------------------------------------------------------
+OUTBOUND = {
+    "HIGH_WATER": int(os.getenv("OUTBOUND_HIGH_WATER", "256")),  # frames; past it typing / presence are shed
+    "MAX_QUEUE": int(os.getenv("OUTBOUND_MAX_QUEUE", "2048")),   # evicted at once
+    "MAX_LAG": float(os.getenv("OUTBOUND_MAX_LAG", "15")),       # seconds past HIGH_WATER before eviction
+    "RETRY_AFTER": (1, 5),                                       # reconnect hint, seconds (random in range)
+}
+
+# Seconds without a typing frame before "stop" is broadcast
+TYPING_EXPIRY = float(os.getenv("TYPING_EXPIRY", "4"))
+
+# Results of the bench_* management commands
+BENCHMARK_DIR = Path(os.getenv("BENCHMARK_DIR", BASE_DIR / "benchmarks"))
+
 # -------------------------------------------------------
 # Static files
 # -------------------------------------------------------
@@ -136,6 +252,36 @@ LOGOUT_REDIRECT_URL = "/login/"
 # -------------------------------------------------------
 MAX_UPLOAD_SIZE = 1024 * 1024 * 1024  # 1 GB
 
+# Resumable chunked uploads (see chatapp/upload_sessions.py)
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024       # default chunk size
+UPLOAD_MIN_CHUNK_SIZE = 256 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 60 * 60         # abandoned sessions are purged after a day
+UPLOAD_SESSION_MAX_OPEN = int(os.getenv("UPLOAD_SESSION_MAX_OPEN", "8"))   # unfinished sessions per user
+UPLOAD_SESSION_MAX_BYTES = int(os.getenv("UPLOAD_SESSION_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))  # their total size
+
+# Threads writing / hashing uploads for the async views (see chatapp/blocking_io.py)
+BLOCKING_IO_WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", "2"))
+
+# Background thumbnail / preview generation (see chatapp/media_pipeline.py)
+MEDIA_PIPELINE = {
+    "WORKERS": int(os.getenv("MEDIA_PIPELINE_WORKERS", "2")),
+    "THUMBNAIL_SIZE": 320,   # longest side, px
+    "PREVIEW_SIZE": 1280,
+}
+
+# Bearer token for Prometheus scraping /metrics (staff sessions may always read it)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Frames / requests slower than this are kept with their queries (panel/slow/; 0 = off)
+SLOW_FRAME_MS = int(os.getenv("SLOW_FRAME_MS", "500"))
+SLOW_FRAME_LOG_SIZE = 200
+
 # Media
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+UPLOAD_SESSION_DIR = MEDIA_ROOT / "upload_sessions"
+
+# Behind nginx: hand media bodies to an `internal` location aliasing MEDIA_ROOT,
+# e.g. MEDIA_ACCEL_REDIRECT=/protected-media/ (empty = stream from Daphne)
+MEDIA_ACCEL_REDIRECT = os.getenv("MEDIA_ACCEL_REDIRECT", "")
@@ -25,8 +25,7 @@ urlpatterns = [
     path("", include("chatapp.urls")),
 ]
 
-# ENABLE MEDIA SERVING
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Media files are served by chatapp.media_serving.MediaFilesHandler (see asgi.py)
 
 # ENABLE STATIC SERVING (for development with Daphne)
 if settings.DEBUG:
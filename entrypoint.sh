@@ -48,4 +48,4 @@ python manage.py collectstatic --noinput 2>/dev/null || true
 echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
 echo "  🚀 Starting Daphne on 0.0.0.0:8000"
 echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
-exec daphne -b 0.0.0.0 -p 8000 chatproject.asgi:application
+exec python -m chatproject.server -b 0.0.0.0 -p 8000 chatproject.asgi:application